@@ -9,11 +9,14 @@ import utilities as util
 import pathlib 
 # import simscale_sdk as sim_sdk
 
-pwc = util.PedestrianWindComfort()
+pwc = util.PedestrianWindComfortBatch(max_workers = 4)
 
 """Setup the API connection"""
 pwc.set_api_connection()
 
+#Rerunning this script with the same session skips every stage that already completed
+pwc.use_ledger(session = "pwc_test_bristol")
+
 """Create Project"""
 pwc.create_project("pwc_test_bristol", "123")
 
@@ -24,7 +27,19 @@ pwc.create_project("pwc_test_bristol", "123")
 name_of_files_to_upload = ["AccucitiesBristol"] #AccucitiesBristol
 
 base_path = pathlib.Path().cwd() / "Geometries" 
-geometry_path = pwc.zip_cad_for_upload(name_of_files_to_upload,base_path)
+
+#Uncomment the lines below to crop the CAD models to the wind tunnels of all wind directions before zipping.
+#The moderate and large tunnels are sized by the server, pass extensions (m) at least as large as theirs
+# pwc.base.set_region_of_interest(radius = 250, center = [0,0], ground_height = 5, north_angle = 0, wt_size = 'moderate')
+# wt_extensions = {"side" : 500, "inflow" : 500, "outflow" : 1000}
+# name_of_files_to_upload = [pwc.base.crop_geometry_to_wind_tunnel(cad, base_path, extensions = wt_extensions) 
+#                            for cad in name_of_files_to_upload]
+
+geometry_path = pwc.base.zip_cad_for_upload(name_of_files_to_upload,base_path)
+
+#Check the CAD models locally before uploading them, fails in seconds on bad inputs
+for cad in name_of_files_to_upload:
+    pwc.preflight_geometry(cad, base_path / cad, radius = 250, center = [0,0], ground_height = 5)
 
 #Keys are just a name that is a reference. Values are the layer names that are predefined in the CAD tool
 layers  = {"terrain" : "Terrain", "terrain_patches" : "TerrainPatches",
@@ -32,23 +47,15 @@ layers  = {"terrain" : "Terrain", "terrain_patches" : "TerrainPatches",
             "buidlings" : "Buildings", "extended_terrain" : "ExtendedTerrain"}  
 
 
-entities = []
 num_WD = 8
-#Iterate over the CAD models and run the simulations of each design in parallel
-for i, cad in enumerate(name_of_files_to_upload): 
-    #Upload the list of provided CAD models to the SimScale project
-    
-    pwc.upload_geometry(cad, geometry_path[i])
+
+def setup_simulation(pwc, cad):
+    #Called once for each design, pwc is the PedestrianWindComfort instance of that design
     print(pwc.project_id)
     print(pwc.geometry_id)
     
-    for i , (key, value)in enumerate(layers.items()) :
-        print(value)
-        print(i)
-        entities.append(value)
-        #Get geometry mappings
-        pwc.get_geometry_mapping(pwc.project_id, pwc.geometry_id, 
-                                 entities_list= entities, layer_key = key, layer_number = i)
+    #Get the geometry mappings of all the layers in one request
+    pwc.get_layer_mappings(pwc.project_id, pwc.geometry_id, layers)
         
 
     """Simulation Setup"""
@@ -93,9 +100,21 @@ for i, cad in enumerate(name_of_files_to_upload):
     pwc.set_reynolds_scaling(scaling = 0.1, auto_scale= True) #The value of scaling is used only when auto_scale = False
     pwc.set_mesh_settings()
     
-    """Start Simulation"""
-    pwc.set_simulation_spec(simulation_name= "Pedestrian Wind Comfort 1")
-    pwc.create_simulation()
-    pwc.check_simulation_setup()
-    pwc.estimate_simulation()
-    pwc.start_simulation_run(run_name = "{}WD".format(num_WD))
+    #Instant local prediction from the history of server estimates, silent until there is enough history
+    pwc.predict_cost()
+
+
+"""Start Simulation"""
+#Set up each design in parallel (upload, setup, create, check), then estimate all of them 
+#and start only the designs within the budget
+#Designs whose setup did not change start a new run on their existing simulation
+designs = pwc.run_designs(name_of_files_to_upload, geometry_path, setup_simulation,
+                          simulation_name = "Pedestrian Wind Comfort", 
+                          run_name = "{}WD".format(num_WD), 
+                          reuse_simulations = True, 
+                          max_gpuh = 10, max_total_gpuh = None)
+
+"""Monitor Simulation Runs"""
+#Uncomment to block until all the runs are finished, printing their progress
+# runs = pwc.monitor_runs()
+# result_paths = pwc.download_results()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Test setup: utilities.py is imported from the repository root. The local
+processing under test does not call the SimScale API, so when simscale_sdk,
+isodate or requests are not installed they are replaced by minimal stand-ins
+that only provide what is referenced without a server.
+"""
+
+import sys
+import types
+import pathlib
+import importlib
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+
+class ApiException(Exception):
+
+    #Same attributes as simscale_sdk.ApiException
+    def __init__(self, status=None, reason=None, http_resp=None, headers=None):
+        super().__init__(status, reason)
+        self.status = status
+        self.reason = reason
+        self.body = None
+        self.headers = headers
+
+
+class SdkModel():
+
+    #Stand-in for the generated SDK models: keyword arguments become attributes
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.__dict__.update(kwargs)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.__dict__ == other.__dict__
+
+
+def _sdk_stand_in():
+    module = types.ModuleType("simscale_sdk")
+    module.ApiException = ApiException
+    models = {}
+
+    def __getattr__(name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        if name not in models:
+            models[name] = type(name, (SdkModel,), {})
+        return models[name]
+
+    module.__getattr__ = __getattr__
+    return module
+
+
+for name in ("simscale_sdk", "isodate", "requests"):
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        sys.modules[name] = _sdk_stand_in() if name == "simscale_sdk" else types.ModuleType(name)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of AsyncPedestrianWindComfort with fake API objects
+"""
+
+import asyncio
+
+import pytest
+
+import utilities as util
+from conftest import ApiException
+
+
+class FakeGeometryImport():
+
+    def __init__(self, status, geometry_id = None):
+        self.status = status
+        self.geometry_id = geometry_id
+
+class FakeGeometryImportApi():
+
+    #Rate limited once, then RUNNING until the third poll
+    def __init__(self):
+        self.calls = 0
+
+    def get_geometry_import(self, project_id, geometry_import_id):
+        self.calls += 1
+        if self.calls == 1:
+            raise ApiException(status = 429, headers = {"X-Rate-Limit-Retry-After-Minutes" : "0"})
+        return FakeGeometryImport("FINISHED", "geometry") if self.calls >= 3 else FakeGeometryImport("RUNNING")
+
+
+@pytest.fixture
+def async_pwc(tmp_path):
+    apwc = util.AsyncPedestrianWindComfort()
+    pwc = apwc.pwc
+    pwc.poller = util.Poller(initial_interval = 0.01, max_interval = 0.05, jitter = 0)
+    pwc.lookup_cache = util.LookupCache(tmp_path / "lookup_cache.json")
+    pwc.geometry_import_api = FakeGeometryImportApi()
+    pwc.project_id = "project"
+    pwc.use_ledger("session", tmp_path / "run_ledger.sqlite")
+    return apwc
+
+def test_upload_geometry_waits_on_the_poller_and_records_the_ledger(async_pwc):
+    pwc = async_pwc.pwc
+    imports = []
+    pwc.find_existing_geometry = lambda *args: None
+    pwc.import_geometry = lambda *args: imports.append(args) or "import"
+
+    asyncio.run(async_pwc.upload_geometry("city"))
+    assert pwc.geometry_id == "geometry"
+    assert pwc.geometry_import_api.calls == 3
+    assert pwc.poller.jobs == {}
+    assert pwc._ledger_result("geometry", pwc._geometry_ledger_inputs("city", None)) == {"geometry_id" : "geometry"}
+
+    #The next upload of the same geometry is taken from the ledger
+    pwc._geometry_exists = lambda geometry_id: True
+    pwc.geometry_id = None
+    asyncio.run(async_pwc.upload_geometry("city"))
+    assert pwc.geometry_id == "geometry" and len(imports) == 1
+
+def test_arguments_are_forwarded_and_api_methods_are_awaited(async_pwc):
+    pwc = async_pwc.pwc
+    pwc.estimate_simulation = lambda *args, **kwargs: (args, kwargs)
+    pwc.find_project = lambda name: f"id of {name}"
+
+    assert asyncio.run(async_pwc.estimate_simulation(max_gpuh = 5)) == ((), {"max_gpuh" : 5})
+    assert asyncio.run(async_pwc.find_project("name")) == "id of name"
+    #Local setters stay synchronous
+    assert async_pwc.set_num_wind_directions == pwc.set_num_wind_directions
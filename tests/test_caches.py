@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of the persistent caches shared between threads and processes, two
+instances on the same file stand for two processes
+"""
+
+import time
+import threading
+
+import utilities as util
+
+
+def fetcher(data):
+    #fetch returning data and counting its calls
+    calls = []
+    def fetch():
+        calls.append(data)
+        return data
+    return fetch, calls
+
+
+"""Wind data cache"""
+
+def test_wind_data_cache_rounds_the_location_and_expires(tmp_path):
+    cache = util.WindDataCache(tmp_path / "wind.json", ttl = 0.05)
+    fetch, calls = fetcher({"wind" : 1})
+    assert cache.get(51.4545, -2.5879, fetch) == {"wind" : 1}
+    assert cache.get("51.45", "-2.59", fetch) == {"wind" : 1}
+    assert len(calls) == 1
+    time.sleep(0.06)
+    cache.get(51.45, -2.59, fetch)
+    assert len(calls) == 2
+
+def test_wind_data_cache_evicts_the_least_recently_used(tmp_path):
+    cache = util.WindDataCache(tmp_path / "wind.json", max_entries = 2)
+    for latitude in (1, 2):
+        cache.get(latitude, 0, fetcher(latitude)[0])
+    cache.get(1, 0, fetcher(None)[0])
+    cache.get(3, 0, fetcher(3)[0])
+    assert list(util.WindDataCache(tmp_path / "wind.json")._load()) == ["1.0,0.0", "3.0,0.0"]
+
+def test_wind_data_cache_fetches_a_location_once_for_concurrent_callers(tmp_path):
+    cache = util.WindDataCache(tmp_path / "wind.json")
+    release, calls = threading.Event(), []
+    def fetch():
+        calls.append(1)
+        release.wait(timeout = 5)
+        return "wind"
+    results = []
+    threads = [threading.Thread(target = lambda: results.append(cache.get(1, 2, fetch))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(timeout = 5)
+    assert results == ["wind"] * 4 and len(calls) == 1
+
+def test_wind_data_cache_processes_keep_each_others_entries(tmp_path):
+    first, second = (util.WindDataCache(tmp_path / "wind.json") for _ in range(2))
+    first.get(1, 0, fetcher("first")[0])
+    second.get(2, 0, fetcher("second")[0])
+    #The location fetched by the second process is read from the file instead of fetched again
+    fetch, calls = fetcher("again")
+    assert first.get(2, 0, fetch) == "second" and calls == []
+    assert set(util.WindDataCache(tmp_path / "wind.json")._load()) == {"1.0,0.0", "2.0,0.0"}
+
+
+"""Lookup cache"""
+
+def test_lookup_cache_downloads_an_index_once_until_it_expires(tmp_path):
+    cache = util.LookupCache(tmp_path / "lookup.json", ttl = 0.05)
+    fetch, calls = fetcher({"project" : "id"})
+    assert cache.lookup("projects", "project", fetch) == "id"
+    assert cache.lookup("projects", "other", fetch) is None
+    assert len(calls) == 1
+    time.sleep(0.06)
+    cache.lookup("projects", "project", fetch)
+    assert len(calls) == 2
+
+def test_lookup_cache_merges_the_changes_of_two_processes(tmp_path):
+    first, second = (util.LookupCache(tmp_path / "lookup.json") for _ in range(2))
+    index = {"a" : 1, "b" : 2}
+    first.get_index("projects", fetcher(index)[0])
+    second.get_index("projects", fetcher(index)[0])
+    first.add("projects", "c", 3)
+    second.remove("projects", "a")
+    second.add("projects", "d", 4)
+    #Adding to a scope that is not cached does nothing
+    first.add("geometries", "e", 5)
+    
+    merged = util.LookupCache(tmp_path / "lookup.json")
+    assert merged.get_index("projects", fetcher(None)[0]) == {"b" : 2, "c" : 3, "d" : 4}
+    assert "geometries" not in merged.entries
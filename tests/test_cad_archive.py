@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of the CAD archives built for the upload
+"""
+
+import os
+import types
+import zipfile
+
+import pytest
+
+import utilities as util
+
+
+@pytest.fixture
+def cad(tmp_path):
+    cad = tmp_path / "cad"
+    (cad / "layers").mkdir(parents = True)
+    (cad / "model.stl").write_bytes(b"solid model\n" * 100)
+    (cad / "layers" / "terrain.stl").write_bytes(b"solid terrain\n" * 100)
+    (cad / "texture.png").write_bytes(os.urandom(256))
+    return cad
+
+def test_archive_is_only_rebuilt_when_a_source_changes(cad, tmp_path):
+    output = tmp_path / "cad.zip"
+    assert util.build_cad_archive(cad, output) is True
+    assert util.build_cad_archive(cad, output) is False
+    with zipfile.ZipFile(output) as archive:
+        assert archive.namelist() == ["layers/terrain.stl", "model.stl", "texture.png"]
+        assert archive.getinfo("texture.png").compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo("model.stl").compress_type == zipfile.ZIP_DEFLATED
+
+    (cad / "model.stl").write_bytes(b"solid changed\n")
+    assert util.build_cad_archive(cad, output) is True
+    #Other compression settings give another archive
+    assert util.build_cad_archive(cad, output, dict(util.ARCHIVE_COMPRESSION, default = (zipfile.ZIP_STORED, None)))
+
+
+class FakeStoragePool():
+
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, url, body, headers, retries):
+        self.requests.append((headers, b"".join(body)))
+        return types.SimpleNamespace(status = 200, data = b"")
+
+@pytest.fixture
+def pwc(tmp_path):
+    pwc = util.PedestrianWindComfort()
+    pwc.cache_dir = tmp_path / "cache"
+    pwc.storage_api = types.SimpleNamespace(
+        create_storage = lambda: types.SimpleNamespace(url = "url", storage_id = "storage"))
+    pwc.storage_pool = FakeStoragePool()
+    return pwc
+
+def test_directory_upload_sends_the_archive_with_its_exact_length(pwc, cad):
+    assert pwc.upload_file_to_storage(cad, chunk_size = 100) == "storage"
+    headers, body = pwc.storage_pool.requests[0]
+    archive = pwc.cad_archive_for_upload(cad)
+    assert body == archive.read_bytes()
+    assert headers["Content-Length"] == str(len(body))
+
+    #The fingerprint reads the same archive and matches the one of a zip of the directory
+    zipped = cad.parent / "cad.zip"
+    util.build_cad_archive(cad, zipped)
+    assert pwc.fingerprint_geometry(cad) == pwc.fingerprint_geometry(zipped)
+    assert list((pwc.cache_dir / "archives").iterdir()) == [archive]
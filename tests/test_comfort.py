@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of the local comfort statistics against hand computed fields
+"""
+
+import numpy as np
+import pytest
+
+import utilities as util
+
+
+#One direction, reference speed uniform on [0, 20] m/s: P(U > u) = 1 - u / 20 for u <= 20
+UNIFORM_WIND_ROSE = {"velocityBuckets" : [{"from" : None, "to" : 10, "fractions" : [0.5]},
+                                          {"from" : 10, "to" : 20, "fractions" : [0.5]}]}
+
+def exceedance(ratio, speed):
+    #Hand computed probability that the local speed ratio * U exceeds speed
+    if ratio == 0:
+        return 0.0
+    return max(0.0, 1 - speed / ratio / 20)
+
+@pytest.mark.parametrize("criterion, ratios, comfort, safety", [
+    #NEN8100: P(> 5 m/s) below 2.5 %, 5 %, 10 %, 20 % gives A - D, else E
+    ("NEN8100", [0, 5 / 19.6, 5 / 19.2, 5 / 18.4, 5 / 17, 5 / 14, 1.0],
+     ["A", "A", "B", "C", "D", "E", "E"],
+     ["No risk"] * 6 + ["Dangerous"]),
+    #City of London: first of 2.5, 4, 6, 8 m/s exceeded at most 5 % of the time
+    ("LAWSON_CITY_OF_LONDON", [0.1, 0.2, 0.25, 0.35, 0.5, 1.0],
+     ["Frequent sitting", "Occasional sitting", "Standing", "Walking", "Uncomfortable", "Uncomfortable"],
+     ["Safe"] * 5 + ["Unsafe for frail persons"]),
+    #LDDC: first of 4, 6, 8, 10 m/s exceeded at most 5 % of the time
+    ("LAWSON_LDDC", [0.15, 0.25, 0.35, 0.45, 0.6, 1.2],
+     ["Sitting", "Standing", "Strolling", "Business walking", "Uncomfortable", "Uncomfortable"],
+     ["Safe"] * 5 + ["Unsafe for all"]),
+])
+def test_comfort_classes_of_hand_computed_field(criterion, ratios, comfort, safety):
+    stats = util.comfort_statistics(np.array(ratios)[:, None], UNIFORM_WIND_ROSE, criterion)
+
+    assert [stats["comfort_labels"][i] for i in stats["comfort_class"]] == comfort
+    assert [stats["safety_labels"][i] for i in stats["safety_class"]] == safety
+    expected = [[exceedance(ratio, speed) for speed in stats["thresholds"]] for ratio in ratios]
+    np.testing.assert_allclose(stats["exceedance"], expected, atol = 1e-6)
+
+def test_exceedance_sums_directions_with_their_frequencies():
+    #Two directions with 30 % and 70 % of the time, only the second one is windy at the point
+    wind_rose = {"velocityBuckets" : [{"from" : None, "to" : 10, "fractions" : [0.3, 0.7]}]}
+    knots, survival = util.wind_rose_survival(wind_rose)
+    probability = util.exceedance_probability(np.array([[0.0, 1.0]]), [5.0], knots, survival)
+    np.testing.assert_allclose(probability, [[0.7 * 0.5]])
+
+def test_chunked_evaluation_matches_unchunked():
+    rng = np.random.default_rng(0)
+    ratios = rng.uniform(0, 1.5, (1000, 8))
+    fractions = rng.uniform(0, 1, (4, 8))
+    bounds = [None, 2.0, 5.0, 10.0, None]
+    wind_rose = {"velocityBuckets" : [{"from" : bounds[i], "to" : bounds[i + 1], "fractions" : fractions[i].tolist()}
+                                      for i in range(4)]}
+
+    for criterion in util.COMFORT_CRITERIA:
+        whole = util.comfort_statistics(ratios, wind_rose, criterion, chunk_size = len(ratios))
+        chunked = util.comfort_statistics(ratios, wind_rose, criterion, chunk_size = 7)
+        for key in ("exceedance", "comfort_class", "safety_class"):
+            np.testing.assert_array_equal(whole[key], chunked[key])
+
+def test_velocity_ratio_directions_must_match_the_wind_rose():
+    with pytest.raises(Exception):
+        util.comfort_statistics(np.ones((3, 2)), UNIFORM_WIND_ROSE, "NEN8100")
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of the connection pool metrics, no connection is opened
+"""
+
+import types
+
+import urllib3
+
+import utilities as util
+
+
+def test_pool_metrics_use_the_public_counters():
+    pwc = util.PedestrianWindComfort()
+    pwc.storage_pool = urllib3.PoolManager(maxsize = pwc.storage_pool_size)
+    pwc.storage_pool.connection_from_url("https://storage.example.com/upload")
+    metrics = pwc.get_pool_metrics()
+    assert metrics == {("storage", "https://storage.example.com:443") :
+                       {"maxsize" : pwc.storage_pool_size, "created" : 0, "requests" : 0}}
+
+def test_pool_metrics_without_counters_are_partial():
+    pwc = util.PedestrianWindComfort()
+    pool = types.SimpleNamespace(scheme = "https", host = "api.example.com", port = 443)
+    pwc.api_client = types.SimpleNamespace(rest_client = types.SimpleNamespace(
+        pool_manager = types.SimpleNamespace(pools = {"key" : pool})))
+    assert pwc.get_pool_metrics() == {("api", "https://api.example.com:443") : {"maxsize" : pwc.api_pool_size}}
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of the local surrogate cost model on synthetic estimate histories
+"""
+
+import itertools
+
+import pytest
+
+import utilities as util
+
+
+def features(radius, fineness, directions, triangles = 10 ** 5, scaling = None):
+    return {"roi_radius" : radius, "mesh_fineness" : fineness, "num_wind_directions" : directions,
+            "triangle_count" : triangles, "reynolds_scaling" : scaling}
+
+def estimate(features):
+    #Power law in the radius and the number of directions, doubling per fineness level
+    level = util.CostModel.FINENESS_LEVELS[features["mesh_fineness"]]
+    cells = 1e3 * features["roi_radius"] ** 2 * 2.0 ** level
+    gpuh = 1e-6 * cells * features["num_wind_directions"]
+    value = lambda x: {"value" : x}
+    return {"available" : True, "cell_count" : value(cells), "compute_resource" : value(gpuh),
+            "duration" : value(3600 * gpuh)}
+
+@pytest.fixture
+def history(tmp_path):
+    model = util.CostModel(tmp_path / "cost_history.jsonl")
+    for radius, fineness, directions in itertools.product([100, 200, 400], ["Coarse", "Moderate", "Fine"], [4, 8, 16]):
+        sample = features(radius, fineness, directions)
+        model.add(sample, estimate(sample))
+    return tmp_path / "cost_history.jsonl"
+
+def test_prediction_follows_the_history(history):
+    #A new instance reads the history file
+    model = util.CostModel(history)
+    target = features(300, "Moderate", 12)
+    prediction = model.predict(target)
+    for key, expected in estimate(target).items():
+        if key != "available":
+            assert prediction[key] == pytest.approx(expected["value"], rel = 0.05)
+
+def test_unsupported_setups_and_short_histories_are_not_predicted(tmp_path, history):
+    model = util.CostModel(history)
+    assert model.predict(features(300, "TargetSize", 8)) is None
+    assert model.predict(features(300, "Moderate", 8, scaling = 0)) is None
+
+    short = util.CostModel(tmp_path / "short.jsonl", min_samples = 3)
+    short.add(features(100, "Coarse", 4), estimate(features(100, "Coarse", 4)))
+    #Estimates that are not available or incomplete are not recorded
+    short.add(features(200, "Coarse", 4), {"available" : False})
+    short.add(features(200, "Coarse", 4), dict(estimate(features(200, "Coarse", 4)), duration = None))
+    assert len(short._load()) == 1
+    assert short.predict(features(100, "Coarse", 4)) is None
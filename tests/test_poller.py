@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of the Poller with fake job callables
+"""
+
+import time
+import threading
+
+import pytest
+
+import utilities as util
+from conftest import ApiException
+
+
+def fast_poller(**kwargs):
+    return util.Poller(initial_interval = 0.01, max_interval = 0.05, jitter = 0, **kwargs)
+
+def counter(done_after, state = "RUNNING"):
+    #fetch returning state until it was called done_after times, then FINISHED
+    calls = {"count" : 0}
+    def fetch():
+        calls["count"] += 1
+        return "FINISHED" if calls["count"] >= done_after else state
+    return fetch, calls
+
+def is_finished(state):
+    return state == "FINISHED"
+
+
+def test_wait_returns_the_last_state_of_every_job():
+    poller = fast_poller()
+    for key, done_after in (("a", 1), ("b", 3)):
+        poller.add_job(key, counter(done_after)[0], is_finished)
+    assert poller.wait() == {"a" : "FINISHED", "b" : "FINISHED"}
+    assert poller.jobs == {}
+
+def test_duplicate_key_is_rejected():
+    poller = fast_poller()
+    poller.add_job("a", counter(1)[0], is_finished)
+    with pytest.raises(Exception):
+        poller.add_job("a", counter(1)[0], is_finished)
+
+def test_failing_callback_ends_only_its_job():
+    poller = fast_poller()
+    def on_update(state):
+        raise ValueError("callback")
+    poller.add_job("bad", counter(1)[0], is_finished, on_update = on_update)
+    poller.add_job("good", counter(2)[0], is_finished)
+    states, errors = poller.wait_all()
+    assert states == {"good" : "FINISHED"}
+    assert isinstance(errors["bad"], ValueError)
+
+def test_fetch_error_and_timeout_are_reported_per_job():
+    poller = fast_poller()
+    def fail():
+        raise ApiException(status = 500)
+    poller.add_job("error", fail, is_finished)
+    poller.add_job("slow", counter(10 ** 6)[0], is_finished, timeout = 0.05)
+    poller.add_job("ok", counter(1)[0], is_finished)
+    states, errors = poller.wait_all()
+    assert states == {"ok" : "FINISHED"}
+    assert errors["error"].status == 500
+    assert isinstance(errors["slow"], TimeoutError)
+    with pytest.raises(ApiException):
+        poller.add_job("error", fail, is_finished)
+        poller.wait(["error"])
+
+def test_rate_limit_pauses_every_job():
+    poller = fast_poller()
+    calls = []
+    def limited():
+        calls.append("limited")
+        raise ApiException(status = 429, headers = {"X-Rate-Limit-Retry-After-Minutes" : "1"})
+    poller.add_job("limited", limited, is_finished)
+    poller.add_job("other", lambda: calls.append("other") or "RUNNING", is_finished)
+    next_poll = poller.poll_once()
+    assert calls == ["limited"]
+    assert next_poll >= time.time() + 50
+    assert all(job["next_poll"] >= time.time() + 50 for job in poller.jobs.values())
+
+def test_waiter_sees_a_finished_job_without_waiting_for_the_driver():
+    poller = util.Poller(initial_interval = 0.01, max_interval = 30, jitter = 0)
+    poller.add_job("quick", counter(3)[0], is_finished, interval = lambda state: 0.01)
+    #The driver waits for the slow job, which is only polled every 30 s
+    poller.add_job("slow", lambda: "RUNNING", is_finished, interval = lambda state: 30)
+    driver = threading.Thread(target = poller.wait_all, args = (["slow"],), daemon = True)
+    driver.start()
+    while not poller._driving:
+        time.sleep(0.001)
+
+    started = time.time()
+    assert poller.wait(["quick"]) == {"quick" : "FINISHED"}
+    assert time.time() - started < 5
+
+def test_collected_and_unknown_keys_end_with_a_key_error():
+    poller = fast_poller()
+    poller.add_job("a", counter(1)[0], is_finished)
+    assert poller.wait(["a"]) == {"a" : "FINISHED"}
+    states, errors = poller.wait_all(["a", "b"])
+    assert states == {}
+    assert set(errors) == {"a", "b"} and all(isinstance(error, KeyError) for error in errors.values())
+
+def test_overlapping_waits_from_two_threads():
+    poller = fast_poller()
+    poller.add_job("shared", counter(5)[0], is_finished)
+    poller.add_job("own", counter(2)[0], is_finished)
+    results = {}
+    def wait(name, keys):
+        results[name] = poller.wait_all(keys)
+    threads = [threading.Thread(target = wait, args = ("first", ["shared", "own"])),
+               threading.Thread(target = wait, args = ("second", ["shared"]))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout = 5)
+    assert results["first"] == ({"shared" : "FINISHED", "own" : "FINISHED"}, {})
+    assert results["second"] == ({"shared" : "FINISHED"}, {})
+    assert poller.jobs == {}
+
+
+class FakeRun():
+    
+    def __init__(self, status, progress = None):
+        self.status = status
+        self.progress = progress
+
+class FakeSimulationRunsApi():
+    
+    #Every run goes through QUEUED, RUNNING and then FINISHED
+    def __init__(self):
+        self.calls = {}
+        
+    def get_simulation_run(self, project_id, simulation_id, run_id):
+        count = self.calls[run_id] = self.calls.get(run_id, 0) + 1
+        return [FakeRun("QUEUED"), FakeRun("RUNNING", 50.0)][count - 1] if count < 3 else FakeRun("FINISHED", 100.0)
+
+def test_run_monitor_waits_again_for_the_new_runs_only():
+    api = FakeSimulationRunsApi()
+    events = []
+    monitor = util.RunMonitor(poller = fast_poller(), on_event = events.append)
+    first = monitor.track(api, "project", "simulation", "run 1")
+    assert set(monitor.wait()) == {first}
+    
+    second = monitor.track(api, "project", "simulation", "run 2")
+    runs = monitor.wait()
+    assert set(runs) == {second} and runs[second].status == "FINISHED"
+    assert monitor.wait() == {}
+    assert [event["status"] for event in events if event["key"] == second] == ["QUEUED", "RUNNING", "FINISHED"]
+    
+    #A collected run can be tracked again, a pending one cannot
+    monitor.track(api, "project", "simulation", "run 1")
+    with pytest.raises(Exception):
+        monitor.track(api, "project", "simulation", "run 1")
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of the run ledger and of the resume of the pipeline stages from it
+"""
+
+import types
+
+import pytest
+
+import utilities as util
+from conftest import ApiException
+
+
+def test_ledger_records_survive_a_new_connection(tmp_path):
+    ledger = util.RunLedger(tmp_path / "ledger.sqlite")
+    inputs = util.RunLedger.hash_inputs("project", ("host", "name"))
+    ledger.record("session", "project", inputs, {"project_id" : "p1"})
+    ledger.record("session", "project", inputs, {"project_id" : "p2"})
+    ledger.record("other", "project", inputs, {"project_id" : "p3"})
+    ledger.close()
+
+    ledger = util.RunLedger(tmp_path / "ledger.sqlite")
+    assert ledger.get("session", "project", inputs) == {"project_id" : "p2"}
+    assert [stage for stage, _, _ in ledger.history("session")] == ["project"]
+    ledger.forget("session", "project")
+    assert ledger.get("session", "project", inputs) is None
+    assert ledger.get("other", "project", inputs) == {"project_id" : "p3"}
+
+def test_inputs_hash_depends_on_every_input():
+    assert util.RunLedger.hash_inputs("a", (1, 2)) == util.RunLedger.hash_inputs("a", [1, 2])
+    assert util.RunLedger.hash_inputs("a", (1, 2)) != util.RunLedger.hash_inputs("a", (2, 1))
+
+
+class FakeProjectApi():
+
+    def __init__(self, existing):
+        self.existing = set(existing)
+        self.created = []
+
+    def get_project(self, project_id):
+        if project_id not in self.existing:
+            raise ApiException(status = 404)
+
+    def create_project(self, project):
+        project_id = f"new{len(self.created)}"
+        self.created.append(project_id)
+        self.existing.add(project_id)
+        return types.SimpleNamespace(project_id = project_id)
+
+@pytest.fixture
+def pwc(tmp_path):
+    pwc = util.PedestrianWindComfort()
+    pwc.lookup_cache = util.LookupCache(tmp_path / "lookup.json")
+    pwc.find_project = lambda name: None
+    pwc.use_ledger("session", tmp_path / "ledger.sqlite")
+    return pwc
+
+@pytest.mark.parametrize("deleted", [False, True])
+def test_project_from_the_ledger_is_checked(pwc, deleted):
+    pwc.project_api = FakeProjectApi(existing = [] if deleted else ["p1"])
+    pwc._ledger_record("project", (pwc.host, "name"), {"project_id" : "p1"})
+
+    pwc.create_project("name", "description")
+    assert pwc.project_id == ("new0" if deleted else "p1")
+    assert pwc._ledger_result("project", (pwc.host, "name")) == {"project_id" : pwc.project_id}
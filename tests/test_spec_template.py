@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of the copy-on-write forks of SimulationSpecTemplate, the parts are
+simple stand-ins for the SDK objects
+"""
+
+import types
+
+import pytest
+
+import utilities as util
+
+
+@pytest.fixture
+def template():
+    parts = {name : types.SimpleNamespace(part = name) for name in util.SimulationSpecTemplate.PARTS}
+    parts.update(
+        name = "PWC", geometry_id = "geometry", pedestrian_comfort_map = [types.SimpleNamespace(height = 1.5)],
+        mesh_settings = types.SimpleNamespace(wind_comfort_fineness = util.mesh_fineness_model("Moderate"),
+                                              reynolds_scaling_type = None),
+        wind_rose = types.SimpleNamespace(num_directions = 8, exposure_categories = ["EC3"] * 8,
+                                          wind_data_source = "METEOBLUE", wind_engineering_standard = "EU"))
+    return util.SimulationSpecTemplate(**parts)
+
+def test_fork_copies_only_the_touched_parts(template):
+    fork = template.with_(name = "Fine", mesh_fineness = "Fine", num_wind_directions = 16)
+    assert (fork.name, template.name) == ("Fine", "PWC")
+
+    assert fork.mesh_settings is not template.mesh_settings
+    assert util._mesh_fineness_name(fork.mesh_settings.wind_comfort_fineness) == "Fine"
+    assert util._mesh_fineness_name(template.mesh_settings.wind_comfort_fineness) == "Moderate"
+    assert fork.wind_rose.num_directions == 16 and fork.wind_rose.exposure_categories == ["EC3"] * 16
+    assert template.wind_rose.num_directions == 8
+
+    #Untouched parts are shared, the comfort maps are frozen into a tuple
+    for name in ("region_of_interest", "simulation_control", "geographical_location", "pedestrian_comfort_map"):
+        assert getattr(fork, name) is getattr(template, name)
+    assert isinstance(template.pedestrian_comfort_map, tuple)
+
+def test_template_is_immutable_and_checks_its_overrides(template):
+    with pytest.raises(AttributeError):
+        template.name = "other"
+    with pytest.raises(Exception):
+        template.with_(unknown_setting = 1)
+    with pytest.raises(Exception, match = "exposure category"):
+        template.with_(exposure_categories = ["EC1"] * 4)
+
+    uploaded = template.with_(wind_rose = types.SimpleNamespace(
+        num_directions = 8, exposure_categories = ["EC3"] * 8, wind_data_source = "USER_UPLOAD"))
+    with pytest.raises(Exception, match = "set_wind_records"):
+        uploaded.with_(num_wind_directions = 16)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of the local STL readers, preflight statistics and cropping
+"""
+
+import numpy as np
+import pytest
+
+import utilities as util
+
+
+def binary_stl(vertices, header = b"binary"):
+    facets = np.zeros(len(vertices), dtype = util.STL_BINARY_DTYPE)
+    facets["vertices"] = vertices
+    return header.ljust(80, b" ") + np.array([len(facets)], dtype = "<u4").tobytes() + facets.tobytes()
+
+def ascii_stl(solids, newline = "\n"):
+    lines = []
+    for name, vertices in solids:
+        lines.append(f"solid {name}")
+        for facet in vertices:
+            lines += ["facet normal 0 0 1", " outer loop"]
+            lines += ["  vertex {:g} {:g} {:g}".format(*vertex) for vertex in facet]
+            lines += [" endloop", "endfacet"]
+        lines.append(f"endsolid {name}")
+    return newline.join(lines).encode()
+
+TRIANGLES = np.arange(2 * 9, dtype = np.float64).reshape(2, 3, 3)
+
+def test_read_empty_binary_stl(tmp_path):
+    path = tmp_path / "empty.stl"
+    path.write_bytes(binary_stl(np.zeros((0, 3, 3))))
+    triangles, solid_index, solid_names = util.read_stl(path)
+    assert triangles.shape == (0, 3, 3) and len(solid_index) == 0
+    assert util.analyze_stl(triangles, solid_index, solid_names)["triangle_count"] == 0
+
+def test_binary_stl_with_solid_header_is_read_as_binary(tmp_path):
+    path = tmp_path / "model.stl"
+    path.write_bytes(binary_stl(TRIANGLES, header = b"solid model"))
+    triangles, _, solid_names = util.read_stl(path)
+    np.testing.assert_array_equal(triangles, TRIANGLES)
+    assert solid_names == ["model"]
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+def test_read_ascii_stl_with_several_solids(tmp_path, newline):
+    path = tmp_path / "city.stl"
+    path.write_bytes(ascii_stl([("Buildings", TRIANGLES), ("Terrain", TRIANGLES[:1] + 100)], newline))
+    triangles, solid_index, solid_names = util.read_stl(path)
+    assert solid_names == ["Buildings", "Terrain"]
+    np.testing.assert_array_equal(solid_index, [0, 0, 1])
+    np.testing.assert_array_equal(triangles, np.concatenate([TRIANGLES, TRIANGLES[:1] + 100]))
+
+def test_streamed_ascii_stl_matches_read_stl(tmp_path):
+    path = tmp_path / "city.stl"
+    path.write_bytes(ascii_stl([("Buildings", TRIANGLES), ("Terrain", TRIANGLES + 100)]))
+    #Tiny reads split lines and solid headers across chunks
+    batches = list(util.iter_ascii_stl(path, batch_size = 1, read_size = 7))
+    assert [name for name, _ in batches] == ["Buildings"] * 2 + ["Terrain"] * 2
+    triangles, _, _ = util.read_stl(path)
+    np.testing.assert_array_equal(np.concatenate([vertices for _, vertices in batches]), triangles)
+
+def test_analyze_stl_counts_duplicates_and_degenerate_facets():
+    triangles = np.array([[[0, 0, 0], [1, 0, 0], [0, 1, 0]],
+                          [[1, 0, 0], [0, 1, 0], [-0.0, 0, 0]],   # same facet, other order and -0.0
+                          [[0, 0, 0], [0, 0, 0], [0, 1, 0]]], dtype = np.float64)
+    stats = util.analyze_stl(triangles, np.zeros(3, dtype = np.intp), ["solid"])
+    assert stats["duplicate_count"] == 1
+    assert stats["degenerate_count"] == 1
+    assert stats["area"] == pytest.approx(1.0)
+
+def test_solid_starts_skips_endsolid_and_longer_words():
+    data = b"solid a\nendsolid a\n  solid\tb\nsolidity\n\tsolid\n"
+    assert util._solid_starts(data) == [0, 19, 38]
+
+def test_read_directory_of_binary_and_ascii_files(tmp_path):
+    (tmp_path / "b").mkdir()
+    (tmp_path / "a.stl").write_bytes(binary_stl(TRIANGLES))
+    (tmp_path / "b" / "c.STL").write_bytes(ascii_stl([("Terrain", TRIANGLES[:1])], "\r\n"))
+    (tmp_path / "notes.txt").write_text("solid not an stl")
+    triangles, solid_index, solid_names = util.read_stl(tmp_path)
+    assert solid_names == ["a", "Terrain"]
+    np.testing.assert_array_equal(solid_index, [0, 0, 1])
+    assert triangles.dtype == np.float64
+    np.testing.assert_array_equal(triangles, np.concatenate([TRIANGLES, TRIANGLES[:1]]))
+
+def test_streamed_ascii_stl_does_not_split_on_endsolid_or_names(tmp_path):
+    path = tmp_path / "city.stl"
+    data = ascii_stl([("solidity tower", TRIANGLES), ("Terrain", TRIANGLES[:1])])
+    path.write_bytes(data.replace(b"solid Terrain", b"  \tsolid Terrain"))
+    batches = list(util.iter_ascii_stl(path, read_size = 5))
+    assert [name for name, _ in batches] == ["solidity tower", "Terrain"]
+    np.testing.assert_array_equal(batches[0][1], TRIANGLES)
+
+def test_crop_binary_stl_keeps_header_and_records(tmp_path):
+    path = tmp_path / "model.stl"
+    far = TRIANGLES + 1000
+    path.write_bytes(binary_stl(np.concatenate([TRIANGLES, far]), header = b"solid Buildings"))
+    output_path = tmp_path / "cropped.stl"
+    kept, total = util.crop_stl(path, output_path, center = [0, 0], half_length = 50, half_width = 50,
+                                angles = [0, 90])
+    assert (kept, total) == (2, 4)
+    assert output_path.read_bytes() == binary_stl(TRIANGLES, header = b"solid Buildings")
+
+def test_footprint_needs_the_extensions_of_server_sized_tunnels():
+    pwc = util.PedestrianWindComfort()
+    pwc.roi_radius, pwc.center, pwc.north_angle = 100, [10, 20, 0], 0
+    pwc.wind_tunnel_size = "moderate"
+    with pytest.raises(Exception, match = "extensions"):
+        pwc.get_wind_tunnel_footprint(4)
+    footprint = pwc.get_wind_tunnel_footprint(4, extensions = {"side" : 50, "inflow" : 100, "outflow" : 300})
+    assert footprint == {"center" : [10, 20], "half_length" : 400, "half_width" : 150, 
+                         "angles" : util.model_wind_angles(0, 4)}
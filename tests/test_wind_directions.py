@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of the planning and bookkeeping of incremental wind direction runs
+"""
+
+import types
+
+import pytest
+
+import utilities as util
+from conftest import ApiException
+
+
+@pytest.mark.parametrize("num_directions, missing, runs", [
+    (8, [], []),
+    #8 -> 16 directions: the new ones are every other direction
+    (16, range(1, 16, 2), [(1, 8)]),
+    (16, range(16), [(0, 16)]),
+    #A single direction cannot be run alone, so everything is run again
+    (8, [0], [(0, 8)]),
+    (12, [0, 6], [(0, 2)]),
+    #12 -> 36 directions: two rotated runs of 12
+    (36, [i for i in range(36) if i % 3], [(1, 12), (2, 12)]),
+    #Not evenly spaced
+    (8, [0, 1], [(0, 8)]),
+])
+def test_plan_wind_direction_runs(num_directions, missing, runs):
+    assert util.plan_wind_direction_runs(num_directions, missing) == runs
+
+def test_wind_direction_angles_are_normalized():
+    assert util.wind_direction_angles(4, 100) == [100.0, 190.0, 280.0, 10.0]
+    assert util.model_wind_angles(350, 4) == [350.0, 80.0, 170.0, 260.0]
+
+
+class FakeSimulationRunsApi():
+
+    def __init__(self, start_error = None):
+        self.start_error = start_error
+
+    def create_simulation_run(self, project_id, simulation_id, simulation_run):
+        return types.SimpleNamespace(run_id = "run")
+
+    def start_simulation_run(self, project_id, simulation_id, run_id):
+        if self.start_error is not None:
+            raise self.start_error
+
+    def get_simulation_run(self, project_id, simulation_id, run_id):
+        return types.SimpleNamespace(run_id = run_id, status = "QUEUED")
+
+@pytest.fixture
+def pwc(tmp_path):
+    pwc = util.PedestrianWindComfort()
+    pwc.flow_run_cache = util.LookupCache(tmp_path / "flow_runs.json", ttl = None)
+    pwc.direction_cache = util.LookupCache(tmp_path / "wind_directions.json", ttl = None)
+    pwc.project_id, pwc.simulation_id = "project", "simulation"
+    pwc.api_client = types.SimpleNamespace(sanitize_for_serialization = lambda simulation_spec: 
+                                           {"model" : {"windConditions" : {"windRose" : {"numDirections" : 4}}}})
+    wind_rose = types.SimpleNamespace(num_directions = 4, exposure_categories = ["EC2"] * 4)
+    pwc.simulation_spec = types.SimpleNamespace(
+        geometry_id = "geometry", model = types.SimpleNamespace(wind_conditions = types.SimpleNamespace(wind_rose = wind_rose)))
+    return pwc
+
+def test_directions_of_a_run_are_registered_once_it_started(pwc):
+    pwc.simulation_run_api = FakeSimulationRunsApi(start_error = ApiException(status = 400))
+    with pytest.raises(ApiException):
+        pwc.start_simulation_run("Run 1")
+    assert pwc._known_wind_directions(pwc.simulation_spec, check_runs = False) == {}
+    assert pwc.find_flow_run() is None
+
+    pwc.simulation_run_api = FakeSimulationRunsApi()
+    pwc.start_simulation_run("Run 1")
+    directions = pwc._known_wind_directions(pwc.simulation_spec, check_runs = False)
+    assert directions == {key : ["simulation", "run", column, "EC2"] 
+                          for column, key in enumerate(["0", "90", "180", "270"])}
+    assert pwc.find_flow_run() == ("simulation", "run")
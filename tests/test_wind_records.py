@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of the binning of raw wind records into a wind rose
+"""
+
+import numpy as np
+import pytest
+
+import utilities as util
+
+
+def test_filter_wind_records():
+    speed = np.array([np.nan, -1, 80, 0.2, 5, 6])
+    direction = np.array([10, 10, 10, 10, 400, 90])
+    kept_speed, kept_direction, qa = util.filter_wind_records(speed, direction, keep_calms = False)
+    assert qa == {"missing" : 1, "out_of_range" : 3, "flagged" : 0, "calms" : 1, "kept" : 1}
+    np.testing.assert_array_equal(kept_speed, [6])
+
+def test_wind_rose_histogram_sector_and_bucket_edges():
+    #Sectors of 4 directions are centred on 0, 90, 180 and 270 degrees
+    speed = np.array([1.0, 5.0, 5.0, 12.0, np.nan])
+    direction = np.array([359.0, 44.9, 45.0, 180.0, 0.0])
+    counts = util.wind_rose_histogram(speed, direction, 4, [5.0, 10.0])
+    np.testing.assert_array_equal(counts, [[1, 0, 0, 0],
+                                           [1, 1, 0, 0],
+                                           [0, 0, 1, 0]])
+
+
+def read_records(path, **kwargs):
+    chunks = list(util.iter_wind_record_chunks(path, **kwargs))
+    assert chunks[-1][3] == pytest.approx(1.0)
+    return [np.concatenate([chunk[i] for chunk in chunks]) for i in range(2)]
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+def test_csv_records_with_empty_fields_and_blank_lines(tmp_path, newline):
+    path = tmp_path / "wind.csv"
+    rows = ["time, speed ,direction", "1,3.5,90", "", "2,,180", "3,4.0,", "", "4,5,270"]
+    path.write_bytes(newline.join(rows).encode())
+    speed, direction = read_records(path)
+    np.testing.assert_array_equal(speed, [3.5, np.nan, 4.0, 5.0])
+    np.testing.assert_array_equal(direction, [90, 180, np.nan, 270])
+
+def test_csv_chunks_split_inside_lines(tmp_path):
+    path = tmp_path / "wind.csv"
+    rng = np.random.default_rng(1)
+    speed, direction = rng.uniform(0, 20, 500).round(2), rng.uniform(0, 360, 500).round(1)
+    path.write_text("speed,direction\n" + "\n".join(f"{s},{d}" for s, d in zip(speed, direction)) + "\n")
+    read_speed, read_direction = read_records(path, chunk_size = 13)
+    np.testing.assert_array_equal(read_speed, speed)
+    np.testing.assert_array_equal(read_direction, direction)
+
+
+@pytest.fixture
+def pwc():
+    pwc = util.PedestrianWindComfort()
+    pwc.set_num_wind_directions(4)
+    pwc.set_velocity_buckets([5.0, 10.0])
+    return pwc
+
+def test_wind_records_keep_the_bucket_edges_they_were_binned_with(pwc):
+    records = {"speed" : np.array([1.0, 5.0, 12.0]), "direction" : np.array([0.0, 90.0, 180.0])}
+    assert pwc.set_wind_records(records)["kept"] == 3
+    np.testing.assert_array_equal(pwc.wind_record_counts, [[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0]])
+    assert pwc.wind_record_edges == [5.0, 10.0]
+
+    #Changing the buckets afterwards must not pair the counts with the new edges
+    pwc.set_wind_data_source("USER_UPLOAD")
+    pwc.set_velocity_buckets([3.0])
+    with pytest.raises(Exception, match = "velocity buckets"):
+        pwc.set_wind_rose()
+
+def test_wind_records_without_kept_records_are_rejected(pwc):
+    records = {"speed" : np.array([np.nan, -1.0]), "direction" : np.array([0.0, 90.0])}
+    with pytest.raises(Exception, match = "No wind records"):
+        pwc.set_wind_records(records)
+    assert pwc.wind_record_counts is None
@@ -5,12 +5,31 @@ Created on Thu Oct 20 10:09:12 2022
 @author: mkdei
 """
 import os
+import re
 import time
+import asyncio
+import functools
+import random
+import hashlib
+import threading
+import socket
+import collections
 import zipfile
 import shutil
+import contextlib
+import pathlib
+import copy
+import sqlite3
+import types
+from concurrent.futures import ThreadPoolExecutor, as_completed
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
 
 import isodate
 import urllib3
+import numpy as np
 
 import json 
 import requests
@@ -49,10 +68,18 @@ class PedestrianWindComfort():
         self.geometry_name = ""
         self.geometry_id   = ""
         self.geometry_path = ""
+        self.storage_id    = ""
+        self.geometry_fingerprint = None
+        self.geometry_stats = None
+        self.upload_max_attempts = 3
+        self.archive_compression = dict(ARCHIVE_COMPRESSION) # file suffix -> (compression, level)
+        self.archive_workers = os.cpu_count()
         
         #Geometry Mapping 
         self.single_entity     = {} 
         self.multiple_entities = {}
+        self.layer_entities    = {} # layer key -> all entity ids of the layer
+        self.geometry_mappings = {} # (project_id, geometry_id) -> {layer name: entity ids}
                 
         #Region Of Interest Variables
         self.region_of_interest = None
@@ -81,6 +108,11 @@ class PedestrianWindComfort():
         self.number_wind_directions = None 
         self.exposure_category = []  #["EC1", "EC2", "EC3", "EC4", "EC5", "EC6"] 
         self.wind_velocity_unit = "m/s"
+        self.velocity_bucket_edges = [1, 2, 3, 4, 5, 6, 8, 10, 12, 15]
+        self.wind_record_counts = None # (velocity buckets, directions) histogram of user wind data
+        self.wind_record_edges = None # velocity bucket edges the histogram was binned with
+        self.wind_record_qa = None
+        self.wind_direction_offset = 0 # degrees of the first wind direction, see run_missing_wind_directions
         self.add_surface_roughness = True 
         
         #Pedestrian Comfort Map Variables
@@ -100,6 +132,8 @@ class PedestrianWindComfort():
         self.reynolds_scaling = None 
         self.mesh_master = None 
         self.min_cell_size = None 
+        self.mesh_fineness_name = None
+        self.reynolds_scaling_factor = None # None for automatic scaling
         
         #Simulation Creation Variables
         self.model = None 
@@ -107,6 +141,41 @@ class PedestrianWindComfort():
         self.simulation_id   = None
         self.simulation_run  = None 
         self.run_id = None
+        self.max_runtime = 36000
+        self.simulation_origin = None # created, reused, updated (see create_or_reuse_simulation)
+        
+        #Connection Variables (pools per host, see set_api_connection)
+        self.api_pool_size = 16
+        self.storage_pool_size = 8
+        self.pool_block = False # True: threads wait for a free connection instead of opening extra ones
+        self.storage_pool = None
+        
+        #Polling Variables (shared between instances by share_api_connection)
+        self.poller = Poller()
+        
+        #Local Cache Variables
+        self.cache_dir = pathlib.Path.home() / ".simscale_pwc"
+        self.lookup_cache = LookupCache(self.cache_dir / "lookup_cache.json")
+        self.fingerprint_cache = LookupCache(self.cache_dir / "geometry_fingerprints.json", ttl = None)
+        self.wind_data_cache = WindDataCache(self.cache_dir / "wind_data_cache.json")
+        self.estimate_cache = LookupCache(self.cache_dir / "estimates.json", ttl = 7 * 24 * 3600)
+        self.cost_model = CostModel(self.cache_dir / "cost_history.jsonl")
+        self.flow_run_cache = LookupCache(self.cache_dir / "flow_runs.json", ttl = None)
+        self.simulation_cache = LookupCache(self.cache_dir / "simulations.json", ttl = None)
+        self.direction_cache = LookupCache(self.cache_dir / "wind_directions.json", ttl = None)
+        
+        #Run Ledger Variables (see use_ledger)
+        self.ledger = None
+        self.ledger_session = None
+        
+        #Comfort Statistics Variables
+        self.comfort_results = {} # comfort map name -> comfort_statistics of the map
+        
+        #Results Variables
+        self.results_dir = self.cache_dir / "results" # <project>/<simulation>/<run>/ below
+        self.download_max_attempts = 3
+        self.download_workers = 4
+        self.result_paths = {} # result file name -> local path of the last download
         
     """Functions that allows setting up the API connection"""
     
@@ -188,10 +257,26 @@ class PedestrianWindComfort():
         configuration.host = self.host
         configuration.api_key = {self.api_key_header: self.api_key}
         
-        #Setup the API client connection 
+        #Setup the API client connection, one pool of kept-alive connections per host
+        configuration.connection_pool_maxsize = self.api_pool_size
         self.api_client = sim_sdk.ApiClient(configuration)
         retry_policy = urllib3.Retry(connect=5, read=5, redirect=0, status=5, backoff_factor=0.2)
-        self.api_client.rest_client.pool_manager.connection_pool_kw["retries"] = retry_policy
+        pool_kw = self.api_client.rest_client.pool_manager.connection_pool_kw
+        pool_kw["retries"] = retry_policy
+        pool_kw["maxsize"] = self.api_pool_size
+        pool_kw["block"] = self.pool_block
+        pool_kw["socket_options"] = KEEPALIVE_SOCKET_OPTIONS
+        
+        #Uploads go to the storage host (pre-signed urls), they get their own pool so 
+        #long uploads do not hold the connections needed for polling
+        pool_args = dict(num_pools=4, maxsize=self.storage_pool_size, block=self.pool_block, 
+                         retries=False, socket_options=KEEPALIVE_SOCKET_OPTIONS)
+        if configuration.ssl_ca_cert is not None:
+            pool_args.update(cert_reqs="CERT_REQUIRED", ca_certs=configuration.ssl_ca_cert)
+        if configuration.proxy:
+            self.storage_pool = urllib3.ProxyManager(configuration.proxy, **pool_args)
+        else:
+            self.storage_pool = urllib3.PoolManager(**pool_args)
        
         #Define the required API clients for the simulation 
         self.project_api = sim_sdk.ProjectsApi(self.api_client)
@@ -205,6 +290,122 @@ class PedestrianWindComfort():
         self.wind_api = sim_sdk.WindApi(self.api_client)
 
 
+    def share_api_connection(self, other):
+        
+        '''
+        Reuse the API client and API objects of another PedestrianWindComfort 
+        instance, so several designs can be set up in parallel over one 
+        connection while keeping their own project, geometry and simulation 
+        variables
+        
+        Parameters
+        ----------
+        other : PedestrianWindComfort
+            an instance on which set_api_connection was already called
+
+        Returns
+        -------
+        None.
+
+        '''
+        self.api_key, self.api_url, self.host = other.api_key, other.api_url, other.host
+        
+        self.api_client = other.api_client
+        self.storage_pool = other.storage_pool
+        self.project_api = other.project_api
+        self.storage_api = other.storage_api
+        self.geometry_import_api = other.geometry_import_api
+        self.geometry_api = other.geometry_api
+        self.simulation_api = other.simulation_api
+        self.simulation_run_api = other.simulation_run_api
+        self.table_import_api = other.table_import_api
+        self.reports_api = other.reports_api
+        self.wind_api = other.wind_api
+        self.poller = other.poller
+        self.lookup_cache = other.lookup_cache
+        self.fingerprint_cache = other.fingerprint_cache
+        self.wind_data_cache = other.wind_data_cache
+        self.estimate_cache = other.estimate_cache
+        self.cost_model = other.cost_model
+        self.flow_run_cache = other.flow_run_cache
+        self.simulation_cache = other.simulation_cache
+        self.direction_cache = other.direction_cache
+        self.ledger = other.ledger
+        self.ledger_session = other.ledger_session
+
+    def get_pool_metrics(self):
+        
+        '''
+        Utilisation of the connection pools of the API and storage hosts, 
+        from the public counters of the urllib3 connection pools. A counter 
+        that the installed urllib3 does not provide is left out.
+        
+        Returns
+        -------
+        metrics : dict
+            per pool ("api" or "storage") and host: maxsize (the configured 
+            pool size), created (connections opened so far, more than 
+            maxsize means connections were closed because the pool was full) 
+            and requests
+
+        '''
+        metrics = {}
+        rest_client = getattr(self.api_client, "rest_client", None)
+        for name, pool_manager, maxsize in (("api", getattr(rest_client, "pool_manager", None), self.api_pool_size), 
+                                            ("storage", self.storage_pool, self.storage_pool_size)):
+            pools = getattr(pool_manager, "pools", None)
+            if pools is None:
+                continue
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host = f"{getattr(pool, 'scheme', 'http')}://{getattr(pool, 'host', key)}:{getattr(pool, 'port', '')}"
+                counters = {"created" : getattr(pool, "num_connections", None), 
+                            "requests" : getattr(pool, "num_requests", None)}
+                metrics[(name, host)] = dict({"maxsize" : maxsize}, 
+                                             **{counter : value for counter, value in counters.items() 
+                                                if value is not None})
+        return metrics
+    
+    def use_ledger(self, session, path=None):
+        
+        '''
+        Record the pipeline stages (project, storage, geometry import, 
+        geometry, simulation, run) in a local SQLite ledger, so a rerun of 
+        the same session skips the stages that were completed and resumes 
+        the polling of those still in flight 
+        
+        Parameters
+        ----------
+        session : str
+            name of the pipeline run, use a new name to start over
+            
+        path : pathlib.Path, optional
+            the default is run_ledger.sqlite in cache_dir
+
+        Returns
+        -------
+        None.
+
+        '''
+        self.ledger = RunLedger(self.cache_dir / "run_ledger.sqlite" if path is None else path)
+        self.ledger_session = session
+        
+    def _ledger_result(self, stage, inputs):
+        #Result of a completed stage with the same inputs, None without a ledger
+        if self.ledger is None:
+            return None
+        return self.ledger.get(self.ledger_session, stage, RunLedger.hash_inputs(stage, inputs))
+    
+    def _ledger_record(self, stage, inputs, result):
+        if self.ledger is not None:
+            self.ledger.record(self.ledger_session, stage, RunLedger.hash_inputs(stage, inputs), result)
+            
+    def _ledger_forget(self, stage, inputs):
+        if self.ledger is not None:
+            self.ledger.forget(self.ledger_session, stage, RunLedger.hash_inputs(stage, inputs))
+
     def create_project(self, name, description, measurement_system = "SI"):
         '''
         Take a name and description and create a new workbench project
@@ -223,29 +424,127 @@ class PedestrianWindComfort():
 
         '''
         
-        try:
-            #Check if the project already exists
-            projects = self.project_api.get_projects(limit=1000).to_dict()['embedded']
-            found = None
-            for project in projects:
-                if project['name'] == name:
-                    found = project
-                    print('Project found: \n' + str(found['name']))
-                    break
-            if found is None:
-                raise Exception('could not find project with name: ' + name)
-            
-            self.project_id = found['project_id']
+        ledger_inputs = (self.host, name)
+        project = self._ledger_result("project", ledger_inputs)
+        if project is not None and not self._project_exists(project["project_id"]):
+            #A project deleted since the ledger row was written is looked up or created again
+            self._ledger_forget("project", ledger_inputs)
+            project = None
+        if project is not None:
+            self.project_id, self.project_name = project["project_id"], name
+            print(f"Project {name} taken from the run ledger")
+            return
+        
+        #Check if the project already exists
+        project_id = self.find_project(name)
+        if project_id is not None and not self._project_exists(project_id):
+            self.lookup_cache.remove(self._cache_scope("projects"), name)
+            project_id = None
+        if project_id is not None:
+            print('Project found: \n' + name)
+            self.project_id = project_id
             self.project_name = name
             print("Cannot create project with the same name, using existing project")
-        except:
+        else:
             #If not then create a new project
             project = sim_sdk.Project(name=name, description=description,
                                       measurement_system = measurement_system)
             project = self.project_api.create_project(project)
             self.project_id = project.project_id
-            self.project_name = name        
+            self.project_name = name
+            self.lookup_cache.add(self._cache_scope("projects"), name, self.project_id)
+        self._ledger_record("project", ledger_inputs, {"project_id" : self.project_id})
              
+    def _project_exists(self, project_id):
+        #The cached name index may still hold a deleted project
+        try:
+            self.project_api.get_project(project_id)
+        except sim_sdk.ApiException as ae:
+            if ae.status == 404:
+                print(f"Project {project_id} no longer exists")
+                return False
+            raise
+        return True
+    
+    def _get_all_pages(self, get_page, limit=100):
+        #Collect the embedded items of every page of a paginated API call
+        items, page = [], 1
+        while True:
+            embedded = get_page(limit=limit, page=page).to_dict()['embedded'] or []
+            items.extend(embedded)
+            if len(embedded) < limit:
+                return items
+            page += 1
+            
+    def _cache_scope(self, kind, project_id=None):
+        #Keep the indices of different servers and projects apart
+        scope = f"{self.host}|{kind}"
+        return scope if project_id is None else f"{scope}|{project_id}"
+            
+    def find_project(self, name):
+        
+        '''
+        Look up the id of a project by its name
+        
+        All the projects are paged through once and kept as a name to id 
+        index in the local lookup cache until its TTL expires.
+        
+        Parameters
+        ----------
+        name : str
+            exact name of the project
+
+        Returns
+        -------
+        project_id : str
+            None if there is no project with this name
+
+        '''
+        def fetch():
+            projects = self._get_all_pages(self.project_api.get_projects)
+            index = {}
+            for project in projects:
+                index.setdefault(project['name'], project['project_id'])
+            return index
+        
+        return self.lookup_cache.lookup(self._cache_scope("projects"), name, fetch)
+    
+    def find_geometry(self, name, project_id=None):
+        
+        '''
+        Look up the id of a geometry of the project by its name, using the 
+        same paged and cached index as find_project
+        
+        Parameters
+        ----------
+        name : str
+            exact name of the geometry
+            
+        project_id : str, optional
+            the default is the current project
+
+        Returns
+        -------
+        geometry_id : str
+            None if there is no geometry with this name
+
+        '''
+        return self._geometry_index(project_id).get(name)
+    
+    def _geometry_index(self, project_id=None):
+        #Name to id index of the geometries of the project
+        project_id = self.project_id if project_id is None else project_id
+        
+        def fetch():
+            geometries = self._get_all_pages(
+                lambda **kwargs: self.geometry_api.get_geometries(project_id, **kwargs))
+            index = {}
+            for geometry in geometries:
+                index.setdefault(geometry['name'], geometry['geometry_id'])
+            return index
+        
+        return self.lookup_cache.get_index(self._cache_scope("geometries", project_id), fetch)
+
     def zip_cad_for_upload(self, file_name, base_path): 
         
         '''
@@ -265,22 +564,30 @@ class PedestrianWindComfort():
         Returns
         -------
         geometry_path : path of the zipped file
+        
+        note: 
+            The compression method and level of each file type is taken from 
+            archive_compression. An archive is only rebuilt when the size or 
+            modification time of one of its source files changed. A CAD 
+            directory can also be passed to upload_geometry directly, it is 
+            then zipped into the cache (see cad_archive_for_upload).
 
         '''
-        geometry_path = []
-        
-        #Loop over the CAD files needed for upload
-        for cad in file_name:
-            
-            #Get the path of each CAD file
+        def build(cad):
+            #Get the path of each CAD file, the zip file is saved next to it
             path = base_path / cad
+            output_filename = str(path) + ".zip"
             
-            # The output_filename variable saves the zip file at a desired path; 
-            # in this case it is same directory
-            output_filename = path
-             
-            #Retruns a zip file(s) path of the associated CAD, 
-            geometry_path.append(shutil.make_archive(output_filename, 'zip', path)) 
+            #Skip the rebuild if the sources did not change since the archive was written
+            if build_cad_archive(path, output_filename, self.archive_compression):
+                print(f"Zipped {cad}")
+            else:
+                print(f"{cad} did not change, using existing archive")
+            return output_filename
+        
+        #Compress the CAD files in parallel, zlib releases the GIL while compressing
+        with ThreadPoolExecutor(max_workers = self.archive_workers) as executor:
+            geometry_path = list(executor.map(build, file_name))
 
         return geometry_path
     
@@ -309,6 +616,63 @@ class PedestrianWindComfort():
         
         self.single_entity[layer_key] = entities[layer_number]
 
+    def get_layer_mappings(self, project_id, geometry_id, layers):
+        
+        '''
+        Resolve the entity ids of every layer in one paged request 
+        
+        Every face mapping is matched to its layer by the name of the CAD 
+        entity it originates from, so the result does not depend on the 
+        order of the layers. Resolved layers are memoized per project and 
+        geometry, only layers that were not resolved before are requested.
+        
+        Parameters
+        ----------
+        project_id : str
+        
+        geometry_id : str
+        
+        layers : dict
+            keys are references used in the setup (for example in 
+            add_more_comfort_maps), values are the layer names defined in the 
+            CAD tool
+
+        Raises
+        ------
+        Exception
+            If no entity is found for a layer.
+
+        Returns
+        -------
+        layer_entities : dict
+            entity ids of each layer key
+
+        '''
+        resolved = self.geometry_mappings.setdefault((project_id, geometry_id), {})
+        missing = [name for name in layers.values() if name not in resolved]
+        
+        if missing:
+            mappings = self._get_all_pages(
+                lambda **kwargs: self.geometry_api.get_geometry_mappings(
+                    project_id, geometry_id, _class="face", entities=missing, **kwargs),
+                limit=500)
+            
+            for name in missing:
+                resolved[name] = []
+            for mapping in mappings:
+                for origin in mapping.get('originate_from') or []:
+                    if origin.get('entity') in resolved and mapping['name'] not in resolved[origin['entity']]:
+                        resolved[origin['entity']].append(mapping['name'])
+                        
+        for key, name in layers.items():
+            if not resolved[name]:
+                raise Exception(f"Found no entities for the layer {name}")
+            self.layer_entities[key] = resolved[name]
+            self.single_entity[key] = resolved[name][0]
+            print(f"{name}: {len(resolved[name])} entities")
+            
+        return {key : self.layer_entities[key] for key in layers}
+
 
 
     def get_entity_names(self, project_id, geometry_id, key, number = None ,**kwargs):
@@ -323,7 +687,102 @@ class PedestrianWindComfort():
             raise Exception(f"Found {len(self.multiple_entities[key])} entities instead of {number}: {self.multiple_entities[key]}")
     
     
-    def upload_geometry(self, name, path=None, units="m", _format="STL", facet_split=False):
+    def _read_in_chunks(self, file, chunk_size):
+        #Yield the file content chunk by chunk so only one chunk is held in memory
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def cad_archive_for_upload(self, path):
+        
+        '''
+        Zip a CAD directory into cache_dir / "archives" for the upload and 
+        the fingerprint, so both read the same bytes. The archive is only 
+        rebuilt when a source file changed (see build_cad_archive). Files and 
+        archives are returned unchanged.
+        
+        Returns
+        -------
+        path : pathlib.Path or str
+            path of the archive, or the given path if it is not a directory
+
+        '''
+        if not os.path.isdir(path):
+            return path
+        path = pathlib.Path(path).resolve()
+        digest = hashlib.sha256(str(path).encode()).hexdigest()[:16]
+        output_filename = self.cache_dir / "archives" / f"{path.name}-{digest}.zip"
+        output_filename.parent.mkdir(parents = True, exist_ok = True)
+        build_cad_archive(path, output_filename, self.archive_compression)
+        return output_filename
+
+    def upload_file_to_storage(self, path, chunk_size=8 * 1024 * 1024):
+        
+        '''
+        Stream a file from disk to a newly created SimScale storage. 
+        
+        The file is sent in chunks of chunk_size bytes with an explicit 
+        Content-Length, so the memory used by the upload does not grow with 
+        the size of the file. If the connection drops the upload is restarted 
+        from disk, up to upload_max_attempts times.
+        
+        note: 
+            The storage only provides a single pre-signed PUT url, so the 
+            file cannot be split into parts that are uploaded in parallel.
+        
+        Parameters
+        ----------
+        path : pathlib.Path or str
+            path of the file to upload. If it is a directory, it is zipped 
+            into the cache first (see cad_archive_for_upload) and the archive 
+            is uploaded.
+            
+        chunk_size : int, optional
+            Number of bytes read and sent per chunk.
+            
+            The default is 8 MB.
+
+        Raises
+        ------
+        Exception
+            If the storage rejects the upload or all attempts failed.
+
+        Returns
+        -------
+        storage_id : str
+            id of the storage holding the uploaded file
+
+        '''
+        #The Content-Length is only exact for bytes that are on disk before the upload starts
+        path = self.cad_archive_for_upload(path)
+        storage = self.storage_api.create_storage()
+        headers = {'Content-Type': 'application/octet-stream',
+                   'Content-Length': str(os.path.getsize(path))}
+        
+        for attempt in range(1, self.upload_max_attempts + 1):
+            try:
+                with open(path, 'rb') as file:
+                    #Retries are handled here, a consumed generator cannot be rewound by urllib3
+                    response = self.storage_pool.request(
+                        "PUT", storage.url, body=self._read_in_chunks(file, chunk_size), headers=headers, 
+                        retries=False)
+            except (urllib3.exceptions.HTTPError, OSError) as error:
+                print(f"Upload attempt {attempt} failed: {error}")
+                if attempt == self.upload_max_attempts:
+                    raise Exception("Could not upload file: " + str(path))
+                time.sleep(2 ** attempt)
+                continue
+            
+            if not 200 <= response.status < 300:
+                raise Exception(f"Upload rejected with status {response.status}: {response.data}")
+            break
+        
+        return storage.storage_id
+
+    def upload_geometry(self, name, path=None, units="m", _format="STL", facet_split=False,
+                        chunk_size=8 * 1024 * 1024):
         '''
         Upload a geometry to the SimScale platform to a preassigned project.
         
@@ -350,6 +809,12 @@ class PedestrianWindComfort():
             types). We prefer not to do this for API use.
             
             The default is False.
+            
+        chunk_size : int, optional
+            Number of bytes read from disk and sent per chunk while 
+            streaming the archive to the storage.
+            
+            The default is 8 MB.
 
         Raises
         ------
@@ -361,61 +826,342 @@ class PedestrianWindComfort():
         None.
 
         '''
+        ledger_inputs, geometry_import_id = self._start_geometry_upload(name, path, units, _format, 
+                                                                         facet_split, chunk_size)
+        if geometry_import_id is not None:
+            self.wait_for_geometry_import(geometry_import_id)
+        self._finish_geometry_upload(ledger_inputs)
+        
+    def _start_geometry_upload(self, name, path=None, units="m", _format="STL", facet_split=False,
+                               chunk_size=8 * 1024 * 1024):
+        #Steps of upload_geometry before the import is polled, also run by AsyncPedestrianWindComfort.
+        #Returns the ledger inputs and the id of the import to wait for, None if the geometry is known
         self.geometry_name = name
+        ledger_inputs = self._geometry_ledger_inputs(name, path, units, _format, facet_split)
+        geometry = self._ledger_result("geometry", ledger_inputs)
+        if geometry is not None and not self._geometry_exists(geometry["geometry_id"]):
+            #The finished import of the ledger would only give the deleted geometry again
+            self._ledger_forget("geometry", ledger_inputs)
+            self._ledger_forget("geometry_import", ledger_inputs)
+            geometry = None
+        if geometry is not None:
+            self.geometry_id = geometry["geometry_id"]
+            print(f"Geometry {name} taken from the run ledger")
+            return ledger_inputs, None
         
         #Check if the geometry already exists
-        try:
-            project_id = self.project_id
-            geometry_api = self.geometry_api
+        geometry_id = self.find_existing_geometry(name, path, units, _format, facet_split)
+        if geometry_id is not None:
+            self.geometry_id = geometry_id
+            return ledger_inputs, None
+        
+        geometry_import = self._ledger_result("geometry_import", ledger_inputs)
+        if geometry_import is not None:
+            #The import was started by an earlier run, only its polling is resumed
+            print(f"Resuming geometry import {geometry_import['geometry_import_id']}")
+            return ledger_inputs, geometry_import["geometry_import_id"]
+        return ledger_inputs, self.import_geometry(name, path, units, _format, facet_split, chunk_size)
+    
+    def _finish_geometry_upload(self, ledger_inputs):
+        #Record the geometry in the ledger once the import has ended
+        if not self.geometry_id:
+            #A failed import is started over by the next run
+            self._ledger_forget("geometry_import", ledger_inputs)
+            self._ledger_forget("storage", ledger_inputs)
+            return
+        self._ledger_record("geometry", ledger_inputs, {"geometry_id" : self.geometry_id})
+        
+    def _geometry_ledger_inputs(self, name, path, units="m", _format="STL", facet_split=False):
+        #Cheap stand-in for the geometry content: names, sizes and modification times of the files
+        stamp = None if path is None else _cad_archive_stamp(path, {}).decode()
+        return (self.host, self.project_id, name, stamp, units, _format, facet_split)
+            
+    def fingerprint_geometry(self, path, chunk_size=8 * 1024 * 1024):
         
-            geometries = geometry_api.get_geometries(project_id).to_dict()['embedded']
-            found = None
-            for geometry in geometries:
-                if geometry['name'] == name:
-                    found = geometry
-                    print('Geometry found: \n' + str(found['name']))
-                    break
-                        
-            if found is None:
-                raise Exception('could not find geometry with id: ' + name)
-                
-            self.geometry_name = found
-            self.geometry_id = found["geometry_id"]
-            print("Cannot upload geometry with the same name, using existing geometry")
+        '''
+        Compute a SHA-256 fingerprint of the geometry content, reading the 
+        file in chunks.
+        
+        For zip archives the names and uncompressed content of the members 
+        are hashed instead of the archive bytes, so re-zipping the same CAD 
+        gives the same fingerprint.
+        
+        Parameters
+        ----------
+        path : pathlib.Path or str
+            path of the zip archive, CAD file or CAD directory
+            
+        chunk_size : int, optional
+            Number of bytes hashed per chunk.
 
-        except:
+        Returns
+        -------
+        fingerprint : str
+            hex digest of the content
+
+        '''
+        sha = hashlib.sha256()
+        #A directory is hashed through the archive that is uploaded, with the same members
+        path = self.cad_archive_for_upload(path)
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                for member in sorted(archive.infolist(), key = lambda info: info.filename):
+                    if member.is_dir():
+                        continue
+                    sha.update(member.filename.encode() + b"\0")
+                    with archive.open(member) as file:
+                        for chunk in self._read_in_chunks(file, chunk_size):
+                            sha.update(chunk)
+        else:
+            with open(path, 'rb') as file:
+                for chunk in self._read_in_chunks(file, chunk_size):
+                    sha.update(chunk)
+        return sha.hexdigest()
+    
+    def find_existing_geometry(self, name, path=None, units="m", _format="STL", facet_split=False):
+        
+        '''
+        Find a geometry of the project that can be reused instead of uploading 
+        the given file.
+        
+        If a path is given, the geometry is matched by the fingerprint of its 
+        content and import options, whatever its name. A geometry with the 
+        same name but a different content is not reused. Without a path the 
+        geometry is matched by name only. A match is confirmed with the API 
+        (one request), so a deleted geometry is not reused.
+        
+        Parameters
+        ----------
+        name : str
+            the name given to the geometry
             
-            self.geometry_path = path
-
-            storage = self.storage_api.create_storage()
-            with open(self.geometry_path, 'rb') as file:
-                self.api_client.rest_client.PUT(url=storage.url, headers={'Content-Type': 'application/octet-stream'},
-                                                body=file.read())
-            self.storage_id = storage.storage_id
-
-            geometry_import = sim_sdk.GeometryImportRequest(
-                name=name,
-                location=sim_sdk.GeometryImportRequestLocation(self.storage_id),
-                format=_format,
-                input_unit=units,
-                options=sim_sdk.GeometryImportRequestOptions(facet_split=facet_split, sewing=False, improve=True,
-                                                         optimize_for_lbm_solver=True),
-            )
+        path : pathlib.Path, optional
+            path of the geometry to upload
+            
+        units, _format, facet_split : optional
+            import options, see upload_geometry
+
+        Returns
+        -------
+        geometry_id : str
+            None if the geometry has to be uploaded
+
+        '''
+        self.geometry_fingerprint = None
+        if path is None:
+            geometry_id = self.find_geometry(name)
+            if geometry_id is not None and not self._geometry_exists(geometry_id):
+                self.lookup_cache.remove(self._cache_scope("geometries", self.project_id), name)
+                geometry_id = None
+            if geometry_id is not None:
+                print('Geometry found: \n' + name)
+                print("Cannot upload geometry with the same name, using existing geometry")
+            return geometry_id
+        
+        #The same content imported with other options gives another geometry
+        options = json.dumps([units, _format, facet_split])
+        self.geometry_fingerprint = self.fingerprint_geometry(path) + ":" + options
+        scope = self._cache_scope("fingerprints", self.project_id)
+        geometry_id = self.fingerprint_cache.lookup(scope, self.geometry_fingerprint, dict)
+        
+        #Make sure the geometry was not deleted from the project in the meantime
+        if geometry_id is not None:
+            if self._geometry_exists(geometry_id):
+                print(f"Geometry with identical content found, reusing geometry {geometry_id}")
+                return geometry_id
+            self.fingerprint_cache.remove(scope, self.geometry_fingerprint)
+            
+        if self.find_geometry(name) is not None:
+            print(f"Geometry {name} exists with a different content, uploading the new version")
+        return None
+    
+    def _geometry_exists(self, geometry_id, project_id=None):
+        #One GET instead of the cached name index, which may not know about a deletion yet
+        project_id = self.project_id if project_id is None else project_id
+        try:
+            self.geometry_api.get_geometry(project_id, geometry_id)
+        except sim_sdk.ApiException as ae:
+            if ae.status == 404:
+                print(f"Geometry {geometry_id} no longer exists")
+                return False
+            raise
+        return True
+    
+    def _register_imported_geometry(self, project_id):
+        #Add a finished import to the name index and the fingerprint store
+        self.lookup_cache.add(self._cache_scope("geometries", project_id), 
+                              self.geometry_name, self.geometry_id)
+        if self.geometry_fingerprint is not None:
+            scope = self._cache_scope("fingerprints", project_id)
+            self.fingerprint_cache.get_index(scope, dict)
+            self.fingerprint_cache.add(scope, self.geometry_fingerprint, self.geometry_id)
+
+    def import_geometry(self, name, path, units="m", _format="STL", facet_split=False,
+                        chunk_size=8 * 1024 * 1024):
+        
+        '''
+        Upload the geometry to a new storage and start its import into the 
+        project, without waiting for the import to finish.
+        
+        Parameters
+        ----------
+        see upload_geometry
+
+        Returns
+        -------
+        geometry_import_id : str
+            id of the started geometry import
 
+        '''
+        self.geometry_name = name
+        self.geometry_path = path
+        ledger_inputs = self._geometry_ledger_inputs(name, path, units, _format, facet_split)
+        storage = self._ledger_result("storage", ledger_inputs)
+        if storage is not None:
+            print(f"Reusing the uploaded storage {storage['storage_id']} from the run ledger")
+            self.storage_id = storage["storage_id"]
+        else:
+            self.storage_id = self.upload_file_to_storage(self.geometry_path, chunk_size=chunk_size)
+            self._ledger_record("storage", ledger_inputs, {"storage_id" : self.storage_id})
+
+        geometry_import = sim_sdk.GeometryImportRequest(
+            name=name,
+            location=sim_sdk.GeometryImportRequestLocation(self.storage_id),
+            format=_format,
+            input_unit=units,
+            options=sim_sdk.GeometryImportRequestOptions(facet_split=facet_split, sewing=False, improve=True,
+                                                     optimize_for_lbm_solver=True),
+        )
+
+        try:
             geometry_import = self.geometry_import_api.import_geometry(self.project_id, geometry_import)
-            geometry_import_id = geometry_import.geometry_import_id
+        except sim_sdk.ApiException:
+            #A storage from the ledger may have expired, the next run uploads again
+            self._ledger_forget("storage", ledger_inputs)
+            raise
+        self._ledger_record("geometry_import", ledger_inputs, 
+                            {"geometry_import_id" : geometry_import.geometry_import_id})
+        return geometry_import.geometry_import_id
+    
+    def wait_for_geometry_import(self, geometry_import_id, timeout=900):
+        
+        '''
+        Block until the geometry import is finished, canceled or failed and 
+        store the resulting geometry id. The import is polled by the shared 
+        poller with exponential backoff.
+        
+        Parameters
+        ----------
+        geometry_import_id : str
+            id returned by import_geometry
+            
+        timeout : int, optional
+            seconds to wait before giving up, adjust for larger geometries
+            
+            The default is 900.
+
+        Raises
+        ------
+        TimeoutError
+            If the import did not end within timeout seconds.
+
+        Returns
+        -------
+        None.
 
-            geometry_import_start = time.time()
-            while geometry_import.status not in ('FINISHED', 'CANCELED', 'FAILED'):
-                # adjust timeout for larger geometries
-                if time.time() > geometry_import_start + 900:
-                    raise TimeoutError()
-                time.sleep(10)
-                geometry_import = self.geometry_import_api.get_geometry_import(self.project_id, geometry_import_id)
-                print(f'Geometry import status: {geometry_import.status}')
-            self.geometry_id = geometry_import.geometry_id
+        '''
+        project_id = self.project_id
+        key = ("geometry_import", geometry_import_id)
+        self.poller.add_job(
+            key,
+            fetch = lambda: self.geometry_import_api.get_geometry_import(project_id, geometry_import_id),
+            is_done = lambda geometry_import: geometry_import.status in ('FINISHED', 'CANCELED', 'FAILED'),
+            timeout = timeout,
+            on_update = lambda geometry_import: print(f'Geometry import status: {geometry_import.status}'))
+        
+        geometry_import = self.poller.wait([key])[key]
+        self.geometry_id = geometry_import.geometry_id
+        if geometry_import.status == 'FINISHED':
+            self._register_imported_geometry(project_id)
         
             
+    def preflight_geometry(self, path, radius=None, center=None, ground_height=None, tolerance=1e-10):
+        
+        '''
+        Analyze the STL geometry locally before it is uploaded and check that 
+        the region of interest fits the model
+        
+        The bounding box, triangle count, degenerate and duplicate facets and 
+        the statistics of each solid (layer) are computed with read_stl and 
+        analyze_stl.
+        
+        Parameters
+        ----------
+        path : pathlib.Path
+            STL file, directory containing the STL files or zip archive
+            
+        radius : float, optional
+            radius of the region of interest, the default is roi_radius 
+            
+        center : list, optional
+            x and y coordinates of the roi center, the default is center
+            
+        ground_height : float, optional
+            the default is ground_height
+            
+        tolerance : float, optional
+            facets with an area below tolerance times the squared bounding 
+            box diagonal are reported as degenerate
+
+        Raises
+        ------
+        Exception
+            If the geometry is empty or the region of interest is not on the 
+            model.
+
+        Returns
+        -------
+        geometry_stats : dict
+            see analyze_stl
+
+        '''
+        radius = self.roi_radius if radius is None else radius
+        center = self.center if center is None else center
+        ground_height = self.ground_height if ground_height is None else ground_height
+        
+        triangles, solid_index, solid_names = read_stl(path)
+        self.geometry_stats = stats = analyze_stl(triangles, solid_index, solid_names, tolerance)
+        
+        print("*"*10)
+        print(f"Geometry preflight: {path}")
+        print(f"Number of triangles: {stats['triangle_count']}")
+        print(f"Bounding box: {stats['bbox_min']} - {stats['bbox_max']}")
+        for name, solid in stats['solids'].items():
+            print(f"  {name}: {solid['triangle_count']} triangles, area {solid['area']:.1f}")
+        print("*"*10)
+        
+        errors, warnings = [], []
+        if stats['triangle_count'] == 0:
+            raise Exception("Geometry preflight failed - no triangles found in", str(path))
+        
+        (x_min, y_min, z_min), (x_max, y_max, z_max) = stats['bbox_min'], stats['bbox_max']
+        if not (x_min <= center[0] <= x_max and y_min <= center[1] <= y_max):
+            errors.append(f"Region of interest center {center} is outside of the model")
+        elif (center[0] - radius < x_min or center[0] + radius > x_max or 
+              center[1] - radius < y_min or center[1] + radius > y_max):
+            warnings.append(f"Region of interest radius {radius} extends beyond the model")
+        if not z_min <= ground_height <= z_max:
+            warnings.append(f"Ground height {ground_height} is outside of the model height {z_min} - {z_max}")
+        if stats['degenerate_count']:
+            warnings.append(f"{stats['degenerate_count']} degenerate facets")
+        if stats['duplicate_count']:
+            warnings.append(f"{stats['duplicate_count']} duplicate facets")
+            
+        print(f"Geometry preflight warnings: {warnings}")
+        if errors:
+            raise Exception("Geometry preflight failed - Correct the following error:", errors)
+        return stats
+            
     def set_region_of_interest(self, radius, center ,ground_height, north_angle, wt_size = 'moderate'):
         
         '''
@@ -533,25 +1279,154 @@ class PedestrianWindComfort():
          self.side_extension    = sim_sdk.DimensionalLength(side_ext, "m")
          self.inflow_extension  = sim_sdk.DimensionalLength(inflow_ext, "m")
          self.outflow_extension = sim_sdk.DimensionalLength(outflow_ext, "m")
+         
+    def get_wind_tunnel_footprint(self, num_directions = None, extensions = None):
         
-    
-    def set_num_wind_directions(self, num_wind_dir): 
+        '''
+        Compute the ground footprint of the wind tunnels of all wind 
+        directions from the region of interest and the wind tunnel size
         
-         '''
-         sets the number of wind directions to be submitted for simulation
-         
-         Parameters
-         ----------
-         num_wind_dir : int 
-             number of wind directions a choice from : 2, 4, 6, 8, 12, 16 ,36 
-             
-             note: 36 wind directions is only possible when the wind data is 
-             either manually imported or if the simulation is done using 
-             the City of London standard 
-             
-         Returns
-         -------
-         number_wind_directions  
+        For every direction the tunnel is a rectangle aligned with the wind, 
+        reaching radius + max(inflow, outflow) extension along the wind and 
+        radius + side extension across it. The extensions of a custom tunnel 
+        are taken from set_custom_wt_size. The moderate and large tunnels are 
+        sized by the server and their extensions are not known locally, so 
+        they have to be passed.
+        
+        Parameters
+        ----------
+        num_directions : int, optional
+            the default is number_wind_directions, or 36 if it is not set
+            
+        extensions : dict, optional
+            side, inflow and outflow extensions in m, overrides the custom 
+            tunnel size. Required for the moderate and large tunnels, choose 
+            them on the large side: keeping a few triangles too many is 
+            harmless, cutting away a few is not.
+
+        Raises
+        ------
+        Exception
+            If the extensions of the tunnel are not known.
+
+        Returns
+        -------
+        footprint : dict
+            center, half_length, half_width and the wind direction angles in 
+            degrees
+
+        '''
+        if num_directions is None:
+            num_directions = self.number_wind_directions or 36
+        radius = self.roi_radius
+        
+        if extensions is not None:
+            side = extensions["side"]
+            along = max(extensions["inflow"], extensions["outflow"])
+        elif self.wind_tunnel_size not in ("moderate", "large") and self.side_extension is not None:
+            side = self.side_extension.value
+            along = max(self.inflow_extension.value, self.outflow_extension.value)
+        else:
+            raise Exception(f"The extensions of the {self.wind_tunnel_size} wind tunnel are not known locally, "
+                            "pass extensions or use set_custom_wt_size")
+        
+        return {"center" : list(self.center[:2]), 
+                "half_length" : radius + along, 
+                "half_width" : radius + side,
+                "angles" : model_wind_angles(self.north_angle, num_directions)}
+        
+    def crop_geometry_to_wind_tunnel(self, cad, base_path, suffix = "_cropped", num_directions = None, 
+                                     extensions = None):
+        
+        '''
+        Remove the triangles that lie outside of every wind tunnel before the 
+        geometry is zipped and uploaded
+        
+        The STL files of the CAD are streamed in batches (see crop_stl) and the 
+        kept triangles are written in the format of the input file with the 
+        same solid (layer) names into the directory base_path / (cad + suffix), 
+        which can be passed to zip_cad_for_upload. Call set_region_of_interest 
+        (and set_custom_wt_size for a custom tunnel) first.
+        
+        Parameters
+        ----------
+        cad : str
+            name of the CAD directory, STL file or zip archive of STL files 
+            in base_path
+            
+        base_path : pathlib.Path
+            path to the directory that contains the CAD files 
+            
+        suffix : str, optional
+            appended to the name of the cropped CAD directory
+            
+        num_directions, extensions : optional
+            see get_wind_tunnel_footprint, the extensions are required for 
+            the moderate and large tunnels
+
+        Raises
+        ------
+        Exception
+            If the CAD contains no STL files, other formats cannot be cropped, 
+            or the extensions of the tunnel are not known.
+
+        Returns
+        -------
+        cropped_cad : str
+            name of the directory with the cropped CAD in base_path
+
+        '''
+        footprint = self.get_wind_tunnel_footprint(num_directions, extensions)
+        path = pathlib.Path(base_path) / cad
+        cropped_cad = pathlib.Path(cad).name.split(".")[0] + suffix
+        output_dir = pathlib.Path(base_path) / cropped_cad
+        output_dir.mkdir(parents = True, exist_ok = True)
+        
+        kept, total = 0, 0
+        if zipfile.is_zipfile(path):
+            #Every STL member is extracted next to its output, cropped and removed again
+            with zipfile.ZipFile(path) as archive:
+                members = sorted(m for m in archive.namelist() if m.lower().endswith(".stl"))
+                if not members:
+                    raise Exception(f"No STL files in the archive {path}, only STL geometry can be cropped")
+                for member in members:
+                    output_path = output_dir / pathlib.PurePath(member).name
+                    tmp_path = output_path.with_suffix(".tmp")
+                    with archive.open(member) as source, open(tmp_path, 'wb') as target:
+                        shutil.copyfileobj(source, target)
+                    try:
+                        file_kept, file_total = crop_stl(tmp_path, output_path, **footprint)
+                    finally:
+                        tmp_path.unlink()
+                    kept, total = kept + file_kept, total + file_total
+        else:
+            stl_paths = sorted(p for p in path.rglob("*") if p.suffix.lower() == ".stl") if path.is_dir() else [path]
+            if not stl_paths or any(p.suffix.lower() != ".stl" for p in stl_paths):
+                raise Exception(f"No STL files in {path}, only STL geometry can be cropped")
+            for stl_path in stl_paths:
+                file_kept, file_total = crop_stl(stl_path, output_dir / stl_path.name, **footprint)
+                kept, total = kept + file_kept, total + file_total
+            
+        print(f"Cropped geometry: kept {kept} of {total} triangles in {output_dir}")
+        return cropped_cad
+    
+    def set_num_wind_directions(self, num_wind_dir): 
+        
+         '''
+         sets the number of wind directions to be submitted for simulation
+         
+         Parameters
+         ----------
+         num_wind_dir : int 
+             number of wind directions a choice from : 2, 4, 6, 8, 12, 16 ,36 
+             
+             note: 36 wind directions is only possible when the wind data is 
+             either manually imported or if the simulation is done using 
+             the City of London standard 
+             
+         Returns
+         -------
+         number_wind_directions  
          
          '''
         
@@ -669,10 +1544,97 @@ class PedestrianWindComfort():
             latitude= self.latitude, 
             longitude=self.longitude)       
 
-    def set_velocity_buckets(self): 
-        #create a function that allows the user to define up to 16 WD using 
-        #velocity buckets
-            pass 
+    def set_velocity_buckets(self, velocity_edges): 
+        
+        '''
+        Define the velocity buckets used to bin user wind data 
+        
+        The first bucket starts at zero and the last one is open ended, so n 
+        edges give n + 1 buckets.
+        
+        Parameters
+        ----------
+        velocity_edges: list 
+            increasing bucket edges in wind_velocity_unit, for example 
+            [1, 2, 3, 5, 8, 12]
+            
+        Returns 
+        -------
+        None.  
+        
+        '''
+        edges = np.asarray(velocity_edges, dtype=np.float64)
+        if edges.ndim != 1 or len(edges) == 0 or np.any(np.diff(edges) <= 0):
+            raise Exception("Velocity bucket edges must be a non empty increasing list", velocity_edges)
+        self.velocity_bucket_edges = edges.tolist()
+        
+    def set_wind_records(self, source, speed_column = "speed", direction_column = "direction",
+                         flag_column = None, valid_flags = (0,), calm_threshold = 0.5, keep_calms = True,
+                         chunk_size = 64 * 1024 * 1024):
+        
+        '''
+        Bin raw wind speed and direction records (for example hourly station 
+        data or 1-minute met mast samples) into the wind rose used by the 
+        USER_UPLOAD wind data source
+        
+        The records are read chunk by chunk (see iter_wind_record_chunks), 
+        quality filtered (see filter_wind_records) and accumulated into a 
+        histogram of number_wind_directions sectors centred on north (see 
+        set_num_wind_directions) and the velocity buckets of 
+        set_velocity_buckets, so the memory used does not depend on the size 
+        of the file.
+        
+        Parameters
+        ----------
+        source: str, pathlib.Path, tuple or dict 
+            CSV, Parquet (needs pyarrow), .npy or .npz file, a (speed, 
+            direction) tuple of arrays or a dict of arrays
+            
+        speed_column, direction_column: str 
+            names of the columns or arrays with the wind speed (in 
+            wind_velocity_unit) and the direction the wind comes from in 
+            degrees clockwise from north
+            
+        flag_column: str, optional 
+            name of a numeric sensor flag column, records whose flag is not 
+            in valid_flags are removed
+            
+        calm_threshold: float, optional
+            speed below which a record counts as calm
+            
+        keep_calms: bool, optional
+            keep the calms in the lowest velocity bucket, default is True
+            
+        chunk_size: int, optional
+            approximate number of bytes read per chunk
+            
+        Returns 
+        -------
+        qa : dict
+            number of records removed per reason, calms and kept records
+        
+        '''
+        if self.number_wind_directions is None:
+            raise Exception("Set the number of wind directions before the wind records")
+            
+        edges = list(self.velocity_bucket_edges)
+        counts = np.zeros((len(edges) + 1, self.number_wind_directions), dtype = np.int64)
+        qa = collections.Counter()
+        for speed, direction, flag, progress in iter_wind_record_chunks(
+                source, speed_column, direction_column, flag_column, chunk_size):
+            speed, direction, chunk_qa = filter_wind_records(speed, direction, flag, calm_threshold, 
+                                                             keep_calms, valid_flags)
+            counts += wind_rose_histogram(speed, direction, self.number_wind_directions, edges)
+            qa.update(chunk_qa)
+            print(f"Wind records: {progress:.0%} read, {qa['kept']} kept")
+            
+        if qa["kept"] == 0:
+            raise Exception("No wind records left after the quality check", dict(qa))
+        self.wind_record_counts = counts
+        self.wind_record_edges = edges
+        self.wind_record_qa = dict(qa)
+        print(f"Wind records quality check: {self.wind_record_qa}")
+        return self.wind_record_qa
         
     def set_wind_rose(self):
     
@@ -681,8 +1643,8 @@ class PedestrianWindComfort():
         using meteoblue or user upload is invoked. 
         
         note: 
-        The user upload method requires the addition of a function that would 
-        allow to define the velocity buckets (number of directions)
+        The user upload method requires the wind records to be binned first 
+        with set_wind_records, after set_velocity_buckets if it is used
                         
         Parameters
         ----------
@@ -697,9 +1659,12 @@ class PedestrianWindComfort():
             
             print("Importing wind data from Meteoblue..")
             try:
-                wind_rose_response = self.wind_api.get_wind_data (self.latitude_meteoblue , 
-                                                                  self.longitude_meteoblue)
-                self.wind_rose = wind_rose_response.wind_rose
+                #The cached wind rose is shared, the settings below are applied to a fresh copy of it
+                wind_rose_data = self.wind_data_cache.get(
+                    self.latitude_meteoblue, self.longitude_meteoblue,
+                    lambda: self.api_client.sanitize_for_serialization(
+                        self.wind_api.get_wind_data(self.latitude_meteoblue, self.longitude_meteoblue).wind_rose))
+                self.wind_rose = self._deserialize(wind_rose_data, 'WindRose')
                 self.wind_rose.num_directions = self.number_wind_directions
                 self.wind_rose.exposure_categories = self.exposure_category # ["EC4"] * wind_rose.num_directions
                 self.wind_rose.wind_engineering_standard = self.wind_engineering_standard
@@ -717,14 +1682,18 @@ class PedestrianWindComfort():
             
             print("Importing wind data from user input..")
             
+            if self.wind_record_counts is None:
+                raise Exception("No wind records binned, call set_wind_records first")
+            if self.wind_record_counts.shape[1] != self.number_wind_directions:
+                raise Exception("The wind records were binned for a different number of wind directions")
+            if self.wind_record_edges != list(self.velocity_bucket_edges):
+                raise Exception("The wind records were binned with other velocity buckets, "
+                                "call set_wind_records again")
+            
             self.wind_rose = sim_sdk.WindRose(
                 num_directions= self.number_wind_directions, 
-                velocity_buckets=[
-                    sim_sdk.WindRoseVelocityBucket(_from=None, to=1.234, fractions=[0.1, 0.1, 0.1, 0.1]),
-                    sim_sdk.WindRoseVelocityBucket(_from=1.234, to=2.345, fractions=[0.0, 0.1, 0.1, 0.1]),
-                    sim_sdk.WindRoseVelocityBucket(_from=2.345, to=3.456, fractions=[0.0, 0.0, 0.1, 0.1]),
-                    sim_sdk.WindRoseVelocityBucket(_from=3.456, to=None, fractions=[0.0, 0.0, 0.0, 0.1]),
-                ],
+                velocity_buckets= wind_rose_velocity_buckets(self.wind_record_counts, 
+                                                             self.wind_record_edges),
                 velocity_unit= self.wind_velocity_unit,
                 exposure_categories= self.exposure_category,
                 wind_engineering_standard= self.wind_engineering_standard,
@@ -732,6 +1701,11 @@ class PedestrianWindComfort():
                 add_surface_roughness= self.add_surface_roughness ,
             )
 
+    def _deserialize(self, data, model_name):
+        #Build an SDK model from its JSON form, the same way API responses are deserialized
+        response = type("Response", (), {"data" : json.dumps(data)})()
+        return self.api_client.deserialize(response, model_name)
+
     def set_wind_conditions(self): 
         
         '''
@@ -810,7 +1784,11 @@ class PedestrianWindComfort():
         
         layers_to_assign = []
         for key in layers_key: 
-            layers_to_assign.append(self.single_entity[key])
+            #Layers resolved with get_layer_mappings may consist of several entities
+            if key in self.layer_entities:
+                layers_to_assign.extend(self.layer_entities[key])
+            else:
+                layers_to_assign.append(self.single_entity[key])
         
         print(layers_to_assign)
         
@@ -973,26 +1951,8 @@ class PedestrianWindComfort():
         None.  
         
         '''
-        if fineness == "VeryCoarse": 
-            self.mesh_fineness = sim_sdk.PacefishFinenessVeryCoarse()
-            
-        elif fineness == "Coarse":
-            self.mesh_fineness = sim_sdk.PacefishFinenessCoarse()
-
-        elif fineness == "Moderate":
-            self.mesh_fineness = sim_sdk.PacefishFinenessModerate()
-
-        elif fineness == "Fine":
-            self.mesh_fineness = sim_sdk.PacefishFinenessFine()
-
-        elif fineness == "VeryFine":
-            self.mesh_fineness = sim_sdk.PacefishFinenessVeryFine()
-    
-        elif fineness == "TargetSize": 
-            
-            self.mesh_fineness = sim_sdk.PacefishFinenessTargetSize(
-            type ="TARGET_SIZE",
-            minimum_cell_size= self.min_cell_size)
+        self.mesh_fineness_name = fineness
+        self.mesh_fineness = mesh_fineness_model(fineness, self.min_cell_size)
     
                               
     def set_reynolds_scaling(self, scaling = 1.0 , auto_scale = True):
@@ -1019,6 +1979,7 @@ class PedestrianWindComfort():
         None.  
         
         '''
+        self.reynolds_scaling_factor = None if auto_scale == True else scaling
         if auto_scale == True: 
             
             self.reynolds_scaling = sim_sdk.AutomaticReynoldsScaling(
@@ -1061,53 +2022,436 @@ class PedestrianWindComfort():
         
         '''
                 
-        self.model = sim_sdk.WindComfort(
-            region_of_interest= self.region_of_interest
-            ,
-            wind_conditions=  sim_sdk.WindConditions(
-                     geographical_location= self.geo_location_obj,
-                     wind_rose = self.wind_rose)
-            ,
-            pedestrian_comfort_map=
-                    self.pedestrian_comfort_map
-            ,
-            simulation_control= self.sim_control
-            ,
-            advanced_modelling=sim_sdk.AdvancedModelling(),
-            additional_result_export=sim_sdk.FluidResultControls(
-                transient_result_control=sim_sdk.TransientResultControl(
-                    write_control=sim_sdk.CoarseResolution(),
-                    fraction_from_end=0.1,
-                ),
-                statistical_averaging_result_control=sim_sdk.StatisticalAveragingResultControlV2(
-                    sampling_interval=sim_sdk.CoarseResolution(),
-                    fraction_from_end=0.1,
-                ),
-            ),
-            mesh_settings=self.mesh_master,
-        )
+        self.simulation_spec = self.get_spec_template(simulation_name).build()
+        self.model = self.simulation_spec.model
+        
+    def get_spec_template(self, simulation_name):
+        
+        '''
+        Freeze the current setup into an immutable SimulationSpecTemplate, 
+        variants for parameter sweeps are forked from it with with_() 
+        
+        Parameters
+        ----------
+        simulation_name: str 
+            name of the simulations built from the template 
 
-        self.simulation_spec = sim_sdk.SimulationSpec(name=simulation_name, geometry_id= self.geometry_id, model=self.model)
+        Returns 
+        -------
+        SimulationSpecTemplate
+        
+        '''
+        return SimulationSpecTemplate.from_pwc(self, simulation_name)
         
         
-    def create_simulation(self):
+    def create_simulation(self, simulation_spec = None):
         
         '''
         Create the simulation setup based on the simulation spec 
 
         Parameters
         ----------
+        simulation_spec: sim_sdk.SimulationSpec, optional
+            spec to create instead of the one from set_simulation_spec, 
+            e.g. a variant built from a SimulationSpecTemplate
 
         Returns 
         -------
         None.  
         
         '''
+        if simulation_spec is not None:
+            self.simulation_spec = simulation_spec
+            self.model = simulation_spec.model
+        if self._simulation_from_ledger():
+            return
         self.simulation_id = self.simulation_api.create_simulation(self.project_id, self.simulation_spec).simulation_id
+        self.simulation_origin = "created"
         print(f"simulationId: {self.simulation_id}")
+        self._record_simulation_in_ledger()
+        
+    def _simulation_from_ledger(self):
+        #Take the simulation of the same spec from the run ledger, True if found
+        ledger_inputs = (self.host, self.project_id, self.get_spec_hash())
+        simulation = self._ledger_result("simulation", ledger_inputs)
+        if simulation is None:
+            return False
+        if not self._verify_simulation(simulation["simulation_id"]):
+            self._ledger_forget("simulation", ledger_inputs)
+            return False
+        self.simulation_id = simulation["simulation_id"]
+        self.simulation_origin = "reused"
+        print(f"simulationId: {self.simulation_id} (run ledger)")
+        return True
+    
+    def _record_simulation_in_ledger(self):
+        self._ledger_record("simulation", (self.host, self.project_id, self.get_spec_hash()), 
+                            {"simulation_id" : self.simulation_id})
+
+    def _simulation_index(self, project_id=None):
+        #Spec hash (and "base:" + base hash) to simulation id index of the project
+        project_id = self.project_id if project_id is None else project_id
+        
+        def fetch():
+            simulations = self._get_all_pages(
+                lambda **kwargs: self.simulation_api.get_simulations(project_id, **kwargs))
+            index = {}
+            for simulation in simulations:
+                spec = self.simulation_api.get_simulation(project_id, simulation['simulation_id'])
+                index.setdefault(self.get_spec_hash(spec), simulation['simulation_id'])
+                index.setdefault("base:" + self.get_spec_base_hash(spec), simulation['simulation_id'])
+            return index
+        
+        return self.lookup_cache.get_index(self._cache_scope("simulations", project_id), fetch)
+    
+    def _find_simulation(self, key):
+        #Simulation recorded under key (spec hash or "base:" + base hash), checked with the server
+        scope = self._cache_scope("simulations", self.project_id)
+        for index in (lambda: self.simulation_cache.get_index(scope, dict), self._simulation_index):
+            simulation_id = index().get(key)
+            if simulation_id is not None and self._verify_simulation(simulation_id):
+                return simulation_id
+        return None
+    
+    def _verify_simulation(self, simulation_id):
+        #The simulation still exists and was not edited since it was recorded
+        scope = self._cache_scope("simulations", self.project_id)
+        try:
+            spec = self.simulation_api.get_simulation(self.project_id, simulation_id)
+        except sim_sdk.ApiException as ae:
+            if ae.status == 404:
+                print(f"Simulation {simulation_id} no longer exists")
+                self._forget_simulation(simulation_id)
+                return False
+            raise
+        recorded = self.simulation_cache.lookup(scope, "server:" + simulation_id, dict)
+        if recorded is not None and recorded != self.get_spec_hash(spec):
+            print(f"Simulation {simulation_id} was changed on the server, not reusing it")
+            self._forget_simulation(simulation_id)
+            return False
+        return True
+    
+    def _forget_simulation(self, simulation_id, keep_base = False):
+        #Drop every index entry pointing to the simulation
+        scope = self._cache_scope("simulations", self.project_id)
+        for cache, index in ((self.simulation_cache, self.simulation_cache.get_index(scope, dict)), 
+                             (self.lookup_cache, self._simulation_index())):
+            for key, value in list(index.items()):
+                if value == simulation_id and not (keep_base and key.startswith("base:")):
+                    cache.remove(scope, key)
+    
+    def _remember_simulation(self, spec_hash, base_hash):
+        #Persistent spec hash -> id entries, and the hash of the spec as the server stores it
+        scope = self._cache_scope("simulations", self.project_id)
+        self.simulation_cache.get_index(scope, dict)
+        self.simulation_cache.add(scope, spec_hash, self.simulation_id)
+        self.simulation_cache.add(scope, base_hash, self.simulation_id)
+        spec = self.simulation_api.get_simulation(self.project_id, self.simulation_id)
+        self.simulation_cache.add(scope, "server:" + self.simulation_id, self.get_spec_hash(spec))
+        self.lookup_cache.add(scope, spec_hash, self.simulation_id)
+    
+    def create_or_reuse_simulation(self, simulation_spec = None):
+        
+        '''
+        Reuse a simulation of the project with the same setup instead of 
+        creating a new one 
+        
+        - identical spec hash: the simulation is reused as it is 
+        - identical apart from the simulation control or the comfort map 
+          names and heights: the simulation is updated with the new spec 
+        - otherwise a new simulation is created 
+        
+        The outcome is stored in simulation_origin, a reused or updated 
+        simulation was checked when it was created so check_simulation_setup 
+        can be skipped. 
+        
+        note: 
+            Simulations created or updated here are recorded by the hash of 
+            the local spec in a persistent index, together with the hash of 
+            the spec read back from the server, so a later edit in the 
+            workbench is detected. Simulations created elsewhere are found 
+            through an index of the project simulations (one request per 
+            simulation, kept in the lookup cache), the specs are normalized 
+            before hashing (see _normalize_spec). A simulation is checked 
+            with one request before it is reused.
+        
+        Parameters
+        ----------
+        simulation_spec: sim_sdk.SimulationSpec, optional
+            the default is simulation_spec
+
+        Returns 
+        -------
+        simulation_origin : str
+            created, reused or updated
+        
+        '''
+        if simulation_spec is not None:
+            self.simulation_spec = simulation_spec
+            self.model = simulation_spec.model
+        if self._simulation_from_ledger():
+            return self.simulation_origin
+        
+        spec_hash = self.get_spec_hash()
+        base_hash = "base:" + self.get_spec_base_hash()
+        
+        simulation_id = self._find_simulation(spec_hash)
+        if simulation_id is not None:
+            self.simulation_id = simulation_id
+            self.simulation_origin = "reused"
+        else:
+            simulation_id = self._find_simulation(base_hash)
+            if simulation_id is not None:
+                self.simulation_id = simulation_id
+                self.simulation_api.update_simulation(self.project_id, self.simulation_id, self.simulation_spec)
+                #The old spec of this simulation must not be reused any more
+                self._forget_simulation(self.simulation_id, keep_base = True)
+                self.simulation_origin = "updated"
+            else:
+                self.create_simulation()
+                self.simulation_origin = "created"
+        
+        self._remember_simulation(spec_hash, base_hash)
+        if self.simulation_origin != "created":
+            print(f"simulationId: {self.simulation_id} ({self.simulation_origin})")
+            self._record_simulation_in_ledger()
+        return self.simulation_origin
+
+
+    def get_spec_hash(self, simulation_spec=None):
+        
+        '''
+        Hash of the simulation spec (without its name) and geometry id, 
+        identical setups give the same hash
+        
+        Parameters
+        ----------
+        simulation_spec : SimulationSpec, optional
+            the default is simulation_spec
+
+        Returns
+        -------
+        spec_hash : str
+
+        '''
+        simulation_spec = self.simulation_spec if simulation_spec is None else simulation_spec
+        spec = self.api_client.sanitize_for_serialization(simulation_spec)
+        return self._hash_spec(spec, simulation_spec.geometry_id)
+    
+    def get_spec_base_hash(self, simulation_spec=None):
+        
+        '''
+        Hash of the simulation spec without the settings that can be updated 
+        on an existing simulation (simulation control, comfort map names and 
+        heights), see create_or_reuse_simulation
+        
+        Parameters
+        ----------
+        simulation_spec : SimulationSpec, optional
+            the default is simulation_spec
+
+        Returns
+        -------
+        spec_hash : str
+
+        '''
+        simulation_spec = self.simulation_spec if simulation_spec is None else simulation_spec
+        spec = self.api_client.sanitize_for_serialization(simulation_spec)
+        model = spec.get("model", {})
+        model.pop("simulationControl", None)
+        for comfort_map in model.get("pedestrianComfortMap") or []:
+            comfort_map.pop("name", None)
+            comfort_map.pop("heightAboveGround", None)
+        return self._hash_spec(spec, simulation_spec.geometry_id)
+    
+    def get_flow_hash(self, simulation_spec=None):
+        
+        '''
+        Hash of the parts of the simulation spec that determine the flow 
+        solution of each wind direction, i.e. without the wind statistics 
+        (velocity buckets and their source) and the geographical location
+        
+        note: 
+            The exposure categories, wind engineering standard and surface 
+            roughness set the inflow profile, so they stay part of the hash.
+        
+        Parameters
+        ----------
+        simulation_spec : SimulationSpec, optional
+            the default is simulation_spec
+
+        Returns
+        -------
+        flow_hash : str
+
+        '''
+        simulation_spec = self.simulation_spec if simulation_spec is None else simulation_spec
+        spec = self._flow_spec(simulation_spec)
+        return self._hash_spec(spec, simulation_spec.geometry_id)
+    
+    def get_direction_hash(self, simulation_spec=None, offset=None):
+        
+        '''
+        Hash of the flow setup (see get_flow_hash) without the wind 
+        directions, i.e. without their number and exposure categories and 
+        with the north angle of the model before any direction offset. Runs 
+        with the same hash have comparable results per wind direction.
+        
+        Parameters
+        ----------
+        simulation_spec : SimulationSpec, optional
+            the default is simulation_spec
+            
+        offset : float, optional
+            direction offset (degrees) the spec was built with, the default 
+            is wind_direction_offset
+
+        Returns
+        -------
+        direction_hash : str
+
+        '''
+        simulation_spec = self.simulation_spec if simulation_spec is None else simulation_spec
+        offset = self.wind_direction_offset if offset is None else offset
+        spec = self._flow_spec(simulation_spec)
+        model = spec.get("model", {})
+        for key in ("numDirections", "exposureCategories"):
+            ((model.get("windConditions") or {}).get("windRose") or {}).pop(key, None)
+        north_angle = (model.get("regionOfInterest") or {}).get("northAngle")
+        if north_angle:
+            north_angle["value"] = round(float(north_angle["value"] - NORTH_ANGLE_SIGN * offset) % 360, 6)
+        return self._hash_spec(spec, simulation_spec.geometry_id)
+    
+    def _flow_spec(self, simulation_spec):
+        #Serialized spec without the wind statistics, see get_flow_hash
+        spec = self.api_client.sanitize_for_serialization(simulation_spec)
+        wind_conditions = spec.get("model", {}).get("windConditions") or {}
+        wind_conditions.pop("geographicalLocation", None)
+        for key in ("velocityBuckets", "windDataSource", "velocityUnit"):
+            (wind_conditions.get("windRose") or {}).pop(key, None)
+        return spec
+    
+    def _hash_spec(self, spec, geometry_id):
+        #spec is the serialized SimulationSpec, its name does not change the setup
+        spec.pop("name", None)
+        spec = json.dumps({"spec" : _normalize_spec(spec), "geometry_id" : geometry_id}, sort_keys=True)
+        return hashlib.sha256(spec.encode()).hexdigest()
+    
+    def get_estimate(self, simulation_id=None, simulation_spec=None):
+        
+        '''
+        Estimate the cell count, GPUh and duration of a created simulation 
+        without printing anything
+        
+        Estimates are cached locally by the hash of the simulation spec and 
+        geometry id (see get_spec_hash), so the same setup is only estimated 
+        once by the server.
+        
+        Parameters
+        ----------
+        simulation_id : str, optional
+            the default is simulation_id
+            
+        simulation_spec : SimulationSpec, optional
+            spec of that simulation, the default is simulation_spec
+
+        Returns
+        -------
+        estimate : dict
+            available (False if the server cannot estimate the setup) and 
+            cell_count, compute_resource (GPUh) and duration (seconds), each 
+            as a dict with value, interval_min and interval_max
+
+        '''
+        simulation_id = self.simulation_id if simulation_id is None else simulation_id
+        simulation_spec = self.simulation_spec if simulation_spec is None else simulation_spec
+        
+        scope = self._cache_scope("estimates")
+        spec_hash = self.get_spec_hash(simulation_spec)
+        estimate = self.estimate_cache.lookup(scope, spec_hash, dict)
+        if estimate is not None:
+            return estimate
+        
+        try:
+            estimation = self.simulation_api.estimate_simulation_setup(self.project_id, simulation_id)
+        except sim_sdk.ApiException as ae:
+            if ae.status == 422:
+                #Not cached, the estimate may become available later
+                return {"available" : False}
+            raise ae
+        
+        def interval(quantity, convert=float):
+            if quantity is None:
+                return None
+            return {key : None if getattr(quantity, key, None) is None else convert(getattr(quantity, key))
+                    for key in ("value", "interval_min", "interval_max")}
+        
+        to_seconds = lambda duration: isodate.parse_duration(duration).total_seconds()
+        estimate = {"available" : True,
+                    "cell_count" : interval(estimation.cell_count),
+                    "compute_resource" : interval(estimation.compute_resource),
+                    "duration" : interval(estimation.duration, to_seconds)}
+        self.estimate_cache.add(scope, spec_hash, estimate)
+        self.cost_model.add(self.get_cost_features(simulation_spec), estimate)
+        return estimate
+    
+    def get_cost_features(self, simulation_spec=None):
+        
+        '''
+        Setup parameters used by the local cost model, see CostModel
+        
+        Parameters
+        ----------
+        simulation_spec : SimulationSpec, optional
+            spec to describe, the default is the current setup (the settings 
+            of set_region_of_interest, set_mesh_settings etc.)
+        
+        Returns
+        -------
+        features : dict
+            roi_radius, mesh_fineness, reynolds_scaling (None for automatic), 
+            num_wind_directions and triangle_count (None if preflight_geometry 
+            was not run)
+
+        '''
+        triangle_count = self.geometry_stats["triangle_count"] if self.geometry_stats else None
+        if simulation_spec is not None:
+            model = simulation_spec.model
+            mesh = model.mesh_settings
+            return {"roi_radius" : model.region_of_interest.disc_radius.value,
+                    "mesh_fineness" : _mesh_fineness_name(mesh.wind_comfort_fineness),
+                    "reynolds_scaling" : getattr(mesh.reynolds_scaling_type, "reynolds_scaling_factor", None),
+                    "num_wind_directions" : model.wind_conditions.wind_rose.num_directions,
+                    "triangle_count" : triangle_count}
+        return {"roi_radius" : self.roi_radius, 
+                "mesh_fineness" : self.mesh_fineness_name,
+                "reynolds_scaling" : self.reynolds_scaling_factor,
+                "num_wind_directions" : self.number_wind_directions,
+                "triangle_count" : triangle_count}
+    
+    def predict_cost(self, verbose=True):
+        
+        '''
+        Instant local prediction of the cell count, GPUh and duration of the 
+        current setup from the history of server estimates, see CostModel. 
+        Call it once the region of interest and the mesh settings are set, 
+        the setters themselves do not read the history.
+        
+        Returns
+        -------
+        prediction : dict
+            value of cell_count, compute_resource (GPUh) and duration 
+            (seconds), None if there is not enough history yet
 
+        '''
+        prediction = self.cost_model.predict(self.get_cost_features())
+        if prediction is not None and verbose:
+            print("Predicted cost: ~{cells:.3g} cells, ~{gpuh:.3g} GPUh, ~{duration:.0f} s".format(
+                cells = prediction["cell_count"], gpuh = prediction["compute_resource"], 
+                duration = prediction["duration"]))
+        return prediction
 
-    def estimate_simulation(self):
+    def estimate_simulation(self, max_gpuh=10.0):
         '''
         Provide an estimation of the maximum and minimum number of cells, 
         the amount of resources to be used and the total estimated duration of 
@@ -1115,42 +2459,43 @@ class PedestrianWindComfort():
 
         Parameters
         ----------
+        max_gpuh : float, optional
+            raise if the estimated GPUh are above this value, default is 10
 
         Returns 
         -------
-        None.  
+        estimate : dict
+            see get_estimate
         
         '''
-        try:
-            estimation = self.simulation_api.estimate_simulation_setup(self.project_id, self.simulation_id)
-            # print(f"Simulation estimation: {estimation}\n")
+        estimate = self.get_estimate()
+        if estimate["available"]:
             print("*"*10)
             print(f"Simulation estimation:")    
-            print("Number of cells: {i} - {k}".format(i = estimation.cell_count.interval_min,
-                                                     k = estimation.cell_count.interval_max ))
-            print("-"*10)
-            print("GPUh consumption: {i} - {k}".format(i = estimation.compute_resource.interval_min,
-                                                      k = estimation.compute_resource.interval_max ))
-            print("-"*10)
-            print("Simulation Time: {i} - {k}".format(i = estimation.duration.interval_min.replace('PT',''),
-                                                      k = estimation.duration.interval_max.replace('PT','') ))
+            for label, key in (("Number of cells", "cell_count"), ("GPUh consumption", "compute_resource"),
+                               ("Simulation Time [s]", "duration")):
+                if estimate[key] is not None:
+                    print("{label}: {i} - {k}".format(label = label, i = estimate[key]["interval_min"],
+                                                      k = estimate[key]["interval_max"]))
+                    print("-"*10)
             print("*"*10)
             
-            if estimation.compute_resource is not None and estimation.compute_resource.value > 10.0:
-                raise Exception("Too expensive", estimation)
+            gpuh = None if estimate["compute_resource"] is None else estimate["compute_resource"]["value"]
+            if gpuh is not None and gpuh > max_gpuh:
+                raise Exception("Too expensive", estimate)
         
-            if estimation.duration is not None:
-                max_runtime = isodate.parse_duration(estimation.duration.interval_max).total_seconds()
-                max_runtime = max(3600, max_runtime * 2)
+            if estimate["duration"] is not None:
+                max_runtime = max(3600, estimate["duration"]["interval_max"] * 2)
             else:
                 max_runtime = 36000
                 print(f"Simulation estimated duration not available, assuming max runtime of {max_runtime} seconds")
-        except sim_sdk.ApiException as ae:
-            if ae.status == 422:
-                max_runtime = 36000
-                print(f"Simulation estimation not available, assuming max runtime of {max_runtime} seconds")
-            else:
-                raise ae
+        else:
+            max_runtime = 36000
+            print(f"Simulation estimation not available, assuming max runtime of {max_runtime} seconds")
+        
+        #Used as the timeout of wait_for_run
+        self.max_runtime = max_runtime
+        return estimate
               
                 
     def check_simulation_setup(self):
@@ -1179,22 +2524,3260 @@ class PedestrianWindComfort():
     def start_simulation_run(self, run_name): 
         
         '''
-        Start the simulation run 
+        Start a new run of the simulation 
         Parameters
         ----------
+        run_name: str 
+            name of the run
 
         Returns 
         -------
         None.  
         
         '''
+        ledger_inputs = (self.host, self.project_id, self.simulation_id, 
+                         None if self.simulation_spec is None else self.get_spec_hash(), run_name)
+        run = self._ledger_result("run", ledger_inputs)
+        simulation_run = None if run is None else self._ledger_run(run["run_id"])
+        if simulation_run is None and run is not None:
+            #The run was deleted, failed or canceled, a new one is created
+            self._ledger_forget("run", ledger_inputs)
+        elif simulation_run is not None:
+            #Created by an earlier run of the pipeline, only started if that did not happen yet
+            self.run_id = run["run_id"]
+            print(f"runId: {self.run_id} (run ledger)")
+            if not run["started"]:
+                self.simulation_run_api.start_simulation_run(self.project_id, self.simulation_id, self.run_id)
+                self._ledger_record("run", ledger_inputs, {"run_id" : self.run_id, "started" : True})
+                simulation_run = self.simulation_run_api.get_simulation_run(self.project_id, self.simulation_id, self.run_id)
+            #Registering again is harmless and covers a crash right after the start
+            self._register_flow_run()
+            self.simulation_run = simulation_run
+            return
+        
         # Create simulation run
-        self.simulation_run = sim_sdk.SimulationRun(name="Run 1")
+        self.simulation_run = sim_sdk.SimulationRun(name=run_name)
         self.simulation_run = self.simulation_run_api.create_simulation_run(self.project_id, self.simulation_id, self.simulation_run)
         self.run_id = self.simulation_run.run_id
         print(f"runId: {self.run_id}")
+        self._ledger_record("run", ledger_inputs, {"run_id" : self.run_id, "started" : False})
         
         #Start Simulation Run 
         self.simulation_run_api.start_simulation_run(self.project_id, self.simulation_id, self.run_id)
+        self._ledger_record("run", ledger_inputs, {"run_id" : self.run_id, "started" : True})
+        #Only a started run provides its directions to later runs
+        self._register_flow_run()
         self.simulation_run = self.simulation_run_api.get_simulation_run(self.project_id, self.simulation_id, self.run_id)
 
+    def _ledger_run(self, run_id):
+        #The run of a ledger row, None if it no longer exists or ended without results
+        try:
+            simulation_run = self.simulation_run_api.get_simulation_run(self.project_id, self.simulation_id, run_id)
+        except sim_sdk.ApiException as ae:
+            if ae.status == 404:
+                return None
+            raise
+        if simulation_run.status in ('FAILED', 'CANCELED'):
+            print(f"Run {run_id} from the run ledger is {simulation_run.status}, starting a new run")
+            return None
+        return simulation_run
+
+    def wait_for_run(self, timeout=None):
+        
+        '''
+        Block until the simulation run is finished, canceled or failed. The 
+        run is polled by the shared poller with exponential backoff.
+        
+        Parameters
+        ----------
+        timeout : int, optional
+            seconds to wait before giving up
+            
+            The default is the max_runtime derived from estimate_simulation.
+
+        Raises
+        ------
+        TimeoutError
+            If the run did not end within timeout seconds.
+
+        Returns
+        -------
+        simulation_run : SimulationRun
+            the last state of the run
+
+        '''
+        key = self.add_run_to_poller(timeout)
+        self.simulation_run = self.poller.wait([key])[key]
+        return self.simulation_run
+    
+    def add_run_to_poller(self, timeout=None, on_update=None):
+        
+        '''
+        Register the current simulation run with the shared poller, so it can 
+        be waited for together with other pending jobs
+        
+        Parameters
+        ----------
+        timeout : int, optional
+            seconds to wait before giving up
+            
+            The default is the max_runtime derived from estimate_simulation.
+            
+        on_update : callable, optional
+            called with the SimulationRun after every poll
+
+        Returns
+        -------
+        key : tuple
+            key of the job in the poller
+
+        '''
+        project_id, simulation_id, run_id = self.project_id, self.simulation_id, self.run_id
+        if on_update is None:
+            on_update = lambda run: print(f'Simulation run status: {run.status}')
+            
+        key = ("simulation_run", run_id)
+        self.poller.add_job(
+            key,
+            fetch = lambda: self.simulation_run_api.get_simulation_run(project_id, simulation_id, run_id),
+            is_done = lambda run: run.status in ('FINISHED', 'CANCELED', 'FAILED'),
+            timeout = self.max_runtime if timeout is None else timeout,
+            on_update = on_update)
+        return key
+
+    def evaluate_comfort(self, velocity_ratios, wind_rose=None, standard=None, criterion=None, 
+                         chunk_size=256 * 1024):
+        
+        '''
+        Evaluate the pedestrian comfort of every comfort map locally from the 
+        per direction velocity ratio fields of a run, e.g. to compare wind 
+        roses or standards without a new CFD run (see comfort_statistics) 
+        
+        Parameters
+        ----------
+        velocity_ratios : dict
+            per comfort map name, a (points, num_directions) array of local 
+            to reference wind speed ratios or the path of a .npy file holding 
+            it (memory-mapped, so it is read chunk by chunk)
+            
+        wind_rose : sim_sdk.WindRose or dict, optional
+            the default is wind_rose
+            
+        standard : str, optional
+            wind engineering standard that selects the comfort criterion (see 
+            STANDARD_COMFORT_CRITERIA), the default is wind_engineering_standard
+            
+        criterion : str, optional
+            key of COMFORT_CRITERIA, overrides standard
+            
+        chunk_size : int, optional
+            number of points evaluated at once
+
+        Returns
+        -------
+        comfort_results : dict
+            comfort_statistics of every map, by comfort map name
+
+        '''
+        wind_rose = self.wind_rose if wind_rose is None else wind_rose
+        if wind_rose is None:
+            raise Exception("No wind rose, call set_wind_rose or pass one")
+        if criterion is None:
+            standard = self.wind_engineering_standard if standard is None else standard
+            if standard not in STANDARD_COMFORT_CRITERIA:
+                raise Exception(f"No comfort criterion for the wind engineering standard: {standard}")
+            criterion = STANDARD_COMFORT_CRITERIA[standard]
+        
+        map_names = [comfort_map.name for comfort_map in self.pedestrian_comfort_map]
+        results = {}
+        for name, ratios in velocity_ratios.items():
+            if map_names and name not in map_names:
+                raise Exception(f"Unknown comfort map: {name}")
+            if isinstance(ratios, (str, pathlib.Path)):
+                ratios = np.load(ratios, mmap_mode = "r")
+            results[name] = comfort_statistics(ratios, wind_rose, criterion, chunk_size)
+            counts = np.bincount(results[name]["comfort_class"], 
+                                 minlength = len(results[name]["comfort_labels"]))
+            print(f"{name}: " + ", ".join(f"{label} {count / max(len(ratios), 1):.1%}" 
+                                          for label, count in zip(results[name]["comfort_labels"], counts)))
+        
+        self.comfort_results.update(results)
+        return results
+
+    def _register_flow_run(self):
+        #Remember the run by the flow hash of its spec, see what_if_wind_rose
+        if self.simulation_spec is None:
+            return
+        scope = self._cache_scope("flow_runs", self.project_id)
+        self.flow_run_cache.get_index(scope, dict)
+        self.flow_run_cache.add(scope, self.get_flow_hash(), [self.simulation_id, self.run_id])
+        
+        #Every direction of the run by its true angle, see plan_wind_directions
+        wind_rose = self.simulation_spec.model.wind_conditions.wind_rose
+        categories = list(wind_rose.exposure_categories or [])
+        scope = self._cache_scope("wind_directions", self.project_id)
+        direction_hash = self.get_direction_hash()
+        directions = dict(self.direction_cache.get_index(scope, dict).get(direction_hash) or {})
+        for column, angle in enumerate(wind_direction_angles(wind_rose.num_directions, self.wind_direction_offset)):
+            directions[_angle_key(angle)] = [self.simulation_id, self.run_id, column, 
+                                             categories[column] if column < len(categories) else None]
+        self.direction_cache.add(scope, direction_hash, directions)
+        
+    def find_flow_run(self, simulation_spec=None):
+        
+        '''
+        Look up a run of the project that was started with the same flow 
+        setup (see get_flow_hash) 
+        
+        Parameters
+        ----------
+        simulation_spec : SimulationSpec, optional
+            the default is simulation_spec
+
+        Returns
+        -------
+        run : tuple
+            (simulation_id, run_id), None if there is no such run
+
+        '''
+        scope = self._cache_scope("flow_runs", self.project_id)
+        run = self.flow_run_cache.lookup(scope, self.get_flow_hash(simulation_spec), dict)
+        return None if run is None else tuple(run)
+    
+    def _velocity_ratio_dir(self, project_id=None, simulation_id=None, run_id=None):
+        project_id = self.project_id if project_id is None else project_id
+        simulation_id = self.simulation_id if simulation_id is None else simulation_id
+        run_id = self.run_id if run_id is None else run_id
+        return pathlib.Path(self.results_dir) / project_id / simulation_id / run_id / "velocity_ratios"
+    
+    def save_velocity_ratios(self, velocity_ratios, project_id=None, simulation_id=None, run_id=None):
+        
+        '''
+        Store the per direction velocity ratio fields of a run next to its 
+        downloaded results, so comfort can later be re-evaluated for other 
+        wind roses (see what_if_wind_rose) 
+        
+        Parameters
+        ----------
+        velocity_ratios : dict
+            (points, num_directions) array per comfort map name
+            
+        project_id, simulation_id, run_id : str, optional
+            the default is the current run
+
+        Returns
+        -------
+        paths : dict
+            .npy path of every map, by comfort map name
+
+        '''
+        directory = self._velocity_ratio_dir(project_id, simulation_id, run_id)
+        directory.mkdir(parents = True, exist_ok = True)
+        paths = {}
+        for name, ratios in velocity_ratios.items():
+            paths[name] = directory / (re.sub(r"[^\w.-]+", "_", name).strip("_") + ".npy")
+            np.save(paths[name], np.asarray(ratios, dtype = np.float32))
+        
+        index_path = directory / "maps.json"
+        index = self.load_velocity_ratios(project_id, simulation_id, run_id)
+        index.update(paths)
+        with open(index_path, 'w') as file:
+            json.dump({name : path.name for name, path in index.items()}, file, indent = 1)
+        return paths
+    
+    def load_velocity_ratios(self, project_id=None, simulation_id=None, run_id=None):
+        
+        '''
+        Paths of the velocity ratio fields stored with save_velocity_ratios, 
+        by comfort map name (empty if none are stored) 
+        
+        '''
+        directory = self._velocity_ratio_dir(project_id, simulation_id, run_id)
+        try:
+            with open(directory / "maps.json", 'r') as file:
+                return {name : directory / file_name for name, file_name in json.load(file).items()}
+        except (OSError, ValueError):
+            return {}
+    
+    def what_if_wind_rose(self, wind_rose=None, standard=None, criterion=None, chunk_size=256 * 1024):
+        
+        '''
+        Re-evaluate the comfort maps for another wind rose without a new CFD 
+        run, when a run with the same flow setup exists 
+        
+        The flow solution of each direction does not depend on the wind 
+        statistics. If the current setup differs from a previous run only in 
+        its wind rose frequencies, velocity buckets or location (see 
+        get_flow_hash), the stored velocity ratios of that run are recombined 
+        locally with evaluate_comfort. 
+        
+        note: 
+            The velocity ratios are not extracted from the downloaded results 
+            (download_run_results), they must have been stored for the run 
+            with save_velocity_ratios beforehand. 
+        
+        Parameters
+        ----------
+        wind_rose : sim_sdk.WindRose or dict, optional
+            the default is wind_rose, e.g. after set_geographical_location 
+            and set_wind_rose for another site. Only the frequencies and 
+            velocity buckets may differ from the run, its exposure categories 
+            and wind engineering standard must be the same.
+            
+        standard, criterion, chunk_size : optional
+            see evaluate_comfort
+
+        Returns
+        -------
+        comfort_results : dict
+            see evaluate_comfort, None if no run with the same flow setup 
+            exists and a new simulation is needed
+
+        '''
+        #The current setup, simulation_spec may be from before the last changes
+        simulation_spec = self.get_spec_template("what-if").build()
+        if wind_rose is not None:
+            current = self.api_client.sanitize_for_serialization(simulation_spec.model.wind_conditions.wind_rose)
+            other = wind_rose if isinstance(wind_rose, dict) else self.api_client.sanitize_for_serialization(wind_rose)
+            for key in ("exposureCategories", "windEngineeringStandard"):
+                if other.get(key) != current.get(key):
+                    raise Exception(f"The wind rose differs from the run in {key}: {other.get(key)} "
+                                    f"instead of {current.get(key)}, a new simulation is needed")
+            
+        run = self.find_flow_run(simulation_spec)
+        if run is None:
+            print("No run with the same flow setup, a new simulation is needed")
+            return None
+        
+        simulation_id, run_id = run
+        velocity_ratios = self.load_velocity_ratios(self.project_id, simulation_id, run_id)
+        if not velocity_ratios:
+            raise Exception(f"Run {run_id} has the same flow setup but its velocity ratios are not "
+                            "stored locally, see save_velocity_ratios")
+        print(f"Recombining the results of run {run_id} with the new wind rose")
+        return self.evaluate_comfort(velocity_ratios, wind_rose, standard, criterion, chunk_size)
+
+    def _known_wind_directions(self, simulation_spec, check_runs):
+        #True angle key -> [simulation_id, run_id, column, category] of the runs with the same direction hash
+        scope = self._cache_scope("wind_directions", self.project_id)
+        directions = self.direction_cache.get_index(scope, dict).get(
+            self.get_direction_hash(simulation_spec, offset = 0)) or {}
+        if check_runs:
+            failed = set()
+            for simulation_id, run_id in {(entry[0], entry[1]) for entry in directions.values()}:
+                run = self.simulation_run_api.get_simulation_run(self.project_id, simulation_id, run_id)
+                if run.status in ('FAILED', 'CANCELED'):
+                    failed.add(run_id)
+            directions = {key : entry for key, entry in directions.items() if entry[1] not in failed}
+        return directions
+    
+    def plan_wind_directions(self, simulation_name=None, check_runs=True):
+        
+        '''
+        Plan the runs needed to get results for all the wind directions of 
+        the current setup, given the directions that runs with the same 
+        geometry, mesh and region of interest (see get_direction_hash) 
+        already cover 
+        
+        The missing directions are split into evenly spaced sets that are 
+        simulated as separate runs with fewer directions and a rotated north 
+        angle, e.g. going from 8 to 16 directions needs one run of 8 
+        directions rotated by 22.5°. If the missing directions cannot be 
+        split like this, the plan is a single run of all directions.
+        
+        Parameters
+        ----------
+        simulation_name : str, optional
+            name of the planned simulations, the offset is appended, the 
+            default is the name of simulation_spec
+            
+        check_runs : bool, optional
+            ignore the directions of failed or canceled runs (one request 
+            per run), default is True
+
+        Returns
+        -------
+        plan : list
+            one dict per run with offset (degrees), num_directions and spec 
+            (sim_sdk.SimulationSpec), empty if all directions have results
+
+        '''
+        if simulation_name is None:
+            simulation_name = self.simulation_spec.name if self.simulation_spec is not None else "Pedestrian Wind Comfort"
+        template = self.get_spec_template(simulation_name)
+        wind_rose = template.wind_rose
+        num_directions = wind_rose.num_directions
+        categories = list(wind_rose.exposure_categories or [None] * num_directions)
+        
+        known = self._known_wind_directions(template.build(), check_runs)
+        angles = wind_direction_angles(num_directions)
+        missing = [index for index, angle in enumerate(angles) 
+                   if (known.get(_angle_key(angle)) or [None] * 4)[3] != categories[index]]
+        
+        plan = []
+        for first, count in plan_wind_direction_runs(num_directions, missing):
+            step = num_directions // count
+            offset = angles[first]
+            sub_rose = _wind_rose_subset(wind_rose, first, step)
+            spec = template.with_(
+                name = f"{template.name} +{offset:g}°" if offset else template.name,
+                north_angle = (self.north_angle + NORTH_ANGLE_SIGN * offset) % 360,
+                wind_rose = sub_rose).build()
+            plan.append({"offset" : offset, "num_directions" : count, "spec" : spec})
+        print(f"Wind directions: {num_directions - len(missing)} of {num_directions} have results, "
+              f"{len(plan)} runs planned")
+        return plan
+    
+    def run_missing_wind_directions(self, run_name, simulation_name=None, check_runs=True):
+        
+        '''
+        Create, check and start the runs of plan_wind_directions one after 
+        the other, their directions are registered once started 
+        
+        Returns
+        -------
+        runs : list
+            (simulation_id, run_id, offset) of every started run
+
+        '''
+        plan = self.plan_wind_directions(simulation_name, check_runs)
+        full_spec, runs = self.simulation_spec, []
+        try:
+            for entry in plan:
+                self.wind_direction_offset = entry["offset"]
+                self.create_simulation(entry["spec"])
+                self.check_simulation_setup()
+                self.start_simulation_run(run_name)
+                runs.append((self.simulation_id, self.run_id, entry["offset"]))
+        finally:
+            self.wind_direction_offset = 0
+            self.simulation_spec = full_spec
+            self.model = None if full_spec is None else full_spec.model
+        return runs
+    
+    def merge_wind_directions(self, simulation_spec=None):
+        
+        '''
+        Assemble the velocity ratio fields of all the directions of the setup 
+        from the runs that computed them (stored with save_velocity_ratios), 
+        for evaluate_comfort
+        
+        note: 
+            The comfort maps of the merged runs must be sampled at the same 
+            points, which holds for runs of the same geometry and comfort 
+            map setup. The velocity ratios are not extracted from the 
+            downloaded results, they must be stored for every merged run with 
+            save_velocity_ratios beforehand.
+        
+        Parameters
+        ----------
+        simulation_spec : SimulationSpec, optional
+            setup with all the directions, the default is simulation_spec
+
+        Returns
+        -------
+        velocity_ratios : dict
+            (points, num_directions) array per comfort map name
+
+        '''
+        simulation_spec = self.simulation_spec if simulation_spec is None else simulation_spec
+        wind_rose = simulation_spec.model.wind_conditions.wind_rose
+        known = self._known_wind_directions(simulation_spec, check_runs = False)
+        
+        sources = []
+        for angle in wind_direction_angles(wind_rose.num_directions):
+            entry = known.get(_angle_key(angle))
+            if entry is None:
+                raise Exception(f"No results for the wind direction {angle:g}°, see run_missing_wind_directions")
+            sources.append(entry)
+        
+        fields = {}
+        for simulation_id, run_id in {(entry[0], entry[1]) for entry in sources}:
+            paths = self.load_velocity_ratios(self.project_id, simulation_id, run_id)
+            if not paths:
+                raise Exception(f"The velocity ratios of run {run_id} are not stored, see save_velocity_ratios")
+            fields[run_id] = {name : np.load(path, mmap_mode = "r") for name, path in paths.items()}
+        
+        velocity_ratios = {}
+        for name in set.intersection(*(set(maps) for maps in fields.values())):
+            num_points = {len(maps[name]) for maps in fields.values()}
+            if len(num_points) > 1:
+                raise Exception(f"The runs sampled the comfort map {name} at different points")
+            merged = np.empty((num_points.pop(), len(sources)), dtype = np.float32)
+            for direction, (_, run_id, column, _) in enumerate(sources):
+                merged[:, direction] = fields[run_id][name][:, column]
+            velocity_ratios[name] = merged
+        return velocity_ratios
+
+    def list_run_results(self, project_id=None, simulation_id=None, run_id=None):
+        
+        '''
+        List the downloadable results of a finished run (comfort maps of each 
+        comfort surface, statistical averages, transient exports) 
+        
+        Parameters
+        ----------
+        project_id, simulation_id, run_id : str, optional
+            the default is the current run
+
+        Returns
+        -------
+        results : list
+            one dict per result with its type, category, quantity, name, 
+            direction and download (url, format, size)
+
+        '''
+        project_id = self.project_id if project_id is None else project_id
+        simulation_id = self.simulation_id if simulation_id is None else simulation_id
+        run_id = self.run_id if run_id is None else run_id
+        
+        results = self._get_all_pages(
+            lambda **kwargs: self.simulation_run_api.get_simulation_run_results(
+                project_id, simulation_id, run_id, **kwargs))
+        return [result for result in results if (result.get('download') or {}).get('url')]
+    
+    def download_run_results(self, project_id=None, simulation_id=None, run_id=None, 
+                             results=None, max_workers=None, verify=True, chunk_size=256 * 1024):
+        
+        '''
+        Download the results of a run concurrently into the local results 
+        cache results_dir/<project_id>/<simulation_id>/<run_id>/
+        
+        Files are first written to a .part file. An interrupted download is 
+        resumed with a range request, and the file is only moved to its final 
+        name once complete. The size and SHA-256 of every file are kept in the 
+        manifest.json of the run, so files that are already complete are not 
+        downloaded again.
+        
+        note: 
+            The API does not publish checksums of the results. A download is 
+            verified against the announced size and, when the server sends 
+            a plain MD5 ETag, against that digest. 
+        
+        Parameters
+        ----------
+        project_id, simulation_id, run_id : str, optional
+            the default is the current run
+            
+        results : list, optional
+            results to download as returned by list_run_results, the default 
+            is all results of the run
+            
+        max_workers : int, optional
+            number of parallel downloads, the default is download_workers
+            
+        verify : bool, optional
+            check the SHA-256 of files already in the cache against the 
+            manifest instead of only their size, default is True
+            
+        chunk_size : int, optional
+            Number of bytes read and written per chunk.
+
+        Raises
+        ------
+        Exception
+            After all downloads are done, if any of them failed.
+
+        Returns
+        -------
+        paths : dict
+            local path of every result, by file name
+
+        '''
+        project_id = self.project_id if project_id is None else project_id
+        simulation_id = self.simulation_id if simulation_id is None else simulation_id
+        run_id = self.run_id if run_id is None else run_id
+        if results is None:
+            results = self.list_run_results(project_id, simulation_id, run_id)
+        
+        run_dir = pathlib.Path(self.results_dir) / project_id / simulation_id / run_id
+        run_dir.mkdir(parents = True, exist_ok = True)
+        manifest_path = run_dir / "manifest.json"
+        try:
+            with open(manifest_path, 'r') as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            manifest = {}
+        manifest_lock = threading.Lock()
+        
+        def download(file_name, result):
+            path = run_dir / file_name
+            entry = manifest.get(file_name)
+            if entry is not None and path.exists() and path.stat().st_size == entry["size"]:
+                if not verify or _file_digest(path, "sha256", chunk_size) == entry["sha256"]:
+                    return path
+            
+            self._download_result(result['download']['url'], path, chunk_size)
+            with manifest_lock:
+                manifest[file_name] = {
+                    "size" : path.stat().st_size,
+                    "sha256" : _file_digest(path, "sha256", chunk_size),
+                    "result" : {key : result.get(key) for key in 
+                                ('type', 'category', 'quantity', 'name', 'direction')}}
+                tmp_path = manifest_path.with_suffix(f".{os.getpid()}.tmp")
+                with open(tmp_path, 'w') as file:
+                    json.dump(manifest, file, indent = 1)
+                os.replace(tmp_path, manifest_path)
+            return path
+        
+        paths, errors = {}, {}
+        with ThreadPoolExecutor(max_workers = max_workers or self.download_workers) as executor:
+            futures = {executor.submit(download, _result_file_name(result), result) : _result_file_name(result) 
+                       for result in results}
+            for future in as_completed(futures):
+                file_name = futures[future]
+                try:
+                    paths[file_name] = future.result()
+                    print(f"Downloaded result: {file_name}")
+                except Exception as error:
+                    errors[file_name] = error
+                    print(f"Download of {file_name} failed: {error}")
+                    
+        self.result_paths.update(paths)
+        if errors:
+            raise Exception(f"Could not download {len(errors)} results: {sorted(errors)}")
+        return paths
+    
+    def _download_result(self, url, path, chunk_size):
+        #Download url to path, resuming path.part with a range request after a dropped connection
+        part_path = pathlib.Path(str(path) + ".part")
+        headers = {self.api_key_header : self.api_key}
+        
+        for attempt in range(1, self.download_max_attempts + 1):
+            offset = part_path.stat().st_size if part_path.exists() else 0
+            request_headers = dict(headers, Range = f"bytes={offset}-") if offset else headers
+            try:
+                response = self.api_client.rest_client.pool_manager.request(
+                    "GET", url, headers=request_headers, preload_content=False, retries=False)
+                try:
+                    if response.status == 416:
+                        #The part file already holds the whole result
+                        total_size = offset
+                    elif response.status in (200, 206):
+                        if response.status == 200:
+                            #The server ignored the range, start over
+                            offset = 0
+                        total_size = _response_total_size(response, offset)
+                        with open(part_path, 'ab' if offset else 'wb') as file:
+                            for chunk in response.stream(chunk_size):
+                                file.write(chunk)
+                    else:
+                        raise Exception(f"Download rejected with status {response.status}: {response.data}")
+                    etag = (response.headers.get('ETag') or '').strip('"')
+                finally:
+                    response.release_conn()
+            except (urllib3.exceptions.HTTPError, OSError) as error:
+                print(f"Download attempt {attempt} of {path.name} failed: {error}")
+                if attempt == self.download_max_attempts:
+                    raise Exception("Could not download result: " + str(path.name))
+                time.sleep(2 ** attempt)
+                continue
+            
+            size = part_path.stat().st_size
+            if total_size is not None and size != total_size:
+                if attempt == self.download_max_attempts:
+                    raise Exception(f"Incomplete download of {path.name}: {size} of {total_size} bytes")
+                continue
+            if re.fullmatch(r"[0-9a-f]{32}", etag) and _file_digest(part_path, "md5", chunk_size) != etag:
+                part_path.unlink()
+                raise Exception(f"Checksum mismatch of {path.name}")
+            os.replace(part_path, path)
+            return path
+
+
+def _normalize_spec(value):
+    #Canonical form of a serialized spec for hashing: no empty values, all numbers as floats
+    if isinstance(value, dict):
+        value = {key : _normalize_spec(item) for key, item in value.items()}
+        return {key : item for key, item in value.items() if item not in (None, {}, [])}
+    if isinstance(value, (list, tuple)):
+        return [_normalize_spec(item) for item in value]
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return round(float(value), 9)
+    return value
+
+def _file_digest(path, algorithm = "sha256", chunk_size = 1024 * 1024):
+    #Hex digest of a file, read in chunks
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _result_file_name(result):
+    #Stable local file name of a run result from its descriptive fields
+    parts = [result.get(key) for key in ('category', 'type', 'quantity', 'name', 'direction')]
+    name = "_".join(str(part) for part in parts if part not in (None, ""))
+    name = re.sub(r"[^\w.-]+", "_", name).strip("_") or "result"
+    extension = str(result['download'].get('format') or "bin").lower()
+    return f"{name}.{extension}"
+
+def _response_total_size(response, offset):
+    #Full size of the downloaded file from Content-Range or Content-Length
+    content_range = response.headers.get('Content-Range')
+    if content_range and "/" in content_range and not content_range.endswith("*"):
+        return int(content_range.rsplit("/", 1)[1])
+    content_length = response.headers.get('Content-Length')
+    return None if content_length is None else offset + int(content_length)
+
+
+#TCP keep-alive on top of the urllib3 defaults, so idle pooled connections are not dropped silently
+KEEPALIVE_SOCKET_OPTIONS = [(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1), 
+                            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+if hasattr(socket, "TCP_KEEPIDLE"):
+    KEEPALIVE_SOCKET_OPTIONS += [(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60), 
+                                 (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 20), 
+                                 (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)]
+
+
+"""Local STL processing"""
+
+#Record layout of a binary STL facet: normal, three vertices and an attribute
+STL_BINARY_DTYPE = np.dtype([("normal", "<f4", (3,)), 
+                             ("vertices", "<f4", (3, 3)), 
+                             ("attribute", "<u2")])
+
+def _is_binary_stl(data):
+    #ASCII files may also start with "solid", the size of a binary file is exact
+    if len(data) < 84:
+        return False
+    count = int(np.frombuffer(data[80:84], dtype="<u4")[0])
+    return len(data) == 84 + count * STL_BINARY_DTYPE.itemsize
+
+def _solid_starts(data):
+    #Offsets of the lines starting with "solid", bytes.find is much faster than a multiline 
+    #^ pattern that the re module tries at every line
+    starts, position = [], data.find(b"solid")
+    while position >= 0:
+        line_start = data.rfind(b"\n", 0, position) + 1
+        after = data[position + 5:position + 6]
+        if not data[line_start:position].strip(b" \t") and not (after.isalnum() or after == b"_"):
+            starts.append(line_start)
+        position = data.find(b"solid", position + 5)
+    return starts
+
+def _parse_ascii_stl(data, default_name):
+    #Parse every solid block of an ASCII STL, the vertex coordinates are parsed in one call per solid
+    starts = _solid_starts(data) or [0]
+    solids = []
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else len(data)
+        block = data[start:end]
+        header = block.split(b"\n", 1)[0].split(None, 1)
+        name = header[1].strip().decode(errors="replace") if len(header) > 1 else default_name
+        
+        coordinates = re.findall(rb"vertex([^\n]*)", block)
+        vertices = np.loadtxt(coordinates, dtype=np.float64, ndmin=2) if coordinates else np.empty((0, 3))
+        solids.append((name, vertices.reshape(-1, 3, 3)))
+    return solids
+
+def _read_stl_source(data, default_name):
+    if _is_binary_stl(data):
+        facets = np.frombuffer(data, dtype=STL_BINARY_DTYPE, offset=84)
+        return [(default_name, facets["vertices"].astype(np.float64))]
+    return _parse_ascii_stl(data, default_name)
+
+def is_binary_stl_file(path):
+    
+    '''
+    Check from the header and the file size whether an STL file is binary
+    
+    '''
+    with open(path, 'rb') as file:
+        header = file.read(84)
+    if len(header) < 84:
+        return False
+    count = int(np.frombuffer(header[80:84], dtype="<u4")[0])
+    return os.path.getsize(path) == 84 + count * STL_BINARY_DTYPE.itemsize
+
+def open_binary_stl(path):
+    
+    '''
+    Memory-map a binary STL file without reading it into memory
+    
+    The facets are exposed as a structured array on top of the file, 
+    facets["normal"] (n, 3) and facets["vertices"] (n, 3, 3) are float32 
+    views, only the pages that are accessed are loaded by the OS.
+    
+    Parameters
+    ----------
+    path : pathlib.Path or str
+        path of the binary STL file
+
+    Raises
+    ------
+    Exception
+        If the file is not a binary STL file.
+
+    Returns
+    -------
+    facets : numpy.memmap
+        read-only structured array with the fields normal, vertices and 
+        attribute
+
+    '''
+    if not is_binary_stl_file(path):
+        raise Exception("Not a binary STL file: " + str(path))
+    count = (os.path.getsize(path) - 84) // STL_BINARY_DTYPE.itemsize
+    if count == 0:
+        #np.memmap cannot map an empty range
+        return np.zeros(0, dtype=STL_BINARY_DTYPE)
+    return np.memmap(path, dtype=STL_BINARY_DTYPE, mode="r", offset=84, shape=(count,))
+
+def iter_ascii_stl(path, batch_size=100000, read_size=16 * 1024 * 1024):
+    
+    '''
+    Stream the facets of an ASCII STL file in batches
+    
+    The file is read read_size bytes at a time and at most batch_size facets 
+    are held in memory, so files of any size can be processed.
+    
+    Parameters
+    ----------
+    path : pathlib.Path or str
+        path of the ASCII STL file
+        
+    batch_size : int, optional
+        maximum number of facets per batch
+        
+    read_size : int, optional
+        number of bytes read from the file at a time
+
+    Yields
+    ------
+    solid_name : str
+        name of the solid the facets belong to, a batch never spans two solids
+        
+    vertices : numpy.ndarray
+        (k, 3, 3) float64 array with the vertices of the facets
+
+    '''
+    path = pathlib.Path(path)
+    name, pending, remainder = path.name.split(".")[0], [], b""
+    
+    def parse(lines):
+        return np.loadtxt(lines, dtype=np.float64, ndmin=2).reshape(-1, 3, 3)
+    
+    with open(path, 'rb') as file:
+        while True:
+            chunk = file.read(read_size)
+            data = remainder + chunk
+            if chunk:
+                #Only complete lines are parsed, the rest is kept for the next chunk
+                cut = data.rfind(b"\n") + 1
+                data, remainder = data[:cut], data[cut:]
+            
+            #The text before the first solid line still belongs to the current solid
+            bounds = [0] + _solid_starts(data) + [len(data)]
+            for i in range(len(bounds) - 1):
+                part = data[bounds[i]:bounds[i + 1]]
+                if i > 0:
+                    if pending:
+                        yield name, parse(pending)
+                        pending = []
+                    header, _, part = part.partition(b"\n")
+                    header = header.split(None, 1)
+                    name = header[1].strip().decode(errors="replace") if len(header) > 1 else name
+                pending.extend(re.findall(rb"vertex([^\n]*)", part))
+                while len(pending) >= 3 * batch_size:
+                    yield name, parse(pending[:3 * batch_size])
+                    pending = pending[3 * batch_size:]
+                    
+            if not chunk:
+                break
+            
+    if pending:
+        yield name, parse(pending)
+
+def iter_stl(path, batch_size=100000):
+    
+    '''
+    Iterate over the facets of a binary or ASCII STL file in batches with 
+    bounded memory, see open_binary_stl and iter_ascii_stl
+    
+    Yields
+    ------
+    solid_name : str
+    
+    vertices : numpy.ndarray
+        (k, 3, 3) array, float32 views on the mapped file for binary files
+        
+    '''
+    path = pathlib.Path(path)
+    if is_binary_stl_file(path):
+        vertices = open_binary_stl(path)["vertices"]
+        for start in range(0, len(vertices), batch_size):
+            yield path.name.split(".")[0], vertices[start:start + batch_size]
+    else:
+        yield from iter_ascii_stl(path, batch_size)
+
+def _read_stl_file(path):
+    #Binary files are mapped instead of read, only the float64 copy of the vertices is held
+    name = path.name.split(".")[0]
+    if is_binary_stl_file(path):
+        return [(name, open_binary_stl(path)["vertices"].astype(np.float64))]
+    return _parse_ascii_stl(path.read_bytes(), name)
+
+def read_stl(path):
+    
+    '''
+    Read the triangles of binary or ASCII STL files into NumPy arrays
+    
+    Parameters
+    ----------
+    path : pathlib.Path or str
+        STL file, directory containing STL files (searched recursively) or 
+        zip archive of STL files. Binary STL files are memory-mapped (see 
+        open_binary_stl), ASCII files and the members of a zip archive are 
+        read into memory.
+        
+    Returns
+    -------
+    triangles : numpy.ndarray
+        (n, 3, 3) array with the vertices of every triangle
+        
+    solid_index : numpy.ndarray
+        (n,) index of the solid of every triangle in solid_names
+        
+    solid_names : list
+        name of every solid (layer), the file name for binary STL files
+
+    '''
+    path = pathlib.Path(path)
+    solids = []
+    if path.is_dir():
+        for stl_path in sorted(p for p in path.rglob("*") if p.suffix.lower() == ".stl"):
+            solids.extend(_read_stl_file(stl_path))
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for member in sorted(archive.namelist()):
+                if member.lower().endswith(".stl"):
+                    name = pathlib.PurePath(member).name.split(".")[0]
+                    solids.extend(_read_stl_source(archive.read(member), name))
+    else:
+        solids.extend(_read_stl_file(path))
+        
+    solid_names = [name for name, _ in solids]
+    if not solids:
+        return np.empty((0, 3, 3)), np.empty(0, dtype=np.intp), solid_names
+    triangles = np.concatenate([vertices for _, vertices in solids])
+    solid_index = np.repeat(np.arange(len(solids)), [len(vertices) for _, vertices in solids])
+    return triangles, solid_index, solid_names
+
+def _write_ascii_stl_facets(file, vertices):
+    #Format a batch of facets in one string operation instead of one write per facet
+    if len(vertices) == 0:
+        return
+    normals = np.cross(vertices[:, 1] - vertices[:, 0], vertices[:, 2] - vertices[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    normals = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+    
+    facet = ("  facet normal %.9g %.9g %.9g\n    outer loop\n" + "      vertex %.9g %.9g %.9g\n" * 3 + 
+             "    endloop\n  endfacet\n")
+    values = np.concatenate([normals, vertices.reshape(-1, 9)], axis=1)
+    file.write((facet * len(values)) % tuple(values.ravel().tolist()))
+
+def _footprint_mask(vertices, center, half_length, half_width, along, across):
+    #Triangles whose bounding box in the frame of a wind direction overlaps the footprint
+    xy = np.asarray(vertices[:, :, :2], dtype=np.float64) - center    # (k, 3, 2)
+    a = xy @ along.T                                                    # (k, 3, d)
+    b = xy @ across.T
+    return ((a.min(axis=1) <= half_length) & (a.max(axis=1) >= -half_length) &
+            (b.min(axis=1) <= half_width) & (b.max(axis=1) >= -half_width)).any(axis=1)
+
+def crop_stl(path, output_path, center, half_length, half_width, angles, batch_size = 100000):
+    
+    '''
+    Stream an STL file and write the triangles that can touch at least one 
+    of the wind tunnel footprints to output_path in the format of the input
+    
+    A triangle is kept when its bounding box in the frame of a wind 
+    direction overlaps the rectangle [-half_length, half_length] x 
+    [-half_width, half_width] around the center. This never drops a 
+    triangle that crosses a footprint, also large terrain triangles whose 
+    vertices are all outside of it.
+    
+    Binary files are written as binary STL with the header (which holds the 
+    solid name of most exporters) and the facet records copied unchanged, 
+    ASCII files as ASCII STL with the same solids.
+    
+    Parameters
+    ----------
+    path : pathlib.Path
+        binary or ASCII STL file
+        
+    output_path : pathlib.Path
+        path of the cropped STL file
+        
+    center, half_length, half_width, angles : 
+        see PedestrianWindComfort.get_wind_tunnel_footprint
+        
+    batch_size : int, optional
+        number of triangles processed at a time
+
+    Returns
+    -------
+    kept : int
+        number of triangles written
+        
+    total : int
+        number of triangles read
+
+    '''
+    theta = np.radians(np.asarray(angles, dtype=np.float64))
+    along = np.stack([np.sin(theta), np.cos(theta)], axis=1)     # (d, 2) wind axis
+    across = np.stack([np.cos(theta), -np.sin(theta)], axis=1)   # (d, 2) perpendicular
+    center = np.asarray(center, dtype=np.float64)
+    
+    if is_binary_stl_file(path):
+        facets = open_binary_stl(path)
+        with open(path, 'rb') as file:
+            header = file.read(80)
+        kept = 0
+        with open(output_path, 'wb') as file:
+            file.write(header + b"\0\0\0\0")
+            for start in range(0, len(facets), batch_size):
+                batch = facets[start:start + batch_size]
+                inside = _footprint_mask(batch["vertices"], center, half_length, half_width, along, across)
+                file.write(batch[inside].tobytes())
+                kept += int(inside.sum())
+            #The facet count is only known at the end
+            file.seek(80)
+            file.write(np.array([kept], dtype="<u4").tobytes())
+        return kept, len(facets)
+    
+    kept, total, current = 0, 0, None
+    with open(output_path, 'w') as file:
+        for name, vertices in iter_stl(path, batch_size):
+            inside = _footprint_mask(vertices, center, half_length, half_width, along, across)
+            if name != current:
+                if current is not None:
+                    file.write(f"endsolid {current}\n")
+                file.write(f"solid {name}\n")
+                current = name
+            _write_ascii_stl_facets(file, np.asarray(vertices[inside], dtype=np.float64))
+            kept, total = kept + int(inside.sum()), total + len(vertices)
+            
+        if current is not None:
+            file.write(f"endsolid {current}\n")
+    return kept, total
+
+def _rows_as_void(array):
+    #View every row as one opaque element, np.unique on it is much faster than with axis=0 
+    array = np.ascontiguousarray(array)
+    return array.view(np.dtype((np.void, array.dtype.itemsize * array.shape[1]))).ravel()
+
+def analyze_stl(triangles, solid_index, solid_names, tolerance=1e-10):
+    
+    '''
+    Compute the statistics of a triangulated geometry, fully vectorized
+    
+    Parameters
+    ----------
+    triangles, solid_index, solid_names : 
+        as returned by read_stl
+        
+    tolerance : float, optional
+        facets with an area below tolerance times the squared bounding box 
+        diagonal, or with a repeated vertex, are counted as degenerate
+
+    Returns
+    -------
+    stats : dict
+        triangle_count, bbox_min, bbox_max, area, degenerate_count, 
+        duplicate_count and per solid name the triangle_count, bbox_min, 
+        bbox_max, area and degenerate_count
+
+    '''
+    count = len(triangles)
+    stats = {"triangle_count" : count, "bbox_min" : None, "bbox_max" : None, "area" : 0.0,
+             "degenerate_count" : 0, "duplicate_count" : 0, "solids" : {}}
+    if count == 0:
+        return stats
+    
+    vertices = triangles.reshape(-1, 3)
+    bbox_min, bbox_max = vertices.min(axis=0), vertices.max(axis=0)
+    diagonal = float(np.linalg.norm(bbox_max - bbox_min))
+    
+    areas = 0.5 * np.linalg.norm(np.cross(triangles[:, 1] - triangles[:, 0], 
+                                          triangles[:, 2] - triangles[:, 0]), axis=1)
+    
+    #Give identical vertices the same id, a facet is a duplicate if its sorted vertex ids repeat
+    #(the rows are compared bytewise, adding 0.0 turns -0.0 into 0.0 so both compare equal)
+    _, vertex_ids = np.unique(_rows_as_void(vertices + 0.0), return_inverse=True)
+    vertex_ids = np.sort(vertex_ids.reshape(-1, 3), axis=1)
+    repeated_vertex = (vertex_ids[:, 0] == vertex_ids[:, 1]) | (vertex_ids[:, 1] == vertex_ids[:, 2])
+    degenerate = repeated_vertex | (areas <= tolerance * diagonal ** 2)
+    unique_facets = len(np.unique(_rows_as_void(vertex_ids)))
+    
+    stats.update({"bbox_min" : bbox_min.tolist(), "bbox_max" : bbox_max.tolist(), 
+                  "area" : float(areas.sum()), "degenerate_count" : int(degenerate.sum()), 
+                  "duplicate_count" : count - unique_facets})
+    
+    #Per solid statistics, the triangles of a solid are contiguous
+    solid_count = len(solid_names)
+    counts = np.bincount(solid_index, minlength=solid_count)
+    solid_area = np.bincount(solid_index, weights=areas, minlength=solid_count)
+    solid_degenerate = np.bincount(solid_index, weights=degenerate, minlength=solid_count)
+    present = np.flatnonzero(counts)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[present]
+    solid_min = np.minimum.reduceat(triangles.min(axis=1), starts)
+    solid_max = np.maximum.reduceat(triangles.max(axis=1), starts)
+    
+    for i, solid in enumerate(present):
+        name = solid_names[solid]
+        if name in stats["solids"]:
+            name = f"{name}_{solid}"
+        stats["solids"][name] = {
+            "triangle_count" : int(counts[solid]), "area" : float(solid_area[solid]),
+            "bbox_min" : solid_min[i].tolist(), "bbox_max" : solid_max[i].tolist(),
+            "degenerate_count" : int(solid_degenerate[solid])}
+    return stats
+
+
+"""Archive building"""
+
+#Compression of each file type in the CAD archives: (method, level). Already compressed
+#files are only stored, recompressing them costs time without making them smaller.
+ARCHIVE_COMPRESSION = {
+    "default" : (zipfile.ZIP_DEFLATED, 6),
+    ".zip"    : (zipfile.ZIP_STORED, None),
+    ".gz"     : (zipfile.ZIP_STORED, None),
+    ".7z"     : (zipfile.ZIP_STORED, None),
+    ".png"    : (zipfile.ZIP_STORED, None),
+    ".jpg"    : (zipfile.ZIP_STORED, None),
+}
+
+def _cad_archive_members(path):
+    #(name in the archive, path on disk) of every file of a CAD directory or of a single CAD file
+    path = pathlib.Path(path)
+    if not path.is_dir():
+        return [(path.name, path)]
+    return sorted((file_path.relative_to(path).as_posix(), file_path) 
+                  for file_path in path.rglob("*") if file_path.is_file())
+
+def _cad_archive_stamp(path, compression):
+    #Fingerprint of the sources (name, size, mtime) and settings, stored as the archive comment
+    sha = hashlib.sha256(repr(sorted(compression.items())).encode())
+    for relative_path, file_path in _cad_archive_members(path):
+        stat = file_path.stat()
+        sha.update(f"{relative_path}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+    return sha.hexdigest().encode()
+
+def write_cad_archive(path, output, compression = None):
+    
+    '''
+    Write the zip archive of a CAD directory or file to output
+    
+    The output can be a file path or any writable file object, also a 
+    non-seekable one. The archive only depends on the content, names and 
+    modification times of the sources, so writing it twice gives the same 
+    bytes.
+    
+    Parameters
+    ----------
+    path : pathlib.Path
+        CAD directory or file
+        
+    output : str or file object
+    
+    compression : dict, optional
+        (method, level) by file suffix, with a "default" entry, the default 
+        is ARCHIVE_COMPRESSION
+
+    Returns
+    -------
+    None.
+
+    '''
+    compression = ARCHIVE_COMPRESSION if compression is None else compression
+    with zipfile.ZipFile(output, 'w') as archive:
+        for relative_path, file_path in _cad_archive_members(path):
+            method, level = compression.get(file_path.suffix.lower(), compression["default"])
+            archive.write(file_path, relative_path, compress_type = method, compresslevel = level)
+        archive.comment = _cad_archive_stamp(path, compression)
+
+def build_cad_archive(path, output_filename, compression = None):
+    
+    '''
+    Write the archive of a CAD to output_filename unless an archive built 
+    from the same sources and settings already exists there
+    
+    Returns
+    -------
+    built : bool
+        False if the existing archive was kept
+
+    '''
+    compression = ARCHIVE_COMPRESSION if compression is None else compression
+    stamp = _cad_archive_stamp(path, compression)
+    if os.path.exists(output_filename) and zipfile.is_zipfile(output_filename):
+        with zipfile.ZipFile(output_filename) as archive:
+            if archive.comment == stamp:
+                return False
+    
+    tmp_filename = f"{output_filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+    write_cad_archive(path, tmp_filename, compression)
+    os.replace(tmp_filename, output_filename)
+    return True
+
+
+"""Wind statistics"""
+
+def iter_wind_record_chunks(source, speed_column = "speed", direction_column = "direction", 
+                            flag_column = None, chunk_size = 64 * 1024 * 1024):
+    
+    '''
+    Read wind speed and direction records chunk by chunk, so files of any 
+    size are processed with constant memory
+    
+    Parameters
+    ----------
+    source : str, pathlib.Path, tuple or dict
+        CSV, Parquet (needs pyarrow), .npy (two or three columns or rows: 
+        speed, direction, flag) or .npz file, a (speed, direction) or 
+        (speed, direction, flag) tuple or a dict of arrays
+        
+    speed_column, direction_column, flag_column : str
+        column names in CSV, Parquet, .npz files and dicts, flag_column is 
+        optional and must be numeric
+        
+    chunk_size : int, optional
+        approximate number of bytes per chunk
+
+    Yields
+    ------
+    speed, direction, flag : numpy.ndarray
+        flag is None without flag_column
+        
+    progress : float
+        fraction of the source read so far
+
+    '''
+    if isinstance(source, (tuple, dict)):
+        if isinstance(source, dict):
+            source = (source[speed_column], source[direction_column]) + \
+                     ((source[flag_column],) if flag_column is not None else ())
+        speed, direction, flag = (tuple(source) + (None,))[:3]
+        yield speed, direction, flag, 1.0
+        return
+        
+    path = pathlib.Path(source)
+    suffix = path.suffix.lower()
+    if suffix == ".npy":
+        records = np.load(path, mmap_mode = "r")
+        if records.shape[0] not in (2, 3):
+            records = records.T
+        rows = max(1, chunk_size // (8 * records.shape[0]))
+        for start in range(0, records.shape[1], rows):
+            chunk = np.asarray(records[:, start:start + rows], dtype = np.float64)
+            yield chunk[0], chunk[1], chunk[2] if len(chunk) == 3 else None, \
+                  min(1.0, (start + rows) / records.shape[1])
+                  
+    elif suffix == ".npz":
+        with np.load(path) as records:
+            yield records[speed_column], records[direction_column], \
+                  records[flag_column] if flag_column is not None else None, 1.0
+                  
+    elif suffix == ".parquet":
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(path)
+        columns = [speed_column, direction_column] + ([flag_column] if flag_column is not None else [])
+        rows, total = 0, parquet.metadata.num_rows
+        for batch in parquet.iter_batches(batch_size = max(1, chunk_size // 24), columns = columns):
+            rows += batch.num_rows
+            arrays = [batch.column(name).to_numpy(zero_copy_only = False) for name in columns]
+            yield arrays[0], arrays[1], arrays[2] if flag_column is not None else None, rows / max(total, 1)
+            
+    else:
+        file_size = max(os.path.getsize(path), 1)
+        with open(path, 'rb') as file:
+            header = [name.strip() for name in file.readline().decode().split(",")]
+            names = [speed_column, direction_column] + ([flag_column] if flag_column is not None else [])
+            columns = [header.index(name) for name in names]
+            
+            remainder = b""
+            while True:
+                data = remainder + file.read(chunk_size)
+                at_end = file.tell() >= file_size
+                #Only complete lines are parsed, the rest is kept for the next chunk
+                cut = len(data) if at_end else data.rfind(b"\n") + 1
+                data, remainder = data[:cut], data[cut:]
+                
+                data = _fill_empty_csv_fields(data)
+                if data:
+                    chunk = np.loadtxt(data.split(b"\n"), delimiter = ",", usecols = columns, 
+                                       ndmin = 2, dtype = np.float64).T
+                    yield chunk[0], chunk[1], chunk[2] if flag_column is not None else None, \
+                          file.tell() / file_size
+                if at_end:
+                    break
+
+def _fill_empty_csv_fields(data):
+    #Drop blank lines and turn empty fields into nan, plain replaces are much faster than a regex
+    data = data.replace(b"\r\n", b"\n")
+    while b"\n\n" in data:
+        data = data.replace(b"\n\n", b"\n")
+    data = b"\n" + data.strip(b"\n") + b"\n"
+    #Run twice, the replacement of ",," cannot handle overlapping matches in one pass
+    data = data.replace(b",,", b",nan,").replace(b",,", b",nan,")
+    data = data.replace(b"\n,", b"\nnan,").replace(b",\n", b",nan\n")
+    return data.strip(b"\n")
+
+def filter_wind_records(speed, direction, flag = None, calm_threshold = 0.5, keep_calms = True,
+                        valid_flags = (0,), max_speed = 75.0):
+    
+    '''
+    Quality filter for wind records
+    
+    Records are removed if a value is missing, the speed is negative or above 
+    max_speed, the direction is outside of [0, 360] or the sensor flag is not 
+    one of valid_flags. Records with a speed below calm_threshold are calms, 
+    they are kept (in the lowest velocity bucket) unless keep_calms is False.
+
+    Returns
+    -------
+    speed, direction : numpy.ndarray
+        the records that passed the filter
+        
+    qa : dict
+        number of records that are missing, out_of_range, flagged, calms 
+        (removed or not) and kept
+
+    '''
+    speed, direction = np.asarray(speed, dtype = np.float64), np.asarray(direction, dtype = np.float64)
+    missing = ~(np.isfinite(speed) & np.isfinite(direction))
+    with np.errstate(invalid = "ignore"):
+        out_of_range = ~missing & ((speed < 0) | (speed > max_speed) | (direction < 0) | (direction > 360))
+        flagged = ~missing & ~out_of_range & ~np.isin(flag, valid_flags) if flag is not None \
+                  else np.zeros(len(speed), dtype = bool)
+        calms = ~missing & ~out_of_range & ~flagged & (speed < calm_threshold)
+        
+    keep = ~(missing | out_of_range | flagged)
+    if not keep_calms:
+        keep &= ~calms
+    qa = {"missing" : int(missing.sum()), "out_of_range" : int(out_of_range.sum()), 
+          "flagged" : int(flagged.sum()), "calms" : int(calms.sum()), "kept" : int(keep.sum())}
+    return speed[keep], direction[keep], qa
+
+def wind_rose_histogram(speed, direction, num_directions, velocity_edges):
+    
+    '''
+    Count the wind records per velocity bucket and direction sector
+    
+    Sector i is centred on i * 360 / num_directions degrees (clockwise from 
+    north). Bucket 0 is below velocity_edges[0] and the last bucket is above 
+    velocity_edges[-1]. Records with NaN speed or direction are ignored.
+
+    Returns
+    -------
+    counts : numpy.ndarray
+        (len(velocity_edges) + 1, num_directions) array of counts
+
+    '''
+    if not 2 <= num_directions <= 36:
+        raise Exception("The number of wind directions must be between 2 and 36", num_directions)
+    
+    valid = np.isfinite(speed) & np.isfinite(direction)
+    speed, direction = speed[valid], direction[valid]
+    
+    width = 360.0 / num_directions
+    sector = (np.mod(direction + width / 2, 360.0) // width).astype(np.intp) % num_directions
+    bucket = np.searchsorted(np.asarray(velocity_edges, dtype = np.float64), speed, side = "right")
+    
+    num_buckets = len(velocity_edges) + 1
+    counts = np.bincount(bucket * num_directions + sector, minlength = num_buckets * num_directions)
+    return counts.reshape(num_buckets, num_directions)
+
+def wind_rose_velocity_buckets(counts, velocity_edges):
+    
+    '''
+    Turn a wind_rose_histogram into the velocity buckets of a sim_sdk.WindRose, 
+    the fractions of all buckets and directions add up to one
+    
+    '''
+    total = counts.sum()
+    if total == 0:
+        raise Exception("No valid wind records to build the wind rose from")
+    fractions = counts / total
+    
+    bounds = [None] + [float(edge) for edge in velocity_edges] + [None]
+    return [sim_sdk.WindRoseVelocityBucket(_from = bounds[i], to = bounds[i + 1], 
+                                           fractions = fractions[i].tolist())
+            for i in range(len(fractions))]
+
+
+"""Comfort statistics"""
+
+#Comfort criteria as (label, threshold speed in m/s, maximum probability of exceeding it), 
+#a point gets the first comfort class whose limit it meets, otherwise the last label. 
+#Safety classes are (label, threshold, probability), the most severe one exceeded applies.
+COMFORT_CRITERIA = {
+    "LAWSON_LDDC" : {
+        "comfort" : [("Sitting", 4, 0.05), ("Standing", 6, 0.05), ("Strolling", 8, 0.05), 
+                     ("Business walking", 10, 0.05), ("Uncomfortable", None, None)],
+        "safety" : [("Unsafe for frail persons", 15, 0.00025), ("Unsafe for all", 20, 0.00025)],
+        "safe_label" : "Safe"},
+    "LAWSON_CITY_OF_LONDON" : {
+        "comfort" : [("Frequent sitting", 2.5, 0.05), ("Occasional sitting", 4, 0.05), 
+                     ("Standing", 6, 0.05), ("Walking", 8, 0.05), ("Uncomfortable", None, None)],
+        "safety" : [("Unsafe for frail persons", 15, 0.00022), ("Unsafe for all", 20, 0.00022)],
+        "safe_label" : "Safe"},
+    "NEN8100" : {
+        "comfort" : [("A", 5, 0.025), ("B", 5, 0.05), ("C", 5, 0.10), ("D", 5, 0.20), ("E", None, None)],
+        "safety" : [("Limited risk", 15, 0.0005), ("Dangerous", 15, 0.003)],
+        "safe_label" : "No risk"},
+    }
+
+#Comfort criterion used for each wind engineering standard (see set_wind_engineering_standard)
+STANDARD_COMFORT_CRITERIA = {"EU" : "LAWSON_LDDC", "AS_NZS" : "LAWSON_LDDC", 
+                             "NEN8100" : "NEN8100", "LONDON" : "LAWSON_CITY_OF_LONDON"}
+
+def wind_rose_survival(wind_rose):
+    
+    '''
+    Probability of each wind direction that the reference wind speed exceeds 
+    a given speed, as knots of a piecewise linear function 
+    
+    The speeds are assumed uniformly distributed within each velocity 
+    bucket, the open last bucket is given the width of the one before it.
+    
+    Parameters
+    ----------
+    wind_rose : sim_sdk.WindRose or dict
+        the wind rose or its serialized form
+
+    Returns
+    -------
+    knots : np.ndarray
+        speeds (B + 1,) from 0 to the upper end of the last bucket
+        
+    survival : np.ndarray
+        (B + 1, num_directions) probability of exceeding each knot, the 
+        fractions are normalized to add up to one over all directions
+
+    '''
+    if isinstance(wind_rose, dict):
+        buckets = [(bucket.get("from"), bucket.get("to"), bucket["fractions"]) 
+                   for bucket in wind_rose["velocityBuckets"]]
+    else:
+        buckets = [(bucket._from, bucket.to, bucket.fractions) for bucket in wind_rose.velocity_buckets]
+    buckets.sort(key = lambda bucket: -np.inf if bucket[0] is None else bucket[0])
+    
+    lower = np.array([0.0 if low is None else low for low, _, _ in buckets], dtype = np.float64)
+    upper = np.array([np.nan if high is None else high for _, high, _ in buckets], dtype = np.float64)
+    if np.isnan(upper[-1]):
+        width = upper[-2] - lower[-2] if len(buckets) > 1 else max(lower[-1], 1.0)
+        upper[-1] = lower[-1] + width
+    knots = np.concatenate([[lower[0]], upper])
+    
+    fractions = np.array([fraction for _, _, fraction in buckets], dtype = np.float64)
+    total = fractions.sum()
+    if total <= 0:
+        raise Exception("The wind rose has no frequencies")
+    fractions = fractions / total
+    
+    #Exceedance at the lower edge of bucket k is the frequency of buckets k and above
+    survival = np.zeros((len(knots), fractions.shape[1]))
+    survival[:-1] = np.cumsum(fractions[::-1], axis = 0)[::-1]
+    return knots, survival
+
+def exceedance_probability(velocity_ratios, thresholds, knots, survival):
+    
+    '''
+    Probability that the local wind speed exceeds each threshold 
+    
+    For a point with velocity ratio r in direction d the local speed exceeds 
+    a threshold U when the reference speed exceeds U / r, these probabilities 
+    are summed over the directions with the wind rose frequencies.
+    
+    Parameters
+    ----------
+    velocity_ratios : np.ndarray
+        (points, num_directions) local to reference wind speed ratios
+        
+    thresholds : np.ndarray
+        (T,) local wind speeds
+        
+    knots, survival : np.ndarray
+        see wind_rose_survival
+
+    Returns
+    -------
+    probability : np.ndarray
+        (points, T)
+
+    '''
+    velocity_ratios = np.asarray(velocity_ratios, dtype = np.float64)
+    thresholds = np.asarray(thresholds, dtype = np.float64)
+    if velocity_ratios.shape[1] != survival.shape[1]:
+        raise Exception(f"{velocity_ratios.shape[1]} velocity ratio directions "
+                        f"for a wind rose of {survival.shape[1]} directions")
+    
+    probability = np.zeros((len(velocity_ratios), len(thresholds)))
+    with np.errstate(divide = "ignore"):
+        for direction in range(survival.shape[1]):
+            #Reference speeds needed per point and threshold, infinite where there is no flow
+            needed = thresholds[None, :] / np.abs(velocity_ratios[:, direction, None])
+            probability += np.interp(needed, knots, survival[:, direction], right = 0.0)
+    return probability
+
+def comfort_statistics(velocity_ratios, wind_rose, criterion = "LAWSON_LDDC", chunk_size = 256 * 1024):
+    
+    '''
+    Comfort and safety classes of every point of a comfort map, processed in 
+    chunks of chunk_size points so that memory-mapped fields with millions 
+    of points can be evaluated 
+    
+    Parameters
+    ----------
+    velocity_ratios : np.ndarray
+        (points, num_directions) local to reference wind speed ratios, the 
+        directions in the order of the wind rose
+        
+    wind_rose : sim_sdk.WindRose or dict
+        wind statistics at the reference height
+        
+    criterion : str, optional
+        key of COMFORT_CRITERIA
+        
+    chunk_size : int, optional
+        number of points evaluated at once
+
+    Returns
+    -------
+    statistics : dict
+        thresholds (T,), exceedance (points, T) probabilities, comfort_class 
+        and safety_class (points,) indices into comfort_labels and 
+        safety_labels, and the criterion
+
+    '''
+    if criterion not in COMFORT_CRITERIA:
+        raise Exception(f"Unknown comfort criterion: {criterion}")
+    definition = COMFORT_CRITERIA[criterion]
+    comfort = [entry for entry in definition["comfort"] if entry[1] is not None]
+    thresholds = np.unique([entry[1] for entry in comfort + definition["safety"]]).astype(np.float64)
+    
+    #Column of each class threshold in the exceedance array
+    comfort_columns = np.searchsorted(thresholds, [entry[1] for entry in comfort])
+    comfort_limits = np.array([entry[2] for entry in comfort])
+    safety_columns = np.searchsorted(thresholds, [entry[1] for entry in definition["safety"]])
+    safety_limits = np.array([entry[2] for entry in definition["safety"]])
+    
+    knots, survival = wind_rose_survival(wind_rose)
+    num_points = len(velocity_ratios)
+    exceedance = np.empty((num_points, len(thresholds)), dtype = np.float32)
+    comfort_class = np.empty(num_points, dtype = np.int8)
+    safety_class = np.empty(num_points, dtype = np.int8)
+    
+    for start in range(0, num_points, chunk_size):
+        stop = min(start + chunk_size, num_points)
+        probability = exceedance_probability(velocity_ratios[start:stop], thresholds, knots, survival)
+        exceedance[start:stop] = probability
+        
+        #First class whose limit is met, len(comfort) (the last label) if none
+        meets = probability[:, comfort_columns] <= comfort_limits
+        comfort_class[start:stop] = np.where(meets.any(axis = 1), meets.argmax(axis = 1), len(comfort))
+        #Number of safety classes exceeded, 0 is safe
+        exceeds = probability[:, safety_columns] > safety_limits
+        safety_class[start:stop] = exceeds.sum(axis = 1)
+    
+    return {"criterion" : criterion,
+            "thresholds" : thresholds,
+            "exceedance" : exceedance,
+            "comfort_class" : comfort_class,
+            "comfort_labels" : [entry[0] for entry in definition["comfort"]],
+            "safety_class" : safety_class,
+            "safety_labels" : [definition["safe_label"]] + [entry[0] for entry in definition["safety"]]}
+
+
+#Change of the north angle that turns the simulated wind directions by +1° in the model 
+#frame, i.e. direction i of a run blows along north_angle + i * 360 / num_directions. The 
+#wind tunnel footprint (cropping) and the rotated runs of plan_wind_directions both rely 
+#on it through model_wind_angles.
+NORTH_ANGLE_SIGN = 1
+
+#Numbers of wind directions the simulation accepts (see set_num_wind_directions)
+WIND_DIRECTION_COUNTS = (2, 4, 6, 8, 12, 16, 36)
+
+def wind_direction_angles(num_directions, offset = 0):
+    #True angles of the wind directions of a run, in degrees
+    return [(offset + index * 360.0 / num_directions) % 360 for index in range(num_directions)]
+
+def model_wind_angles(north_angle, num_directions, offset = 0):
+    #Angles of the wind directions of a run in the model frame, in degrees
+    return [(north_angle + NORTH_ANGLE_SIGN * angle) % 360 
+            for angle in wind_direction_angles(num_directions, offset)]
+
+def _angle_key(angle):
+    return f"{round(angle % 360, 4):g}"
+
+def plan_wind_direction_runs(num_directions, missing, counts = WIND_DIRECTION_COUNTS):
+    
+    '''
+    Split the missing direction indices of a num_directions wind rose into 
+    evenly spaced sets of an accepted size, as few as possible 
+    
+    Returns
+    -------
+    runs : list
+        (first direction index, number of directions) of every run, a single 
+        run of all directions if the missing ones cannot be split
+
+    '''
+    missing = set(missing)
+    if not missing:
+        return []
+    for count in sorted((count for count in counts if num_directions % count == 0), reverse = True):
+        step = num_directions // count
+        firsts = sorted({index % step for index in missing})
+        if all(first + k * step in missing for first in firsts for k in range(count)):
+            return [(first, count) for first in firsts]
+    return [(0, num_directions)]
+
+def _wind_rose_subset(wind_rose, first, step):
+    #Wind rose of every step-th direction from first, the statistics only matter for the server side results
+    if step == 1:
+        return wind_rose
+    subset = copy.copy(wind_rose)
+    subset.num_directions = wind_rose.num_directions // step
+    if wind_rose.exposure_categories:
+        subset.exposure_categories = list(wind_rose.exposure_categories)[first::step]
+    if wind_rose.wind_data_source != "METEOBLUE":
+        #Uploaded fractions are per direction, keep the columns of the subset
+        buckets = []
+        for bucket in wind_rose.velocity_buckets:
+            bucket = copy.copy(bucket)
+            bucket.fractions = list(bucket.fractions)[first::step]
+            buckets.append(bucket)
+        total = sum(sum(bucket.fractions) for bucket in buckets)
+        for bucket in buckets:
+            bucket.fractions = [fraction / total for fraction in bucket.fractions] if total else bucket.fractions
+        subset.velocity_buckets = buckets
+    return subset
+
+
+"""Simulation spec templates"""
+
+def mesh_fineness_model(fineness, min_cell_size = None):
+    
+    '''
+    SDK fineness model for a fineness name from 
+    [VeryCoarse, Coarse, Moderate, Fine, VeryFine, TargetSize], TargetSize 
+    needs the minimum cell size as a sim_sdk.DimensionalLength
+    
+    '''
+    if fineness == "VeryCoarse": 
+        return sim_sdk.PacefishFinenessVeryCoarse()
+    elif fineness == "Coarse":
+        return sim_sdk.PacefishFinenessCoarse()
+    elif fineness == "Moderate":
+        return sim_sdk.PacefishFinenessModerate()
+    elif fineness == "Fine":
+        return sim_sdk.PacefishFinenessFine()
+    elif fineness == "VeryFine":
+        return sim_sdk.PacefishFinenessVeryFine()
+    elif fineness == "TargetSize": 
+        if min_cell_size is None:
+            raise Exception("A TargetSize mesh needs a minimum cell size")
+        return sim_sdk.PacefishFinenessTargetSize(
+            type ="TARGET_SIZE",
+            minimum_cell_size= min_cell_size)
+    raise Exception(f"Unknown mesh fineness: {fineness}")
+
+
+class SimulationSpecTemplate():
+    
+    '''
+    Immutable set of the parts of a wind comfort simulation spec 
+    
+    with_() returns a new template in which only the parts touched by the 
+    overrides are rebuilt (as copies), every other SDK object is shared with 
+    the parent. Nothing is modified in place once it belongs to a template, 
+    so templates and the specs built from them can be used from several 
+    threads, e.g. 
+    
+        template = pwc.get_spec_template("PWC")
+        fine = template.with_(mesh_fineness = "Fine", num_wind_directions = 16)
+        pwc.create_simulation(fine.build())
+    
+    Overrides are either whole parts (any name of PARTS) or one of:
+        name, geometry_id, 
+        mesh_fineness, min_cell_size (m), reynolds_scaling (None for automatic), 
+        num_wind_directions, exposure_categories, wind_engineering_standard, 
+        roi_radius (m), north_angle (°), max_run_time (s, as set_maximum_run_time), 
+        num_fluid_passes
+    
+    '''
+    PARTS = ("name", "geometry_id", "region_of_interest", "geographical_location", 
+             "wind_rose", "pedestrian_comfort_map", "simulation_control", 
+             "mesh_settings", "advanced_modelling", "additional_result_export")
+    
+    def __init__(self, **parts):
+        missing = set(self.PARTS) - set(parts)
+        unknown = set(parts) - set(self.PARTS)
+        if missing or unknown:
+            raise Exception(f"Invalid template parts, missing: {sorted(missing)}, unknown: {sorted(unknown)}")
+        parts["pedestrian_comfort_map"] = tuple(parts["pedestrian_comfort_map"])
+        object.__setattr__(self, "_parts", types.MappingProxyType(parts))
+    
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["_parts"][name]
+        except KeyError:
+            raise AttributeError(name)
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("SimulationSpecTemplate is immutable, use with_() to derive a variant")
+    
+    def __repr__(self):
+        return f"SimulationSpecTemplate(name={self.name!r}, geometry_id={self.geometry_id!r})"
+    
+    @classmethod
+    def from_pwc(cls, pwc, simulation_name):
+        
+        '''
+        Template of the current setup of a PedestrianWindComfort instance, the 
+        setters must have been called as for set_simulation_spec 
+        
+        '''
+        return cls(
+            name = simulation_name, 
+            geometry_id = pwc.geometry_id,
+            region_of_interest = pwc.region_of_interest,
+            geographical_location = pwc.geo_location_obj,
+            wind_rose = pwc.wind_rose,
+            pedestrian_comfort_map = pwc.pedestrian_comfort_map,
+            simulation_control = pwc.sim_control,
+            mesh_settings = pwc.mesh_master,
+            advanced_modelling = sim_sdk.AdvancedModelling(),
+            additional_result_export = sim_sdk.FluidResultControls(
+                transient_result_control=sim_sdk.TransientResultControl(
+                    write_control=sim_sdk.CoarseResolution(),
+                    fraction_from_end=0.1,
+                ),
+                statistical_averaging_result_control=sim_sdk.StatisticalAveragingResultControlV2(
+                    sampling_interval=sim_sdk.CoarseResolution(),
+                    fraction_from_end=0.1,
+                ),
+            ),
+        )
+    
+    def with_(self, **overrides):
+        
+        '''
+        Fork the template, see the class docstring for the accepted overrides 
+        
+        Returns 
+        -------
+        SimulationSpecTemplate
+        
+        '''
+        parts = dict(self._parts)
+        settings = dict(overrides)
+        
+        for name in self.PARTS:
+            if name in settings:
+                value = settings.pop(name)
+                parts[name] = value
+        
+        #Each group of settings copies its part once, the copy is private until returned
+        if {"mesh_fineness", "min_cell_size", "reynolds_scaling"} & set(settings):
+            mesh = copy.copy(parts["mesh_settings"])
+            if "mesh_fineness" in settings or "min_cell_size" in settings:
+                fineness = settings.pop("mesh_fineness", None)
+                min_cell_size = settings.pop("min_cell_size", None)
+                current = mesh.wind_comfort_fineness
+                if fineness is None:
+                    fineness = _mesh_fineness_name(current)
+                if min_cell_size is not None:
+                    min_cell_size = sim_sdk.DimensionalLength(min_cell_size, "m")
+                else:
+                    min_cell_size = getattr(current, "minimum_cell_size", None)
+                mesh.wind_comfort_fineness = mesh_fineness_model(fineness, min_cell_size)
+            if "reynolds_scaling" in settings:
+                scaling = settings.pop("reynolds_scaling")
+                if scaling is None:
+                    mesh.reynolds_scaling_type = sim_sdk.AutomaticReynoldsScaling(
+                                    type='AUTOMATIC_REYNOLDS_SCALING')
+                else:
+                    mesh.reynolds_scaling_type = sim_sdk.ManualReynoldsScaling(
+                                    type='MANUAL_REYNOLDS_SCALING', 
+                                    reynolds_scaling_factor=scaling)
+            parts["mesh_settings"] = mesh
+        
+        if {"num_wind_directions", "exposure_categories", "wind_engineering_standard"} & set(settings):
+            wind_rose = copy.copy(parts["wind_rose"])
+            if "num_wind_directions" in settings:
+                num_directions = settings.pop("num_wind_directions")
+                if num_directions != wind_rose.num_directions and wind_rose.wind_data_source != "METEOBLUE":
+                    #Uploaded velocity buckets are binned per direction, they can not be re-sectored here
+                    raise Exception("Changing the number of wind directions of an uploaded wind rose "
+                                    "needs a new wind_rose, rebin with set_wind_records")
+                categories = list(wind_rose.exposure_categories or [])
+                if "exposure_categories" not in settings:
+                    if len(set(categories)) > 1 and num_directions != wind_rose.num_directions:
+                        raise Exception("The exposure categories differ per direction, "
+                                        "pass exposure_categories for the new number of directions")
+                    settings["exposure_categories"] = categories[:1] * num_directions
+                wind_rose.num_directions = num_directions
+            if "exposure_categories" in settings:
+                categories = list(settings.pop("exposure_categories"))
+                if len(categories) != wind_rose.num_directions:
+                    raise Exception("One exposure category per wind direction is needed")
+                wind_rose.exposure_categories = categories
+            if "wind_engineering_standard" in settings:
+                wind_rose.wind_engineering_standard = settings.pop("wind_engineering_standard")
+            parts["wind_rose"] = wind_rose
+        
+        if {"roi_radius", "north_angle"} & set(settings):
+            region_of_interest = copy.copy(parts["region_of_interest"])
+            if "roi_radius" in settings:
+                region_of_interest.disc_radius = sim_sdk.DimensionalLength(settings.pop("roi_radius"), "m")
+            if "north_angle" in settings:
+                region_of_interest.north_angle = sim_sdk.DimensionalAngle(settings.pop("north_angle"), "°")
+            parts["region_of_interest"] = region_of_interest
+        
+        if {"max_run_time", "num_fluid_passes"} & set(settings):
+            control = copy.copy(parts["simulation_control"])
+            if "max_run_time" in settings:
+                control.max_direction_run_time = sim_sdk.DimensionalTime(settings.pop("max_run_time"), "s")
+            if "num_fluid_passes" in settings:
+                control.number_of_fluid_passes = settings.pop("num_fluid_passes")
+            parts["simulation_control"] = control
+        
+        if settings:
+            raise Exception(f"Unknown template overrides: {sorted(settings)}")
+        return SimulationSpecTemplate(**parts)
+    
+    def build(self):
+        
+        '''
+        Build the sim_sdk.SimulationSpec, only the wrapping objects are new, 
+        the parts are shared with the template 
+        
+        '''
+        model = sim_sdk.WindComfort(
+            region_of_interest= self.region_of_interest,
+            wind_conditions= sim_sdk.WindConditions(
+                geographical_location= self.geographical_location,
+                wind_rose= self.wind_rose),
+            pedestrian_comfort_map= list(self.pedestrian_comfort_map),
+            simulation_control= self.simulation_control,
+            advanced_modelling= self.advanced_modelling,
+            additional_result_export= self.additional_result_export,
+            mesh_settings= self.mesh_settings,
+        )
+        return sim_sdk.SimulationSpec(name= self.name, geometry_id= self.geometry_id, model= model)
+
+@contextlib.contextmanager
+def _file_lock(path):
+    #Exclusive lock between processes on path + ".lock", held while a shared cache file is written
+    with open(str(path) + ".lock", 'a+b') as file:
+        if os.name == "nt":
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+def _mesh_fineness_name(fineness):
+    #Inverse of mesh_fineness_model
+    for name in ("VeryCoarse", "Coarse", "Moderate", "Fine", "VeryFine", "TargetSize"):
+        if type(fineness).__name__ == f"PacefishFineness{name}":
+            return name
+    raise Exception(f"Unknown mesh fineness: {type(fineness).__name__}")
+
+
+class LookupCache():
+    
+    '''
+    Name to id indices (projects, geometries of a project) persisted to a 
+    local JSON file
+    
+    An index is downloaded once through the given fetch function and reused 
+    until it is older than ttl seconds (never expires if ttl is None). Newly created entries are added to 
+    the index directly, so it does not need to be downloaded again.
+    
+    Several processes can share the file: the changes of this process are 
+    replayed onto the current file content under a file lock when saving, 
+    so entries written by other processes are kept.
+    
+    '''
+    
+    def __init__(self, path, ttl = 3600):
+        
+        self.path = pathlib.Path(path)
+        self.ttl = ttl
+        self.entries = None
+        self._changes = [] # changes of this process not merged into the file yet
+        self._lock = threading.RLock()
+        
+    def _read(self):
+        try:
+            with open(self.path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+        
+    def _load(self):
+        if self.entries is None:
+            self.entries = self._read()
+        return self.entries
+    
+    def _apply(self, entries, change):
+        kind, scope, *args = change
+        if kind == "index":
+            entries[scope] = copy.deepcopy(args[0])
+        elif kind == "add" and scope in entries:
+            entries[scope]["index"][args[0]] = args[1]
+        elif kind == "remove" and scope in entries:
+            entries[scope]["index"].pop(args[0], None)
+        elif kind == "invalidate":
+            if scope is None:
+                entries.clear()
+            else:
+                entries.pop(scope, None)
+    
+    def _change(self, *change):
+        #Apply a change in memory and merge it into the file
+        self._apply(self._load(), change)
+        self._changes.append(change)
+        self._save()
+    
+    def _save(self):
+        #Replay the changes onto the file content, write to a temporary file first so a crash 
+        #never leaves a truncated cache
+        self.path.parent.mkdir(parents = True, exist_ok = True)
+        with _file_lock(self.path):
+            entries = self._read()
+            for change in self._changes:
+                self._apply(entries, change)
+            tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, 'w') as file:
+                json.dump(entries, file)
+            os.replace(tmp_path, self.path)
+        self.entries, self._changes = entries, []
+        
+    def get_index(self, scope, fetch):
+        
+        '''
+        Return the name to id index of the scope, downloading it with fetch 
+        when it is missing or older than ttl
+        
+        '''
+        with self._lock:
+            entry = self._load().get(scope)
+            if entry is None or (self.ttl is not None and time.time() - entry["time"] > self.ttl):
+                self._change("index", scope, {"time" : time.time(), "index" : fetch()})
+                entry = self.entries[scope]
+            return entry["index"]
+        
+    def lookup(self, scope, name, fetch):
+        return self.get_index(scope, fetch).get(name)
+    
+    def add(self, scope, name, value):
+        
+        '''
+        Add a newly created entry to a cached index, nothing is done if the 
+        index of the scope is not cached yet
+        
+        '''
+        with self._lock:
+            if scope in self._load():
+                self._change("add", scope, name, value)
+                
+    def remove(self, scope, name):
+        
+        '''
+        Remove an entry, e.g. when the API answers 404 for its id
+        
+        '''
+        with self._lock:
+            if name in (self._load().get(scope) or {}).get("index", {}):
+                self._change("remove", scope, name)
+                
+    def invalidate(self, scope = None):
+        with self._lock:
+            self._change("invalidate", scope)
+
+
+class WindDataCache():
+    
+    '''
+    Persistent cache of the Meteoblue wind roses keyed by the rounded 
+    geographical location
+    
+    Entries expire after ttl seconds and the least recently used entries are 
+    evicted beyond max_entries. Concurrent requests for the same location 
+    are merged: only the first one calls the API, the others wait for it.
+    
+    Several processes can share the file: a missing or expired location is 
+    looked up in the file again before it is fetched, and the file is 
+    merged with the entries of this process under a file lock when saving.
+    
+    '''
+    
+    def __init__(self, path, ttl = 30 * 24 * 3600, max_entries = 256, precision = 2):
+        
+        self.path = pathlib.Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.precision = precision # decimals of latitude and longitude kept in the key
+        self.entries = None
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        
+    def key(self, latitude, longitude):
+        return f"{round(float(latitude), self.precision)},{round(float(longitude), self.precision)}"
+        
+    def _read(self):
+        try:
+            with open(self.path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+        
+    def _load(self):
+        if self.entries is None:
+            self.entries = self._merge(self._read(), {})
+        return self.entries
+    
+    def _merge(self, entries, other):
+        #The newest fetch of every location wins and keeps the latest use, ordered by last use
+        merged = dict(entries)
+        for key, entry in other.items():
+            current = merged.get(key)
+            if current is None or entry["time"] > current["time"]:
+                current, entry = entry, current
+            merged[key] = current if entry is None else dict(
+                current, last_used = max(current["last_used"], entry["last_used"]))
+        merged = collections.OrderedDict(sorted(merged.items(), key = lambda item: item[1]["last_used"]))
+        while len(merged) > self.max_entries:
+            merged.popitem(last = False)
+        return merged
+    
+    def _save(self):
+        #Merge with the entries other processes wrote since the file was read
+        self.path.parent.mkdir(parents = True, exist_ok = True)
+        with _file_lock(self.path):
+            entries = self._merge(self._read(), self.entries)
+            tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, 'w') as file:
+                json.dump(entries, file)
+            os.replace(tmp_path, self.path)
+        self.entries = entries
+        
+    def _lookup(self, key):
+        entry = self._load().get(key)
+        if entry is None or time.time() - entry["time"] > self.ttl:
+            return None
+        entry["last_used"] = time.time()
+        self.entries.move_to_end(key)
+        return entry["data"]
+    
+    def get(self, latitude, longitude, fetch):
+        
+        '''
+        Return the cached wind data of the location, calling fetch (once, 
+        also for concurrent callers) if it is missing or expired
+        
+        Parameters
+        ----------
+        latitude, longitude : float or str
+        
+        fetch : callable
+            returns the wind data as JSON serializable data
+
+        Returns
+        -------
+        data : 
+            the wind data, do not modify it
+
+        '''
+        key = self.key(latitude, longitude)
+        while True:
+            with self._lock:
+                data = self._lookup(key)
+                if data is not None:
+                    return data
+                in_flight = self._in_flight.get(key)
+                if in_flight is None:
+                    in_flight = self._in_flight[key] = threading.Event()
+                    break
+            #Another thread is fetching this location, use its result (or retry if it failed)
+            in_flight.wait()
+            
+        try:
+            with self._lock:
+                #Another process may have fetched the location since the file was read
+                self.entries = self._merge(self._read(), self._load())
+                data = self._lookup(key)
+            if data is not None:
+                return data
+            
+            data = fetch()
+            with self._lock:
+                now = time.time()
+                self._load()[key] = {"time" : now, "last_used" : now, "data" : data}
+                self.entries.move_to_end(key)
+                self._save()
+            return data
+        finally:
+            with self._lock:
+                self._in_flight.pop(key).set()
+
+
+class CostModel():
+    
+    '''
+    Local surrogate of the server side simulation estimate
+    
+    Every server estimate is appended with the setup parameters to a JSON 
+    lines history file. The log of the cell count, GPUh and duration is 
+    fitted with a ridge regression on the log of the ROI radius, number of 
+    wind directions, triangle count and Reynolds scaling factor and the 
+    level of the mesh fineness. An unknown triangle count is replaced by the 
+    median of the history. Setups with a TargetSize mesh are not predicted.
+    
+    '''
+    
+    FINENESS_LEVELS = {"VeryCoarse" : 0, "Coarse" : 1, "Moderate" : 2, "Fine" : 3, "VeryFine" : 4}
+    TARGETS = ("cell_count", "compute_resource", "duration")
+    
+    def __init__(self, path, min_samples = 8, ridge = 1e-3):
+        
+        self.path = pathlib.Path(path)
+        self.min_samples = min_samples
+        self.ridge = ridge
+        self.history = None
+        self.coefficients = None
+        self.default_triangle_count = 0 # used when the triangle count is unknown
+        self._lock = threading.Lock()
+        
+    def _load(self):
+        if self.history is None:
+            self.history = []
+            try:
+                with open(self.path, 'r') as file:
+                    self.history = [json.loads(line) for line in file if line.strip()]
+            except (OSError, ValueError):
+                pass
+        return self.history
+    
+    def _feature_vector(self, features):
+        #None if the setup cannot be described by the model
+        level = self.FINENESS_LEVELS.get(features.get("mesh_fineness"))
+        if level is None or not features.get("roi_radius") or not features.get("num_wind_directions"):
+            return None
+        scaling = features.get("reynolds_scaling")
+        if scaling is not None and scaling <= 0:
+            #A manual scaling of 0 has no logarithm
+            return None
+        return [1.0, np.log(features["roi_radius"]), float(level), 
+                np.log(features["num_wind_directions"]),
+                np.log1p(features.get("triangle_count") or self.default_triangle_count),
+                1.0 if scaling is None else 0.0,
+                0.0 if scaling is None else np.log(scaling)]
+    
+    def add(self, features, estimate):
+        
+        '''
+        Append an available server estimate to the history
+        
+        '''
+        if not estimate.get("available"):
+            return
+        targets = {key : (estimate.get(key) or {}).get("value") for key in self.TARGETS}
+        if any(value is None or value <= 0 for value in targets.values()):
+            return
+        with self._lock:
+            self._load().append({"features" : features, "targets" : targets})
+            self.coefficients = None
+            self.path.parent.mkdir(parents = True, exist_ok = True)
+            with open(self.path, 'a') as file:
+                file.write(json.dumps(self.history[-1]) + "\n")
+                
+    def fit(self):
+        
+        '''
+        Fit the model on the history, returns False if there are fewer than 
+        min_samples usable samples
+        
+        '''
+        with self._lock:
+            counts = [sample["features"].get("triangle_count") for sample in self._load()]
+            counts = [count for count in counts if count]
+            self.default_triangle_count = float(np.median(counts)) if counts else 0
+            
+            samples = [(self._feature_vector(sample["features"]), sample["targets"]) for sample in self.history]
+            samples = [(x, y) for x, y in samples if x is not None]
+            if len(samples) < self.min_samples:
+                return False
+            
+            X = np.array([x for x, _ in samples])
+            Y = np.log(np.array([[y[key] for key in self.TARGETS] for _, y in samples], dtype = np.float64))
+            #Ridge regression keeps the fit stable when a feature never changed in the history
+            self.coefficients = np.linalg.solve(X.T @ X + self.ridge * np.eye(X.shape[1]), X.T @ Y)
+            return True
+        
+    def predict(self, features):
+        
+        '''
+        Predict the cell count, GPUh and duration (seconds) of a setup, None 
+        if the setup is not supported or the history is too short
+        
+        '''
+        x = self._feature_vector(features)
+        if x is None or (self.coefficients is None and not self.fit()):
+            return None
+        return dict(zip(self.TARGETS, np.exp(np.array(x) @ self.coefficients).tolist()))
+
+
+class RunLedger():
+    
+    '''
+    Local SQLite record of the completed stages of a pipeline 
+    
+    Every stage is stored with the hash of its inputs and its result (the ids 
+    it produced) per session. Each record is committed on its own, so after 
+    a crash a rerun finds everything that was completed before. The 
+    connection is shared by the threads of a batch behind a lock.
+    
+    '''
+    
+    def __init__(self, path):
+        
+        self.path = pathlib.Path(path)
+        self._connection = None
+        self._lock = threading.Lock()
+        
+    @staticmethod
+    def hash_inputs(*inputs):
+        return hashlib.sha256(json.dumps(inputs, sort_keys = True, default = str).encode()).hexdigest()
+        
+    def _connect(self):
+        if self._connection is None:
+            self.path.parent.mkdir(parents = True, exist_ok = True)
+            self._connection = sqlite3.connect(str(self.path), check_same_thread = False, 
+                                               isolation_level = None, timeout = 30)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS stages ("
+                "session TEXT, stage TEXT, inputs_hash TEXT, result TEXT, updated REAL, "
+                "PRIMARY KEY (session, stage, inputs_hash))")
+        return self._connection
+    
+    def get(self, session, stage, inputs_hash):
+        
+        '''
+        Result of the stage with these inputs, None if it was not recorded 
+        
+        '''
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT result FROM stages WHERE session = ? AND stage = ? AND inputs_hash = ?", 
+                (session, stage, inputs_hash)).fetchone()
+        return None if row is None else json.loads(row[0])
+    
+    def record(self, session, stage, inputs_hash, result):
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?)", 
+                (session, stage, inputs_hash, json.dumps(result), time.time()))
+            
+    def forget(self, session, stage = None, inputs_hash = None):
+        
+        '''
+        Remove the records of a session, optionally only of one stage or one 
+        set of inputs 
+        
+        '''
+        query, parameters = "DELETE FROM stages WHERE session = ?", [session]
+        if stage is not None:
+            query, parameters = query + " AND stage = ?", parameters + [stage]
+        if inputs_hash is not None:
+            query, parameters = query + " AND inputs_hash = ?", parameters + [inputs_hash]
+        with self._lock:
+            self._connect().execute(query, parameters)
+            
+    def history(self, session):
+        
+        '''
+        (stage, result, time) of every record of the session, oldest first 
+        
+        '''
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT stage, result, updated FROM stages WHERE session = ? ORDER BY updated", 
+                (session,)).fetchall()
+        return [(stage, json.loads(result), updated) for stage, result, updated in rows]
+    
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class Poller():
+    
+    '''
+    Polls many long-running jobs (geometry imports, mesh operations, 
+    simulation runs) from one loop
+    
+    Every job is polled with an exponentially growing, jittered interval. If 
+    the API answers with 429 all jobs are paused for the time given in the 
+    X-Rate-Limit-Retry-After-Minutes header. Several threads can wait on the 
+    same poller, one of them drives the loop for all pending jobs.
+    
+    With max_rate (polls per second) the intervals are stretched so that many 
+    pending jobs together stay below that rate.
+    
+    '''
+    
+    def __init__(self, initial_interval = 5, max_interval = 120, backoff_factor = 1.5, jitter = 0.5,
+                 max_rate = None):
+        
+        #Backoff Variables
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.jitter = jitter
+        self.max_rate = max_rate
+        
+        #Job Variables
+        self.jobs = {}
+        self.api_calls = 0
+        self._condition = threading.Condition()
+        self._driving = False
+        
+    def backoff(self, attempt):
+        
+        '''
+        Interval before the next poll of a job that was already polled 
+        attempt times, with a random jitter of up to jitter * interval
+        
+        '''
+        interval = min(self.max_interval, self.initial_interval * self.backoff_factor ** attempt)
+        return interval * (1 - self.jitter * random.random())
+        
+    def add_job(self, key, fetch, is_done, timeout = None, on_update = None, interval = None):
+        
+        '''
+        Register a job to be polled
+        
+        Parameters
+        ----------
+        key : hashable
+            unique key of the job, for example ("simulation_run", run_id)
+            
+        fetch : callable
+            returns the current state of the job, usually one API call
+            
+        is_done : callable
+            takes the state and returns True once the job has ended
+            
+        timeout : float, optional
+            seconds after which the job is given up with a TimeoutError
+            
+        on_update : callable, optional
+            called with the state after every poll, an exception it raises 
+            ends this job with that error
+            
+        interval : callable, optional
+            takes the state and returns the seconds until the next poll 
+            (kept between initial_interval and max_interval), or None to 
+            use the exponential backoff
+
+        Raises
+        ------
+        Exception
+            If a job with the same key is already registered, its waiters 
+            would otherwise get the state of the new job.
+
+        Returns
+        -------
+        None.
+
+        '''
+        now = time.time()
+        with self._condition:
+            if key in self.jobs:
+                raise Exception(f"A job with the key {key} is already registered")
+            self.jobs[key] = {
+                "fetch" : fetch, "is_done" : is_done, "on_update" : on_update, "interval" : interval,
+                "deadline" : None if timeout is None else now + timeout,
+                "attempt" : 0, "next_poll" : now, 
+                "state" : None, "done" : False, "error" : None, "waiters" : 0}
+            self._condition.notify_all()
+            
+    def poll_once(self):
+        
+        '''
+        Poll every pending job that is due and schedule its next poll
+        
+        Returns
+        -------
+        next_poll : float
+            time of the next due poll, None if no job is pending
+
+        '''
+        with self._condition:
+            pending = [(key, job) for key, job in self.jobs.items() if not job["done"]]
+            
+        #The API calls and callbacks run without the lock, the job dicts are only changed under it
+        for key, job in pending:
+            now = time.time()
+            with self._condition:
+                if job["next_poll"] > now:
+                    continue
+                if job["deadline"] is not None and now > job["deadline"]:
+                    job["error"], job["done"] = TimeoutError(key), True
+                    continue
+            
+            try:
+                self.api_calls += 1
+                state = job["fetch"]()
+            except sim_sdk.ApiException as ae:
+                if ae.status == 429:
+                    #The rate limit applies to the account, so pause every job
+                    minutes = float((ae.headers or {}).get('X-Rate-Limit-Retry-After-Minutes', 1))
+                    print(f"Exceeded max amount requests, polling again in {minutes} minutes")
+                    with self._condition:
+                        for _, other in pending:
+                            other["next_poll"] = max(other["next_poll"], now + minutes * 60)
+                    break
+                with self._condition:
+                    job["error"], job["done"] = ae, True
+                continue
+            except Exception as error:
+                with self._condition:
+                    job["error"], job["done"] = error, True
+                continue
+                
+            try:
+                if job["on_update"] is not None:
+                    job["on_update"](state)
+                done = job["is_done"](state)
+                interval = None if done else self._next_interval(job, state, len(pending))
+            except Exception as error:
+                #A failing callback only ends its own job
+                with self._condition:
+                    job["state"], job["error"], job["done"] = state, error, True
+                continue
+            with self._condition:
+                job["state"], job["done"] = state, done
+                if not done:
+                    job["next_poll"] = time.time() + interval
+        
+        with self._condition:
+            #Waiters see the jobs that ended in this round right away
+            self._condition.notify_all()
+            next_polls = [job["next_poll"] for job in self.jobs.values() if not job["done"]]
+        return min(next_polls) if next_polls else None
+    
+    def _next_interval(self, job, state, num_pending):
+        interval = None if job["interval"] is None else job["interval"](state)
+        if interval is None:
+            interval = self.backoff(job["attempt"])
+            job["attempt"] += 1
+        else:
+            interval = min(self.max_interval, max(self.initial_interval, interval))
+            interval *= 1 - self.jitter * random.random()
+        if self.max_rate is not None:
+            interval = max(interval, num_pending / self.max_rate)
+        return interval
+    
+    def wait(self, keys = None):
+        
+        '''
+        Block until the given jobs have ended and remove them from the poller
+        
+        Parameters
+        ----------
+        keys : list, optional
+            keys of the jobs to wait for, the default is all jobs
+
+        Raises
+        ------
+        Exception
+            The error of the first job that failed or timed out, see wait_all 
+            to get the states of the other jobs as well.
+
+        Returns
+        -------
+        states : dict
+            last state of every job, by key
+
+        '''
+        states, errors = self.wait_all(keys)
+        for error in errors.values():
+            raise error
+        return states
+    
+    def wait_all(self, keys = None):
+        
+        '''
+        Block until the given jobs have ended and remove them from the poller, 
+        the errors are collected per job instead of raised
+        
+        Several threads can wait on the same job, it is removed once the last 
+        of them has returned. A key that is not registered (never added, or 
+        already collected by an earlier wait) ends with a KeyError.
+        
+        Parameters
+        ----------
+        keys : list, optional
+            keys of the jobs to wait for, the default is all jobs
+
+        Returns
+        -------
+        states : dict
+            last state of every job that ended without an error, by key
+            
+        errors : dict
+            error of every job that failed or timed out, by key
+
+        '''
+        jobs, errors = {}, {}
+        with self._condition:
+            for key in (list(self.jobs) if keys is None else keys):
+                if key in self.jobs:
+                    jobs[key] = self.jobs[key]
+                    jobs[key]["waiters"] += 1
+                else:
+                    errors[key] = KeyError(f"No job with the key {key}, it was never added or already collected")
+        
+        try:
+            while True:
+                with self._condition:
+                    if all(job["done"] for job in jobs.values()):
+                        break
+                    if self._driving:
+                        #Another thread is polling, it notifies after every round
+                        self._condition.wait(timeout = self.max_interval)
+                        continue
+                    self._driving = True
+                    
+                try:
+                    next_poll = self.poll_once()
+                    with self._condition:
+                        if next_poll is not None and not all(job["done"] for job in jobs.values()):
+                            #add_job notifies, so a new job does not wait for the current interval
+                            self._condition.wait(timeout = max(0, next_poll - time.time()))
+                finally:
+                    with self._condition:
+                        self._driving = False
+                        self._condition.notify_all()
+        finally:
+            with self._condition:
+                for key, job in jobs.items():
+                    job["waiters"] -= 1
+                    if job["done"] and job["waiters"] == 0 and self.jobs.get(key) is job:
+                        del self.jobs[key]
+        
+        states = {key : job["state"] for key, job in jobs.items() if job["error"] is None}
+        errors.update({key : job["error"] for key, job in jobs.items() if job["error"] is not None})
+        return states, errors
+
+
+class RunMonitor():
+    
+    '''
+    Tracks many simulation runs at once on a Poller and reports their 
+    progress as events
+    
+    An event is a dict with key, project_id, simulation_id, run_id, name, 
+    status, previous_status, progress, done, time and run (the SimulationRun), 
+    it is emitted when the status or progress of a run changes. Events are 
+    passed to the callbacks (from the polling thread) and to the async 
+    iterator of events().
+    
+    Polling is adaptive: while a run reports progress, its next poll is 
+    planned from the progress rate (about half the estimated remaining 
+    time), queued runs and runs without progress fall back to the poller 
+    backoff. The poller max_rate caps the request rate for large batches.
+    
+    '''
+    
+    TERMINAL_STATUSES = ('FINISHED', 'CANCELED', 'FAILED')
+    MAX_RATE = 2 # polls per second of a poller created by the monitor
+    
+    def __init__(self, poller = None, on_event = None):
+        
+        self.poller = Poller(max_rate = self.MAX_RATE) if poller is None else poller
+        self.callbacks = [] if on_event is None else [on_event]
+        self.runs = {} # key -> last event of the run
+        self._history = {} # key -> (time, progress) of the first progress seen
+        self._collected = set() # keys of the runs already returned by a wait
+        self._lock = threading.Lock()
+        
+    def add_callback(self, on_event):
+        self.callbacks.append(on_event)
+        
+    def remove_callback(self, on_event):
+        self.callbacks.remove(on_event)
+        
+    def track(self, simulation_run_api, project_id, simulation_id, run_id, name = None, timeout = None):
+        
+        '''
+        Start tracking a run
+        
+        Parameters
+        ----------
+        simulation_run_api : sim_sdk.SimulationRunsApi
+        
+        project_id, simulation_id, run_id : str
+            ids of the run
+            
+        name : str, optional
+            label of the run in the events, the default is the run id
+            
+        timeout : float, optional
+            seconds after which the run is given up with a TimeoutError
+
+        Returns
+        -------
+        key : tuple
+            key of the run in the poller and in runs
+
+        '''
+        key = ("simulation_run", run_id)
+        ids = {"key" : key, "project_id" : project_id, "simulation_id" : simulation_id, 
+               "run_id" : run_id, "name" : run_id if name is None else name}
+        with self._lock:
+            if key in self.runs and key not in self._collected:
+                raise Exception(f"The run {run_id} is already tracked")
+            self.runs[key] = dict(ids, status = None, progress = None, done = False, time = None, run = None)
+            self._history.pop(key, None)
+            self._collected.discard(key)
+        
+        self.poller.add_job(
+            key,
+            fetch = lambda: simulation_run_api.get_simulation_run(project_id, simulation_id, run_id),
+            is_done = lambda run: run.status in self.TERMINAL_STATUSES,
+            timeout = timeout,
+            on_update = lambda run: self._update(key, run),
+            interval = lambda run: self._interval(key, run))
+        return key
+    
+    def track_design(self, pwc, timeout = None):
+        
+        '''
+        Track the current run of a PedestrianWindComfort instance, labelled 
+        with its simulation name 
+        
+        '''
+        name = pwc.simulation_spec.name if pwc.simulation_spec is not None else None
+        return self.track(pwc.simulation_run_api, pwc.project_id, pwc.simulation_id, pwc.run_id, 
+                          name = name, timeout = pwc.max_runtime if timeout is None else timeout)
+    
+    def _update(self, key, run):
+        #Called by the poller after every poll of the run
+        progress = getattr(run, "progress", None)
+        now = time.time()
+        with self._lock:
+            last = self.runs[key]
+            if last["run"] is not None and (run.status, progress) == (last["status"], last["progress"]):
+                last["run"] = run
+                return
+            event = dict(last, previous_status = last["status"], status = run.status, 
+                         progress = progress, done = run.status in self.TERMINAL_STATUSES, 
+                         time = now, run = run)
+            self.runs[key] = event
+            if progress is not None and key not in self._history:
+                self._history[key] = (now, progress)
+                
+        for callback in list(self.callbacks):
+            callback(event)
+            
+    def _interval(self, key, run):
+        #Seconds to the next poll, None for the poller backoff
+        progress = getattr(run, "progress", None)
+        with self._lock:
+            first = self._history.get(key)
+        if run.status != 'RUNNING' or progress is None or first is None:
+            return None
+        elapsed, advanced = time.time() - first[0], progress - first[1]
+        if elapsed <= 0 or advanced <= 0:
+            return None
+        full = 100.0 if progress > 1 else 1.0
+        return 0.5 * (full - progress) * elapsed / advanced
+    
+    def wait(self, keys = None):
+        
+        '''
+        Block until the given runs (default all tracked runs that were not 
+        waited for yet) are finished, canceled or failed, see Poller.wait
+        
+        Returns
+        -------
+        runs : dict
+            last SimulationRun of every run, by key
+
+        '''
+        runs, errors = self.wait_all(keys)
+        for error in errors.values():
+            raise error
+        return runs
+    
+    def wait_all(self, keys = None):
+        
+        '''
+        Block until the given runs (default all tracked runs that were not 
+        waited for yet) have ended, the errors (timeouts, API errors) are 
+        collected per run, see Poller.wait_all
+        
+        Returns
+        -------
+        runs : dict
+            last SimulationRun of every run that could be polled to its end, 
+            by key
+            
+        errors : dict
+            error of every other run, by key
+
+        '''
+        with self._lock:
+            if keys is None:
+                keys = [key for key in self.runs if key not in self._collected]
+            keys = list(keys)
+        runs, errors = self.poller.wait_all(keys)
+        with self._lock:
+            self._collected.update(key for key in keys if key in self.runs)
+        return runs, errors
+    
+    async def events(self, keys = None, executor = None):
+        
+        '''
+        Async iterator over the events of the given runs (default as in 
+        wait) until all of them have ended, e.g. 
+        
+            async for event in monitor.events():
+                print(event["name"], event["status"], event["progress"])
+        
+        The blocking wait runs in the executor, errors of the wait (timeouts, 
+        API errors) are raised at the end of the iteration.
+        
+        '''
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        on_event = lambda event: loop.call_soon_threadsafe(events.put_nowait, event)
+        self.add_callback(on_event)
+        try:
+            waiting = loop.run_in_executor(executor, self.wait, keys)
+            while True:
+                getter = asyncio.ensure_future(events.get())
+                await asyncio.wait([getter, waiting], return_when = asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield getter.result()
+                    continue
+                getter.cancel()
+                break
+            while not events.empty():
+                yield events.get_nowait()
+            await waiting
+        finally:
+            self.remove_callback(on_event)
+
+
+class PedestrianWindComfortBatch():
+    
+    def __init__(self, max_workers = 4):
+        
+        #Batch Variables
+        self.max_workers = max_workers
+        self.base = PedestrianWindComfort()
+        
+        #Design Variables (one PedestrianWindComfort instance per CAD variant)
+        self.designs = {}
+        self.failed_designs = {}
+        self.geometry_stats = {} # preflight statistics by CAD name, copied into the designs
+        
+    def set_api_connection(self, version=0, server='prod'):
+        
+        '''
+        Setup the API connection once, it is shared by all the designs. The 
+        connection pools are sized so that every worker can upload and poll 
+        at the same time without opening extra connections
+        
+        Returns
+        -------
+        None.
+
+        '''
+        self.base.api_pool_size = max(self.base.api_pool_size, 2 * self.max_workers)
+        self.base.storage_pool_size = max(self.base.storage_pool_size, self.max_workers)
+        self.base.set_api_connection(version, server)
+        
+    def use_ledger(self, session, path = None):
+        
+        '''
+        Record the stages of all the designs in a run ledger, see 
+        PedestrianWindComfort.use_ledger, call it before create_project
+        
+        '''
+        self.base.use_ledger(session, path)
+        
+    def create_project(self, name, description, measurement_system = "SI"):
+        
+        '''
+        Create (or reuse) the project that all the designs are uploaded to
+        
+        Returns
+        -------
+        None.
+
+        '''
+        self.base.create_project(name, description, measurement_system)
+        
+    def new_design(self, cad):
+        
+        '''
+        Create an isolated PedestrianWindComfort instance for one CAD variant, 
+        sharing the API connection and project of the batch
+        
+        Parameters
+        ----------
+        cad : str
+            name of the CAD variant, used as key in designs
+
+        Returns
+        -------
+        pwc : PedestrianWindComfort
+        
+        '''
+        pwc = PedestrianWindComfort()
+        pwc.share_api_connection(self.base)
+        pwc.project_id, pwc.project_name = self.base.project_id, self.base.project_name
+        pwc.geometry_stats = self.geometry_stats.get(cad)
+        
+        self.designs[cad] = pwc
+        return pwc
+    
+    def preflight_geometry(self, cad, path, radius=None, center=None, ground_height=None, tolerance=1e-10):
+        
+        '''
+        Run PedestrianWindComfort.preflight_geometry on the geometry of one 
+        CAD variant, its statistics (e.g. the triangle count for the cost 
+        model) are passed on to the design of that CAD
+        
+        Returns
+        -------
+        geometry_stats : dict
+            see analyze_stl
+
+        '''
+        stats = self.base.preflight_geometry(path, radius, center, ground_height, tolerance)
+        self.geometry_stats[cad] = stats
+        if cad in self.designs:
+            self.designs[cad].geometry_stats = stats
+        return stats
+    
+    def _prepare_design(self, cad, pwc, path, setup_simulation, simulation_name, reuse_simulations):
+        
+        pwc.upload_geometry(cad, path)
+        setup_simulation(pwc, cad)
+        pwc.set_simulation_spec(simulation_name = f"{simulation_name} - {cad}")
+        if reuse_simulations:
+            pwc.create_or_reuse_simulation()
+        else:
+            pwc.create_simulation()
+        if pwc.simulation_origin == "created":
+            pwc.check_simulation_setup()
+        return pwc
+    
+    def _start_design(self, cad, pwc, run_name):
+        
+        #The estimate is cached by estimate_designs, this only sets max_runtime
+        pwc.estimate_simulation(max_gpuh = float("inf"))
+        pwc.start_simulation_run(run_name)
+        return pwc
+    
+    def _map_designs(self, function, designs, *args):
+        #Run function(cad, pwc, *args) for every design in parallel, errors go to failed_designs
+        done = {}
+        with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+            futures = {executor.submit(function, cad, pwc, *args) : cad for cad, pwc in designs.items()}
+            for future in as_completed(futures):
+                cad = futures[future]
+                try:
+                    done[cad] = future.result()
+                except Exception as error:
+                    self.failed_designs[cad] = error
+                    print(f"{cad}: failed with {error!r}")
+        return done
+        
+    def prepare_designs(self, cad_names, geometry_paths, setup_simulation, 
+                        simulation_name = "Pedestrian Wind Comfort", reuse_simulations = False):
+        
+        '''
+        Upload, set up, create and check the simulation of every CAD variant, 
+        with up to max_workers designs in flight at the same time, without 
+        starting any run (see run_designs for the parameters)
+        
+        Returns
+        -------
+        designs : dict
+            the PedestrianWindComfort instance of every prepared design
+
+        '''
+        designs = {cad : self.new_design(cad) for cad in cad_names}
+        paths = dict(zip(cad_names, geometry_paths))
+        prepared = self._map_designs(
+            lambda cad, pwc: self._prepare_design(cad, pwc, paths[cad], setup_simulation, 
+                                                  simulation_name, reuse_simulations), designs)
+        for cad, pwc in prepared.items():
+            print(f"{cad}: simulation {pwc.simulation_id} ready")
+        return prepared
+    
+    def start_designs(self, designs, run_name = "Run 1"):
+        
+        '''
+        Start a run for each of the given designs in parallel
+        
+        Parameters
+        ----------
+        designs : list
+            CAD names of the designs to start
+            
+        run_name : str, optional
+            name of the simulation runs
+
+        Returns
+        -------
+        designs : dict
+            the PedestrianWindComfort instance of every started design
+
+        '''
+        started = self._map_designs(self._start_design, 
+                                    {cad : self.designs[cad] for cad in designs}, run_name)
+        for cad, pwc in started.items():
+            print(f"{cad}: simulation {pwc.simulation_id} started with run {pwc.run_id}")
+        return started
+        
+    def run_designs(self, cad_names, geometry_paths, setup_simulation, 
+                    simulation_name = "Pedestrian Wind Comfort", run_name = "Run 1", 
+                    reuse_simulations = False, max_gpuh = 10.0, max_total_gpuh = None):
+        
+        '''
+        Push every CAD variant through upload, setup, creation and check 
+        (prepare_designs), estimate all of them (estimate_designs) and start 
+        the runs of the designs within the budget (start_designs). No run is 
+        started before every design has been estimated.
+        
+        Parameters
+        ----------
+        cad_names : list
+            names of the CAD variants, as passed to upload_geometry
+            
+        geometry_paths : list
+            path of the zipped CAD of each variant (see zip_cad_for_upload)
+            
+        setup_simulation : callable
+            called as setup_simulation(pwc, cad) once the geometry is imported, 
+            it should do the geometry mapping and call the setters of the 
+            region of interest, wind conditions, comfort maps, simulation 
+            control and mesh settings on the given instance
+            
+        simulation_name : str, optional
+            prefix of the simulation names, the CAD name is appended
+            
+        run_name : str, optional
+            name of the simulation runs
+            
+        reuse_simulations : bool, optional
+            start the new runs on existing simulations of the project with the 
+            same setup where possible (see create_or_reuse_simulation), 
+            default is False
+            
+        max_gpuh, max_total_gpuh : float, optional
+            budget of a single simulation and of the whole batch, see 
+            estimate_designs
+
+        Returns
+        -------
+        designs : dict
+            the PedestrianWindComfort instance of each CAD variant, designs 
+            that raised an exception or are over budget are collected in 
+            failed_designs
+
+        '''
+        prepared = self.prepare_designs(cad_names, geometry_paths, setup_simulation, 
+                                        simulation_name, reuse_simulations)
+        ranked = self.estimate_designs(max_gpuh, max_total_gpuh, designs = list(prepared))
+        self.start_designs([cad for cad, _ in ranked if cad not in self.failed_designs], run_name)
+        return self.designs
+    
+    def monitor_runs(self, on_event = None, timeout = None):
+        
+        '''
+        Wait for the runs of all the started designs, reporting their 
+        progress through a RunMonitor on the shared poller
+        
+        The shared poller is rate limited like the poller of a standalone 
+        RunMonitor while the runs are monitored. Designs whose run could not 
+        be polled (timeout, API error) or ended as FAILED or CANCELED are put 
+        in failed_designs.
+        
+        Parameters
+        ----------
+        on_event : callable, optional
+            called with every progress event (see RunMonitor), the default 
+            prints the status and progress of the design
+            
+        timeout : float, optional
+            seconds to wait for each run, the default is its max_runtime
+
+        Returns
+        -------
+        runs : dict
+            last SimulationRun of every design that finished, by CAD name
+
+        '''
+        if on_event is None:
+            on_event = lambda event: print(f"{event['name']}: {event['status']} {event['progress'] or ''}")
+        poller = self.base.poller
+        max_rate = poller.max_rate
+        if max_rate is None:
+            poller.max_rate = RunMonitor.MAX_RATE
+        try:
+            monitor = RunMonitor(poller = poller, on_event = on_event)
+            keys = {cad : monitor.track_design(pwc, timeout) 
+                    for cad, pwc in self.designs.items() if pwc.run_id is not None}
+            runs, errors = monitor.wait_all(list(keys.values()))
+        finally:
+            poller.max_rate = max_rate
+            
+        finished = {}
+        for cad, key in keys.items():
+            if key in errors:
+                self.failed_designs[cad] = errors[key]
+                print(f"{cad}: monitoring the run failed with {errors[key]!r}")
+                continue
+            run = self.designs[cad].simulation_run = runs[key]
+            if run.status == 'FINISHED':
+                finished[cad] = run
+            else:
+                self.failed_designs[cad] = Exception(f"Simulation run {run.status}")
+                print(f"{cad}: simulation run {run.status}")
+        return finished
+    
+    def download_results(self, max_workers = None):
+        
+        '''
+        Download the results of every design whose run is finished into the 
+        local results cache (see PedestrianWindComfort.download_run_results), 
+        the designs are downloaded one after the other, the files of each 
+        design in parallel
+        
+        Returns
+        -------
+        paths : dict
+            local paths of the results of every design, by CAD name
+
+        '''
+        paths = {}
+        for cad, pwc in self.designs.items():
+            if pwc.simulation_run is None or pwc.simulation_run.status != 'FINISHED':
+                continue
+            try:
+                paths[cad] = pwc.download_run_results(max_workers = max_workers)
+            except Exception as error:
+                self.failed_designs[cad] = error
+                print(f"{cad}: result download failed with {error!r}")
+        return paths
+    
+    def estimate_designs(self, max_gpuh = 10.0, max_total_gpuh = None, designs = None):
+        
+        '''
+        Estimate the created simulations of the batch concurrently, rank them 
+        by cost and apply the budget before any run is started
+        
+        Estimates are cached by spec hash (see get_spec_hash), designs that 
+        were estimated before do not cost a server round trip. Designs above 
+        max_gpuh are rejected, the remaining ones are accepted from the 
+        cheapest on as long as the total stays within max_total_gpuh. With a 
+        total budget, designs without an available estimate are rejected as 
+        their cost cannot be accounted for. Rejected designs are put in 
+        failed_designs.
+        
+        Parameters
+        ----------
+        max_gpuh : float, optional
+            maximum GPUh of a single simulation, default is 10
+            
+        max_total_gpuh : float, optional
+            maximum GPUh of the whole batch, not checked by default
+            
+        designs : list, optional
+            CAD names of the designs to estimate, the default is all designs 
+            with a created simulation
+
+        Returns
+        -------
+        estimates : list
+            (cad, estimate) tuples of the accepted designs sorted by estimated 
+            GPUh, designs whose estimate is not available come last
+
+        '''
+        if designs is None:
+            designs = [cad for cad, pwc in self.designs.items() if pwc.simulation_id]
+        designs = {cad : self.designs[cad] for cad in designs if cad not in self.failed_designs}
+        estimates = self._map_designs(lambda cad, pwc: pwc.get_estimate(), designs)
+            
+        def gpuh(estimate):
+            resource = estimate["compute_resource"] if estimate["available"] else None
+            return None if resource is None else resource["value"]
+        ranked = sorted(estimates.items(), key = lambda item: (gpuh(item[1]) is None, gpuh(item[1]) or 0))
+        
+        accepted, total = [], 0.0
+        for cad, estimate in ranked:
+            cost = gpuh(estimate)
+            if cost is not None and cost > max_gpuh:
+                reason = f"Too expensive: {cost} GPUh above {max_gpuh}"
+            elif max_total_gpuh is not None and cost is None:
+                reason = "No estimate available to account for in the batch budget"
+            elif max_total_gpuh is not None and total + cost > max_total_gpuh:
+                reason = f"Over the batch budget: {total + cost} GPUh above {max_total_gpuh}"
+            else:
+                accepted.append((cad, estimate))
+                total += cost or 0
+                continue
+            self.failed_designs[cad] = Exception(reason, estimate)
+            print(f"{cad}: not started, {reason}")
+            
+        print(f"Batch estimate: {len(accepted)} of {len(ranked)} designs accepted, {total} GPUh")
+        return accepted
+
+
+class AsyncPedestrianWindComfort():
+    
+    '''
+    asyncio facade of PedestrianWindComfort
+    
+    API calls run on a thread pool and are awaited. Geometry imports and 
+    simulation runs are waited for on the shared Poller (with its backoff and 
+    429 handling) in the thread pool, several designs waiting at the same 
+    time share one polling loop. The setters that only build the simulation 
+    spec locally are forwarded unchanged and stay synchronous, the other 
+    methods that call the API (BLOCKING_METHODS) are returned as coroutine 
+    functions.
+    
+    Example
+    -------
+    pwc = AsyncPedestrianWindComfort()
+    await pwc.set_api_connection()
+    await pwc.create_project("name", "description")
+    await pwc.upload_geometry("AccucitiesBristol", path)
+    pwc.set_region_of_interest(...)
+    ...
+    await pwc.start_simulation_run("Run 1")
+    await pwc.wait_for_run()
+    
+    '''
+    
+    #Methods that call the API or read whole geometries, awaited on the thread pool
+    BLOCKING_METHODS = ("find_project", "find_geometry", "get_single_entity_name", "get_entity_names", 
+                        "upload_file_to_storage", "cad_archive_for_upload", "fingerprint_geometry", 
+                        "find_existing_geometry", "import_geometry", "get_estimate", "plan_wind_directions")
+    
+    def __init__(self, connection = None, executor = None):
+        
+        #Synchronous workflow holding the state of this project/design
+        self.pwc = PedestrianWindComfort()
+        if connection is not None:
+            self.pwc.share_api_connection(connection.pwc if isinstance(connection, AsyncPedestrianWindComfort) 
+                                          else connection)
+        
+        #Thread pool used for the blocking API calls, None uses the loop default
+        self.executor = executor
+        
+    def __getattr__(self, name):
+        #Everything that is not overridden (setters, variables) comes from the wrapped instance
+        if name == "pwc":
+            raise AttributeError(name)
+        if name in self.BLOCKING_METHODS:
+            return functools.partial(self._call, getattr(self.pwc, name))
+        return getattr(self.pwc, name)
+    
+    async def _call(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+    
+    async def set_api_connection(self, version=0, server='prod'):
+        return await self._call(self.pwc.set_api_connection, version, server)
+    
+    async def create_project(self, name, description, measurement_system = "SI"):
+        return await self._call(self.pwc.create_project, name, description, measurement_system)
+    
+    async def zip_cad_for_upload(self, file_name, base_path):
+        return await self._call(self.pwc.zip_cad_for_upload, file_name, base_path)
+    
+    async def get_geometry_mapping(self, *args, **kwargs):
+        return await self._call(self.pwc.get_geometry_mapping, *args, **kwargs)
+    
+    async def get_layer_mappings(self, project_id, geometry_id, layers):
+        return await self._call(self.pwc.get_layer_mappings, project_id, geometry_id, layers)
+    
+    async def upload_geometry(self, name, path=None, units="m", _format="STL", facet_split=False,
+                              chunk_size=8 * 1024 * 1024, timeout=900):
+        
+        '''
+        Same as PedestrianWindComfort.upload_geometry, the import is awaited 
+        with wait_for_geometry_import
+        
+        '''
+        ledger_inputs, geometry_import_id = await self._call(self.pwc._start_geometry_upload, name, path, units, 
+                                                             _format, facet_split, chunk_size)
+        if geometry_import_id is not None:
+            await self.wait_for_geometry_import(geometry_import_id, timeout)
+        await self._call(self.pwc._finish_geometry_upload, ledger_inputs)
+        
+    async def wait_for_geometry_import(self, geometry_import_id, timeout=900):
+        return await self._call(self.pwc.wait_for_geometry_import, geometry_import_id, timeout)
+        
+    async def set_wind_rose(self):
+        return await self._call(self.pwc.set_wind_rose)
+        
+    async def create_simulation(self, simulation_spec = None):
+        return await self._call(self.pwc.create_simulation, simulation_spec)
+    
+    async def create_or_reuse_simulation(self, simulation_spec = None):
+        return await self._call(self.pwc.create_or_reuse_simulation, simulation_spec)
+    
+    async def check_simulation_setup(self):
+        return await self._call(self.pwc.check_simulation_setup)
+    
+    async def estimate_simulation(self, *args, **kwargs):
+        return await self._call(self.pwc.estimate_simulation, *args, **kwargs)
+    
+    async def start_simulation_run(self, run_name):
+        return await self._call(self.pwc.start_simulation_run, run_name)
+    
+    async def what_if_wind_rose(self, *args, **kwargs):
+        return await self._call(self.pwc.what_if_wind_rose, *args, **kwargs)
+    
+    async def run_missing_wind_directions(self, run_name, simulation_name=None, check_runs=True):
+        return await self._call(self.pwc.run_missing_wind_directions, run_name, simulation_name, check_runs)
+    
+    async def list_run_results(self, project_id=None, simulation_id=None, run_id=None):
+        return await self._call(self.pwc.list_run_results, project_id, simulation_id, run_id)
+    
+    async def download_run_results(self, project_id=None, simulation_id=None, run_id=None, 
+                                   results=None, max_workers=None, verify=True):
+        return await self._call(self.pwc.download_run_results, project_id, simulation_id, run_id, 
+                                results, max_workers, verify)
+    
+    async def wait_for_run(self, timeout=None):
+        return await self._call(self.pwc.wait_for_run, timeout)